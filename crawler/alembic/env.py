@@ -5,8 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from crawler import settings
-from urllib.parse import quote_plus
+from crawler.database import get_engine_url
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -29,16 +28,6 @@ target_metadata = None
 # ... etc.
 
 
-def _get_engine_url():
-    postgres_config = settings.config['postgres']
-    user = quote_plus(postgres_config['user'])
-    password = quote_plus(postgres_config['password'])
-    host = quote_plus(postgres_config['host'])
-    port = quote_plus(postgres_config['port'])
-    database = quote_plus(postgres_config['database'])
-    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
-
-
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -51,7 +40,7 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    url = _get_engine_url()
+    url = get_engine_url()
     context.configure(
         url=url,
         target_metadata=target_metadata,
@@ -71,7 +60,7 @@ def run_migrations_online() -> None:
 
     """
     connectable = create_engine(
-        url=_get_engine_url(),
+        url=get_engine_url(),
         poolclass=pool.NullPool,
         echo=True
     )
@@ -0,0 +1,49 @@
+"""Unique ingredient and measurement unit names
+
+Revision ID: b3c1e8f27a41
+Revises: 6ca5404325f5
+Create Date: 2026-10-18 09:30:12.418207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3c1e8f27a41'
+down_revision: Union[str, None] = '6ca5404325f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _merge_duplicates(table: str, column: str, reference: str):
+    # Point every recipe_ingredient at the lowest id of each name, then drop the rest.
+    op.execute(
+        f"""
+        UPDATE recipe_ingredient
+        SET {reference} = keep.id
+        FROM {table} duplicate
+        JOIN (SELECT {column}, MIN(id) AS id FROM {table} GROUP BY {column}) keep USING ({column})
+        WHERE recipe_ingredient.{reference} = duplicate.id AND duplicate.id <> keep.id
+        """
+    )
+    op.execute(
+        f"""
+        DELETE FROM {table} duplicate
+        USING {table} keep
+        WHERE duplicate.{column} = keep.{column} AND duplicate.id > keep.id
+        """
+    )
+
+
+def upgrade() -> None:
+    _merge_duplicates("ingredient", "canonical_name", "ingredient_id")
+    _merge_duplicates("measurement_unit", "name", "measurement_unit_id")
+    op.create_unique_constraint("ingredient_canonical_name_key", "ingredient", ["canonical_name"])
+    op.create_unique_constraint("measurement_unit_name_key", "measurement_unit", ["name"])
+
+
+def downgrade() -> None:
+    op.drop_constraint("measurement_unit_name_key", "measurement_unit")
+    op.drop_constraint("ingredient_canonical_name_key", "ingredient")
@@ -0,0 +1,32 @@
+"""Pipeline checkpoints
+
+Revision ID: 5d2f90a6c3e8
+Revises: b3c1e8f27a41
+Create Date: 2026-10-18 10:15:40.201553
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2f90a6c3e8'
+down_revision: Union[str, None] = 'b3c1e8f27a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "pipeline_checkpoint",
+        sa.Column("stage", sa.Text, primary_key=True),
+        sa.Column("high_water_id", sa.Integer, nullable=False),
+        sa.Column("updated_at", sa.DateTime, server_default=sqlalchemy.text('NOW()'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('pipeline_checkpoint')
@@ -0,0 +1,42 @@
+"""Unique recipe url
+
+Revision ID: 8a4d6b1f0e27
+Revises: 5d2f90a6c3e8
+Create Date: 2026-10-18 10:40:03.776129
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4d6b1f0e27'
+down_revision: Union[str, None] = '5d2f90a6c3e8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Should there be copies of a recipe, only the first one is kept along with its ingredients.
+    op.execute(
+        """
+        DELETE FROM recipe_ingredient
+        USING recipe duplicate, recipe keep
+        WHERE recipe_ingredient.recipe_id = duplicate.id
+          AND duplicate.url = keep.url
+          AND duplicate.id > keep.id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM recipe duplicate
+        USING recipe keep
+        WHERE duplicate.url = keep.url AND duplicate.id > keep.id
+        """
+    )
+    op.create_unique_constraint("recipe_url_key", "recipe", ["url"])
+
+
+def downgrade() -> None:
+    op.drop_constraint("recipe_url_key", "recipe")
@@ -0,0 +1,38 @@
+"""Parsed ingredients
+
+Revision ID: c71e04d9a2b6
+Revises: 8a4d6b1f0e27
+Create Date: 2026-10-18 11:05:12.448213
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c71e04d9a2b6'
+down_revision: Union[str, None] = '8a4d6b1f0e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "parsed_ingredients",
+        sa.Column(
+            "recipe_id",
+            sa.Integer,
+            sa.ForeignKey("scraped_recipe.id", ondelete="CASCADE"),
+            primary_key=True
+        ),
+        sa.Column("format_version", sa.SmallInteger, nullable=False),
+        sa.Column("data", sa.LargeBinary, nullable=False),
+        sa.Column("updated_at", sa.DateTime, server_default=sqlalchemy.text('NOW()'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('parsed_ingredients')
@@ -0,0 +1,25 @@
+"""Index recipe_ingredient by recipe
+
+Revision ID: e4b9a1c7d352
+Revises: c71e04d9a2b6
+Create Date: 2026-10-18 11:40:03.915128
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b9a1c7d352'
+down_revision: Union[str, None] = 'c71e04d9a2b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_recipe_ingredient_recipe_id", "recipe_ingredient", ["recipe_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_recipe_ingredient_recipe_id", table_name="recipe_ingredient")
@@ -0,0 +1,106 @@
+"""Normalize measurement units
+
+Revision ID: 7f3a5c2e91d8
+Revises: e4b9a1c7d352
+Create Date: 2026-10-18 12:10:47.630912
+
+"""
+import re
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f3a5c2e91d8'
+down_revision: Union[str, None] = 'e4b9a1c7d352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# The unit spellings as of this revision, so what it does doesn't change with lib.units or settings.ini.
+SPELLINGS = {
+    'teaspoon': ('teaspoon', 'teaspoons', 'tsp', 'tsps', 'tsp.', 'tspn', 't', 't.'),
+    'tablespoon': ('tablespoon', 'tablespoons', 'tbsp', 'tbsps', 'tbsp.', 'tbs', 'tbs.', 'tbl', 'tbl.', 'tblsp', 'T', 'T.'),
+    'cup': ('cup', 'cups', 'c', 'c.'),
+    'fluid ounce': ('fluid ounce', 'fluid ounces', 'fl oz', 'fl. oz.', 'fl. oz', 'fl.oz.', 'floz'),
+    'pint': ('pint', 'pints', 'pt', 'pt.', 'pts'),
+    'quart': ('quart', 'quarts', 'qt', 'qt.', 'qts'),
+    'gallon': ('gallon', 'gallons', 'gal', 'gal.'),
+    'milliliter': ('milliliter', 'milliliters', 'millilitre', 'millilitres', 'ml', 'ml.', 'mL'),
+    'liter': ('liter', 'liters', 'litre', 'litres', 'l', 'L'),
+    'milligram': ('milligram', 'milligrams', 'mg', 'mg.'),
+    'gram': ('gram', 'grams', 'g', 'g.', 'gr', 'gr.', 'gm', 'gms'),
+    'kilogram': ('kilogram', 'kilograms', 'kg', 'kg.', 'kgs', 'kilo', 'kilos'),
+    'ounce': ('ounce', 'ounces', 'oz', 'oz.'),
+    'pound': ('pound', 'pounds', 'lb', 'lb.', 'lbs', 'lbs.'),
+    'pinch': ('pinch', 'pinches'),
+    'dash': ('dash', 'dashes'),
+    'drop': ('drop', 'drops'),
+    'clove': ('clove', 'cloves'),
+    'can': ('can', 'cans', 'tin', 'tins'),
+    'jar': ('jar', 'jars'),
+    'package': ('package', 'packages', 'pkg', 'pkg.', 'packet', 'packets', 'pack', 'packs'),
+    'bag': ('bag', 'bags'),
+    'box': ('box', 'boxes'),
+    'stick': ('stick', 'sticks'),
+    'slice': ('slice', 'slices'),
+    'piece': ('piece', 'pieces', 'pc', 'pcs', 'whole'),
+    'bunch': ('bunch', 'bunches'),
+    'sprig': ('sprig', 'sprigs'),
+    'head': ('head', 'heads'),
+    'stalk': ('stalk', 'stalks'),
+    'handful': ('handful', 'handfuls'),
+    'sheet': ('sheet', 'sheets'),
+    'fillet': ('fillet', 'fillets'),
+}
+
+# Single letters where the case is what tells teaspoons and tablespoons apart.
+CASE_SENSITIVE = {"t", "t.", "T", "T."}
+
+ALIASES = dict()
+for canonical, spellings in SPELLINGS.items():
+    ALIASES.setdefault(canonical, canonical)
+    for spelling in spellings:
+        if spelling in CASE_SENSITIVE:
+            ALIASES[spelling] = canonical
+        else:
+            ALIASES.setdefault(spelling.lower(), canonical)
+
+
+def normalize(name: str) -> str:
+    name = re.sub(r"\s+", " ", name.strip())
+    if name in CASE_SENSITIVE:
+        return ALIASES[name]
+    return ALIASES.get(name.lower(), name.lower().rstrip("."))
+
+
+def upgrade() -> None:
+    # Group the spellings of each unit ("tbsp", "Tbs.", "tablespoons"), and keep
+    # the row already named canonically, or else the lowest id of the group.
+    bind = op.get_bind()
+    groups = dict()
+    for unit_id, name in bind.execute(sa.text("SELECT id, name FROM measurement_unit ORDER BY id")):
+        groups.setdefault(normalize(name), []).append((unit_id, name))
+
+    merges, renames = [], []
+    for canonical, rows in groups.items():
+        keep_id, keep_name = next(((unit_id, name) for unit_id, name in rows if name == canonical), rows[0])
+        merges.extend(dict(duplicate=unit_id, keep=keep_id) for unit_id, _ in rows if unit_id != keep_id)
+        if keep_name != canonical:
+            renames.append(dict(id=keep_id, name=canonical))
+
+    if merges:
+        bind.execute(
+            sa.text("UPDATE recipe_ingredient SET measurement_unit_id = :keep WHERE measurement_unit_id = :duplicate"),
+            merges
+        )
+        bind.execute(sa.text("DELETE FROM measurement_unit WHERE id = :duplicate"), merges)
+    if renames:
+        bind.execute(sa.text("UPDATE measurement_unit SET name = :name WHERE id = :id"), renames)
+
+
+def downgrade() -> None:
+    # Merged spellings can't be told apart anymore.
+    pass
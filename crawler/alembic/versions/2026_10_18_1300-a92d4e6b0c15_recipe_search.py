@@ -0,0 +1,100 @@
+"""Recipe search
+
+Revision ID: a92d4e6b0c15
+Revises: 7f3a5c2e91d8
+Create Date: 2026-10-18 13:00:21.508734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a92d4e6b0c15'
+down_revision: Union[str, None] = '7f3a5c2e91d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("ALTER TABLE recipe ADD COLUMN search_vector tsvector")
+
+    # Names weigh the most, then ingredients, then descriptions.
+    op.execute(
+        """
+        CREATE FUNCTION recipe_search_document(recipe_name text, recipe_description text, recipe_id integer)
+        RETURNS tsvector LANGUAGE sql STABLE AS $$
+            SELECT setweight(to_tsvector('english', coalesce(recipe_name, '')), 'A')
+                || setweight(to_tsvector('english', coalesce((
+                       SELECT string_agg(ingredient.canonical_name, ' ')
+                       FROM recipe_ingredient
+                       JOIN ingredient ON ingredient.id = recipe_ingredient.ingredient_id
+                       WHERE recipe_ingredient.recipe_id = $3
+                   ), '')), 'B')
+                || setweight(to_tsvector('english', coalesce(recipe_description, '')), 'C')
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE FUNCTION recipe_search_vector_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.search_vector := recipe_search_document(NEW.name, NEW.description, NEW.id);
+            RETURN NEW;
+        END
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER recipe_search_vector
+        BEFORE INSERT OR UPDATE OF name, description ON recipe
+        FOR EACH ROW EXECUTE FUNCTION recipe_search_vector_trigger()
+        """
+    )
+
+    # Ingredients are rewritten a chunk of recipes at a time, so refresh once per statement.
+    op.execute(
+        """
+        CREATE FUNCTION recipe_ingredient_search_vector_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE recipe
+            SET search_vector = recipe_search_document(recipe.name, recipe.description, recipe.id)
+            WHERE recipe.id IN (SELECT DISTINCT recipe_id FROM changed_rows);
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    for event, transition in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        op.execute(
+            f"""
+            CREATE TRIGGER recipe_ingredient_search_vector_{event.lower()}
+            AFTER {event} ON recipe_ingredient
+            REFERENCING {transition} TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION recipe_ingredient_search_vector_trigger()
+            """
+        )
+
+    op.execute("UPDATE recipe SET search_vector = recipe_search_document(name, description, id)")
+
+    op.execute("CREATE INDEX ix_recipe_search_vector ON recipe USING gin (search_vector)")
+    op.execute("CREATE INDEX ix_recipe_name_trgm ON recipe USING gin (name gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_recipe_description_trgm ON recipe USING gin (description gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_ingredient_canonical_name_trgm ON ingredient USING gin (canonical_name gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX ix_ingredient_canonical_name_trgm")
+    op.execute("DROP INDEX ix_recipe_description_trgm")
+    op.execute("DROP INDEX ix_recipe_name_trgm")
+    op.execute("DROP INDEX ix_recipe_search_vector")
+    for event in ("insert", "update", "delete"):
+        op.execute(f"DROP TRIGGER recipe_ingredient_search_vector_{event} ON recipe_ingredient")
+    op.execute("DROP FUNCTION recipe_ingredient_search_vector_trigger()")
+    op.execute("DROP TRIGGER recipe_search_vector ON recipe")
+    op.execute("DROP FUNCTION recipe_search_vector_trigger()")
+    op.execute("DROP FUNCTION recipe_search_document(text, text, integer)")
+    op.execute("ALTER TABLE recipe DROP COLUMN search_vector")
@@ -0,0 +1,35 @@
+"""Recipe duplicates
+
+Revision ID: 3b8e7d05f6a2
+Revises: a92d4e6b0c15
+Create Date: 2026-10-18 13:40:55.072316
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e7d05f6a2'
+down_revision: Union[str, None] = 'a92d4e6b0c15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "recipe_duplicate",
+        sa.Column("url", sa.Text, primary_key=True),
+        sa.Column("canonical_url", sa.Text, nullable=False),
+        sa.Column("similarity", sa.Float, nullable=False),
+        sa.Column("detected_at", sa.DateTime, server_default=sqlalchemy.text('NOW()'), nullable=False),
+    )
+    op.create_index("ix_recipe_duplicate_canonical_url", "recipe_duplicate", ["canonical_url"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_recipe_duplicate_canonical_url", table_name="recipe_duplicate")
+    op.drop_table('recipe_duplicate')
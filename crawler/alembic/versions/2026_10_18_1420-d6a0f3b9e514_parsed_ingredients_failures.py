@@ -0,0 +1,38 @@
+"""Parsed ingredients failures
+
+Revision ID: d6a0f3b9e514
+Revises: 3b8e7d05f6a2
+Create Date: 2026-10-18 14:20:31.604127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6a0f3b9e514'
+down_revision: Union[str, None] = '3b8e7d05f6a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "parsed_ingredients",
+        sa.Column("failed_attempts", sa.SmallInteger, server_default="0", nullable=False),
+    )
+    op.add_column("parsed_ingredients", sa.Column("retry_after", sa.DateTime, nullable=True))
+    op.create_index(
+        "ix_parsed_ingredients_retry_after",
+        "parsed_ingredients",
+        ["retry_after"],
+        postgresql_where=sa.text("retry_after IS NOT NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_parsed_ingredients_retry_after", table_name="parsed_ingredients")
+    op.drop_column("parsed_ingredients", "retry_after")
+    op.drop_column("parsed_ingredients", "failed_attempts")
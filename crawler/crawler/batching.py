@@ -0,0 +1,66 @@
+import asyncio
+import typing
+
+T = typing.TypeVar('T')
+
+
+class MicroBatcher(typing.Generic[T]):
+    """
+    Groups items submitted by concurrent tasks into batches for `flush`.
+
+    A batch is flushed once it holds `max_size` items or its first item has
+    waited `max_delay` seconds, and only one flush runs at a time. `submit`
+    returns once the batch holding the item has been flushed, and raises
+    whatever the flush raised.
+    """
+
+    def __init__(
+        self,
+        flush: typing.Callable[[typing.List[T]], typing.Awaitable[None]],
+        max_size: int,
+        max_delay: float,
+    ):
+        self.flush = flush
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._items: typing.List[T] = []
+        self._waiters: typing.List[asyncio.Future] = []
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+        self._lock: typing.Optional[asyncio.Lock] = None
+
+    async def submit(self, item: T):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._items.append(item)
+        self._waiters.append(waiter)
+        if len(self._items) >= self.max_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush_now)
+        # The batch is flushed whether or not this submitter is still around.
+        await asyncio.shield(waiter)
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._items:
+            return
+        items, waiters = self._items, self._waiters
+        self._items, self._waiters = [], []
+        asyncio.ensure_future(self._flush(items, waiters))
+
+    async def _flush(self, items: typing.List[T], waiters: typing.List[asyncio.Future]):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                await self.flush(items)
+            except Exception as exc:  # noqa
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(exc)
+            else:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
@@ -0,0 +1,66 @@
+"""
+Encodings of the values of Kafka messages.
+
+Msgpack records start with a two byte header: a marker that can't start a
+JSON document nor valid UTF-8, and the version of the record schema. Records
+without the marker are the JSON ones written before, and are still read.
+"""
+
+import json
+import typing
+
+import msgpack
+
+from crawler import settings
+
+MARKER = 0xC1
+SCHEMA_VERSION = 1
+
+
+class Codec:
+    """
+    Writes records in one format, and reads records in any of them.
+    """
+
+    def encode(self, value: typing.Any) -> bytes:
+        raise NotImplementedError("Should be implemented by subclasses.")
+
+    def decode(self, data: typing.Union[bytes, str]) -> typing.Any:
+        if isinstance(data, str) or not data or data[0] != MARKER:
+            return json.loads(data)
+        if len(data) < 2 or data[1] > SCHEMA_VERSION:
+            raise ValueError(f"Unknown message schema version: {data[1:2]!r}")
+        return msgpack.unpackb(memoryview(data)[2:], raw=False)
+
+
+class JsonCodec(Codec):
+
+    def encode(self, value: typing.Any) -> bytes:
+        return json.dumps(value).encode('utf-8')
+
+
+class MsgpackCodec(Codec):
+
+    _header = bytes((MARKER, SCHEMA_VERSION))
+
+    def encode(self, value: typing.Any) -> bytes:
+        return self._header + msgpack.packb(value, use_bin_type=True)
+
+
+CODECS: typing.Dict[str, typing.Type[Codec]] = {
+    "json": JsonCodec,
+    "msgpack": MsgpackCodec,
+}
+
+
+def codec_from_settings() -> Codec:
+    """
+    The codec named by `[message-codec] format`. Both read either format,
+    so switching to msgpack only needs every consumer upgraded first. That
+    is also when `[kafka-producer] compression_type = zstd` can be turned
+    on, as older consumers can't decompress zstd batches either.
+    """
+    name = settings.config.get("message-codec", "format", fallback="json")
+    if name not in CODECS:
+        raise ValueError(f"Unknown message codec: {name!r}")
+    return CODECS[name]()
@@ -0,0 +1,62 @@
+import typing
+from urllib.parse import quote_plus
+
+import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from crawler import settings
+
+
+def get_engine_url(driver: str = "psycopg2") -> str:
+    postgres_config = settings.config["postgres"]
+    user = quote_plus(postgres_config["user"])
+    password = quote_plus(postgres_config["password"])
+    host = quote_plus(postgres_config["host"])
+    port = quote_plus(postgres_config["port"])
+    database = quote_plus(postgres_config["database"])
+    return f"postgresql+{driver}://{user}:{password}@{host}:{port}/{database}"
+
+
+def get_pool_options() -> typing.Dict[str, typing.Any]:
+    postgres_config = settings.config["postgres"]
+    return {
+        "pool_size": postgres_config.getint("pool_size", fallback=5),
+        "max_overflow": postgres_config.getint("max_overflow", fallback=5),
+        "pool_timeout": postgres_config.getfloat("pool_timeout", fallback=30),
+        "pool_recycle": postgres_config.getint("pool_recycle", fallback=1800),
+        # Connections are checked before being handed out, so a restarted
+        # server doesn't surface as errors in whoever gets a stale one.
+        "pool_pre_ping": True,
+    }
+
+
+_async_engine: typing.Optional[AsyncEngine] = None
+
+
+def get_async_engine() -> AsyncEngine:
+    """
+    The asyncpg engine shared by everything in this process.
+    """
+    global _async_engine
+    if _async_engine is None:
+        statement_cache_size = settings.config["postgres"].getint("statement_cache_size", fallback=500)
+        _async_engine = create_async_engine(
+            f"{get_engine_url('asyncpg')}?prepared_statement_cache_size={statement_cache_size}",
+            echo=False,
+            **get_pool_options(),
+        )
+    return _async_engine
+
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    return async_sessionmaker(get_async_engine(), expire_on_commit=False)
+
+
+async def health_check(engine: AsyncEngine) -> bool:
+    try:
+        async with engine.connect() as connection:
+            await connection.execute(sqlalchemy.text("SELECT 1"))
+    except (sqlalchemy.exc.SQLAlchemyError, OSError):
+        return False
+    return True
@@ -0,0 +1,93 @@
+import hashlib
+import math
+import time
+import typing
+
+import redis.asyncio
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str) -> typing.Iterator[int]:
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class VisitedLinks:
+    """
+    Remembers which URLs were crawled in the last `period` seconds.
+
+    Redis holds the source of truth in `visited__{url}` keys. A local Bloom
+    filter of URLs already known to be marked sits in front of it so most
+    repeated links never leave the process. The filter is rebuilt every
+    `rebuild_interval` seconds (or once it is full) so that links whose keys
+    expired in Redis are crawled again, at most that much later.
+    """
+
+    def __init__(
+        self,
+        cache: redis.asyncio.Redis,
+        period: int,
+        bloom_capacity: int,
+        bloom_error_rate: float,
+        rebuild_interval: float,
+    ):
+        self.cache = cache
+        self.period = period
+        self.rebuild_interval = rebuild_interval
+        self._seen = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._built_at = time.monotonic()
+
+    @staticmethod
+    def key(url: str) -> str:
+        return f"visited__{url}"
+
+    def _maybe_rebuild(self):
+        if time.monotonic() - self._built_at < self.rebuild_interval and self._seen.count < self._seen.capacity:
+            return
+        self._seen.clear()
+        self._built_at = time.monotonic()
+
+    async def mark_visited(self, urls: typing.Iterable[str]) -> typing.List[str]:
+        """
+        Mark `urls` as visited and return the ones that had not been visited
+        recently, in their original order.
+        """
+        self._maybe_rebuild()
+        candidates = [url for url in dict.fromkeys(urls) if url not in self._seen]
+        if not candidates:
+            return []
+
+        async with self.cache.pipeline(transaction=False) as pipe:
+            for url in candidates:
+                pipe.set(self.key(url), 1, ex=self.period, nx=True)
+            created = await pipe.execute()
+
+        unvisited = []
+        for url, was_created in zip(candidates, created):
+            self._seen.add(url)
+            if was_created:
+                unvisited.append(url)
+        return unvisited
@@ -0,0 +1,88 @@
+import dataclasses
+import html.parser
+import json
+import typing
+
+LD_JSON_TYPE = "application/ld+json"
+RECIPE_TYPE = "Recipe"
+
+
+@dataclasses.dataclass
+class Page:
+    hrefs: typing.List[str] = dataclasses.field(default_factory=list)
+    ld_json: typing.List[str] = dataclasses.field(default_factory=list)
+    has_recipe_microdata: bool = False
+
+
+class _PageExtractor(html.parser.HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.page = Page()
+        self._ld_json: typing.Optional[typing.List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            for name, value in attrs:
+                if name == "href" and value:
+                    self.page.hrefs.append(value)
+        elif tag == "script":
+            for name, value in attrs:
+                if name == "type" and value and value.strip().lower() == LD_JSON_TYPE:
+                    self._ld_json = []
+        for name, value in attrs:
+            if name == "itemtype" and value and value.rstrip("/").endswith(RECIPE_TYPE):
+                self.page.has_recipe_microdata = True
+
+    def handle_data(self, data):
+        if self._ld_json is not None:
+            self._ld_json.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self._ld_json is not None:
+            self.page.ld_json.append("".join(self._ld_json))
+            self._ld_json = None
+
+
+def extract_page(document: str) -> Page:
+    """
+    Collect the anchors, `application/ld+json` blocks and recipe microdata
+    markers of an HTML document in a single streaming pass.
+    """
+    extractor = _PageExtractor()
+    extractor.feed(document)
+    extractor.close()
+    return extractor.page
+
+
+def _is_recipe_type(value: typing.Any) -> bool:
+    # "Recipe", "schema:Recipe" and "https://schema.org/Recipe" are all seen in the wild.
+    return isinstance(value, str) and value.rsplit("/", 1)[-1].rsplit(":", 1)[-1] == RECIPE_TYPE
+
+
+def _is_recipe(node: typing.Any) -> bool:
+    if isinstance(node, list):
+        return any(_is_recipe(child) for child in node)
+    if not isinstance(node, dict):
+        return False
+    types = node.get("@type")
+    if isinstance(types, list):
+        if any(_is_recipe_type(value) for value in types):
+            return True
+    elif _is_recipe_type(types):
+        return True
+    return _is_recipe(node.get("@graph"))
+
+
+def has_recipe_schema(page: Page) -> bool:
+    if page.has_recipe_microdata:
+        return True
+    for block in page.ld_json:
+        if RECIPE_TYPE not in block:
+            continue
+        try:
+            if _is_recipe(json.loads(block)):
+                return True
+        except ValueError:
+            continue
+    return False
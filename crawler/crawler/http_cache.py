@@ -0,0 +1,136 @@
+import asyncio
+import dataclasses
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+import typing
+
+import structlog
+
+logger = structlog.getLogger()
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    url: str
+    etag: typing.Optional[str]
+    last_modified: typing.Optional[str]
+    # Length of the body when it was stored, i.e. what a 304 saves.
+    size: int
+
+    def conditional_headers(self) -> typing.Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    Validators of crawled pages, so re-crawls can be conditional.
+
+    Only the `ETag` and `Last-Modified` of every canonical URL are kept, in
+    an sqlite index in `directory`: a 304 means the page, and so its recipe
+    and links, haven't changed since they were sent on, so its body is
+    never needed again. Past `max_entries` URLs, the least recently used
+    ones are dropped.
+    """
+
+    def __init__(self, directory: typing.Union[str, pathlib.Path], max_entries: int):
+        self.directory = pathlib.Path(directory)
+        self.max_entries = max_entries
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.directory / "index.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS validators_accessed_at ON validators (accessed_at)")
+        self._db.commit()
+        self._entries = self._db.execute("SELECT COUNT(*) FROM validators").fetchone()[0]
+
+    def _lookup(self, url: str) -> typing.Optional[CachedResponse]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, etag, last_modified, size FROM validators WHERE url = ?",
+                (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(*row)
+
+    def _touch(self, url: str):
+        with self._lock:
+            self._db.execute("UPDATE validators SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+
+    def _store(self, url: str, etag: typing.Optional[str], last_modified: typing.Optional[str], size: int):
+        with self._lock:
+            exists = self._db.execute("SELECT 1 FROM validators WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, size, time.time())
+            )
+            if exists is None:
+                self._entries += 1
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        excess = self._entries - self.max_entries
+        if excess <= 0:
+            return
+        self._db.execute(
+            "DELETE FROM validators WHERE url IN (SELECT url FROM validators ORDER BY accessed_at LIMIT ?)",
+            (excess,)
+        )
+        self._entries -= excess
+        logger.debug("Evicted from http cache.", entries=self._entries)
+
+    async def lookup(self, url: str) -> typing.Optional[CachedResponse]:
+        return await asyncio.to_thread(self._lookup, url)
+
+    async def touch(self, url: str):
+        await asyncio.to_thread(self._touch, url)
+
+    async def store(self, url: str, etag: typing.Optional[str], last_modified: typing.Optional[str], size: int):
+        if not etag and not last_modified:
+            # Nothing to make the next request conditional on.
+            return
+        await asyncio.to_thread(self._store, url, etag, last_modified, size)
+
+
+def drop_legacy_entries(directory: typing.Union[str, pathlib.Path]) -> bool:
+    """
+    Delete the bodies and index table that caches from before only
+    validators were kept stored in `directory`. Returns whether there
+    were any.
+    """
+    directory = pathlib.Path(directory)
+    objects = directory / "objects"
+    found = objects.exists()
+    shutil.rmtree(objects, ignore_errors=True)
+    index = directory / "index.sqlite3"
+    if index.exists():
+        db = sqlite3.connect(str(index))
+        try:
+            entries = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries'").fetchone()
+            found = found or entries is not None
+            db.execute("DROP TABLE IF EXISTS entries")
+            db.commit()
+            db.execute("VACUUM")
+        finally:
+            db.close()
+    return found
@@ -4,12 +4,34 @@ import msgpack
 import pydantic
 import typing
 
+from crawler.urls import canonicalize_url
 
-class Link(pydantic.BaseModel):
-    url: str
-    metadata: typing.Optional[typing.Dict[str, typing.Any]] = None
 
-    _hostname: typing.Optional[str] = None
+class Link:
+    """
+    A link to crawl, as sent on the 'links' topic. A plain class rather
+    than a pydantic model since one is built for every message.
+    """
+
+    __slots__ = ("url", "metadata", "_hostname", "_canonical_url")
+
+    def __init__(self, url: str, metadata: typing.Optional[typing.Dict[str, typing.Any]] = None):
+        if not isinstance(url, str):
+            raise ValueError(f"Link url must be a string, got {url!r}")
+        if metadata is not None and not isinstance(metadata, dict):
+            raise ValueError(f"Link metadata must be a dict, got {metadata!r}")
+        self.url = url
+        self.metadata = metadata
+        self._hostname: typing.Optional[str] = None
+        self._canonical_url: typing.Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"Link(url={self.url!r}, metadata={self.metadata!r})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Link):
+            return NotImplemented
+        return self.url == other.url and self.metadata == other.metadata
 
     @property
     def hostname(self) -> str:
@@ -17,6 +39,21 @@ class Link(pydantic.BaseModel):
             self._hostname = urllib.parse.urlparse(self.url).hostname or 'unknown'
         return self._hostname
 
+    @property
+    def canonical_url(self) -> str:
+        if self._canonical_url is None:
+            self._canonical_url = canonicalize_url(self.url)
+        return self._canonical_url
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {"url": self.url, "metadata": self.metadata}
+
+    @classmethod
+    def from_dict(cls, value: typing.Any) -> "Link":
+        if not isinstance(value, dict):
+            raise ValueError(f"Expected a link, got {value!r}")
+        return cls(value.get("url"), value.get("metadata"))
+
 
 class CrawlResult(pydantic.BaseModel):
     url: str
@@ -24,6 +61,8 @@ class CrawlResult(pydantic.BaseModel):
     contents: typing.Optional[bytes] = None
     status_code: typing.Optional[int] = None
     timestamp: typing.Optional[str] = None
+    etag: typing.Optional[str] = None
+    last_modified: typing.Optional[str] = None
     _hostname: typing.Optional[str] = None
 
     @property
@@ -0,0 +1,118 @@
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import dataclasses
+import threading
+import typing
+import urllib.parse
+
+import recipe_scrapers
+import structlog
+
+from crawler.extract import extract_page, has_recipe_schema
+
+logger = structlog.getLogger()
+
+
+@dataclasses.dataclass
+class ParsedDocument:
+    recipe: typing.Optional[typing.Dict[str, typing.Any]] = None
+    links: typing.List[str] = dataclasses.field(default_factory=list)
+    error: typing.Optional[str] = None
+
+
+def parse_document(url: str, contents: bytes) -> ParsedDocument:
+    """
+    Scrape the recipe out of a crawled page along with the absolute URLs
+    of its anchors.
+
+    The page is first scanned once for anchors and schema.org markup, and
+    only handed to `recipe_scrapers` if it declares a Recipe. Runs in a
+    worker process, so it only takes and returns picklable values.
+    """
+    try:
+        html = contents.decode('utf-8')
+    except UnicodeError:
+        return ParsedDocument(error="invalid_utf8")
+
+    page = extract_page(html)
+    if not has_recipe_schema(page):
+        return ParsedDocument(error="No Recipe schema found on the page.")
+    try:
+        recipe = recipe_scrapers.scrape_html(html).to_json()
+    except recipe_scrapers.NoSchemaFoundInWildMode as exc:
+        return ParsedDocument(error=exc.message)
+
+    links = [urllib.parse.urljoin(url, href) for href in page.hrefs]
+    return ParsedDocument(recipe=recipe, links=links)
+
+
+class DocumentParser:
+    """
+    Runs `parse_document` in a pool of worker processes so that parsing
+    never holds up the event loop.
+
+    A document that takes longer than `timeout` seconds is given up on. Its
+    worker cannot be interrupted, so it stays busy until the parse finishes.
+    After `max_timeouts` of them in a row the pool is replaced by a fresh
+    one, and the old one is left to wind down once its workers are done.
+
+    A worker that dies, e.g. killed for running out of memory, breaks the
+    whole pool. It is then replaced too, and the document tried once more
+    before it is given up on as "worker_crashed".
+    """
+
+    def __init__(self, workers: int, timeout: float, max_timeouts: int = 3):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_timeouts = max_timeouts
+        self.executor = self._create_executor()
+        self._timeouts = 0
+        self._lock = threading.Lock()
+
+    def _create_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+    def _replace(self, executor: concurrent.futures.ProcessPoolExecutor):
+        with self._lock:
+            # Whoever noticed first already replaced it.
+            if self.executor is not executor:
+                return
+            self.executor = self._create_executor()
+            self._timeouts = 0
+        # Parses already handed to it still finish, or fail if it broke.
+        executor.shutdown(wait=False)
+
+    async def _parse_once(self, url: str, contents: bytes) -> ParsedDocument:
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            document = await asyncio.wait_for(
+                loop.run_in_executor(executor, parse_document, url, contents),
+                timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            if self._timeouts >= self.max_timeouts:
+                logger.warning("Parses keep timing out, replacing the worker pool.", timeouts=self._timeouts)
+                self._replace(executor)
+            raise
+        except concurrent.futures.process.BrokenProcessPool:
+            self._replace(executor)
+            raise
+        self._timeouts = 0
+        return document
+
+    async def parse(self, url: str, contents: bytes) -> ParsedDocument:
+        try:
+            return await self._parse_once(url, contents)
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.warning("A parser worker died, retrying with a new pool.", url=url)
+        try:
+            return await self._parse_once(url, contents)
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.error("A parser worker died twice on the same document.", url=url)
+            return ParsedDocument(error="worker_crashed")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
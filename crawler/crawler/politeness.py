@@ -0,0 +1,233 @@
+import asyncio
+import collections
+import datetime
+import email.utils
+import time
+import typing
+
+import structlog
+
+logger = structlog.getLogger()
+
+T = typing.TypeVar('T')
+
+THROTTLING_STATUS_CODES = {429, 503}
+
+
+def parse_retry_after(value: typing.Optional[str]) -> typing.Optional[float]:
+    """
+    Seconds to wait according to a `Retry-After` header, which is
+    either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float, clock: typing.Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_consume(self, tokens: float = 1.0) -> float:
+        """
+        Take `tokens` out of the bucket if they are available and return 0,
+        otherwise leave the bucket alone and return the seconds until they will be.
+        """
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def consume(self, tokens: float = 1.0):
+        while True:
+            delay = self.try_consume(tokens)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+class _HostState:
+
+    def __init__(self, rate: float, burst: float):
+        self.pending: typing.Deque[typing.Any] = collections.deque()
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+
+
+class HostScheduler(typing.Generic[T]):
+    """
+    A work queue that hands out items round-robin across hosts.
+
+    Every host has a token bucket refilled at `rate` requests per second and
+    at most `max_concurrency` items handed out at a time. Whoever takes an
+    item out with `get` has to call `release` for its host once the request
+    is done, which is also where the rate backs off on throttling responses
+    and slowly recovers on successful ones.
+
+    Hosts with nothing to do are kept until their bucket has refilled and
+    their rate recovered, so links trickling in one at a time for a host
+    can't each start it over with a full burst.
+
+    Every host counts towards `qsize` with at most `max_pending_per_host`
+    of its items, so a host that is throttled or slow can't fill the
+    consumer's `max_pending` on its own and stall the others. Once
+    `max_size` items are held in all, `qsize` is that total instead.
+    """
+
+    # Idle hosts looked at for eviction every time an item is put.
+    EVICTION_SCAN = 8
+
+    def __init__(
+        self,
+        key: typing.Callable[[T], str],
+        rate: float,
+        burst: float,
+        max_concurrency: int,
+        min_rate: float,
+        max_pending_per_host: int,
+        max_size: int,
+        stats=None,
+    ):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.max_pending_per_host = max_pending_per_host
+        self.max_size = max_size
+        self.stats = stats
+        self._hosts: typing.Dict[str, _HostState] = dict()
+        self._ready: typing.Deque[str] = collections.deque()
+        # Hosts with nothing pending or in flight, oldest idle first.
+        self._idle: typing.OrderedDict[str, None] = collections.OrderedDict()
+        self._size = 0
+        # The items that count towards qsize, at most max_pending_per_host a host.
+        self._counted = 0
+        self._changed = asyncio.Event()
+
+    def qsize(self) -> int:
+        if self._size >= self.max_size:
+            return self._size
+        return self._counted
+
+    def _host(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(self.rate, self.burst)
+            self._hosts[host] = state
+        return state
+
+    def _report_depth(self, host: str, state: _HostState):
+        if self.stats is not None:
+            self.stats.gauge(f'host_queue_depth,hostname={host}', len(state.pending))
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for _ in range(min(self.EVICTION_SCAN, len(self._idle))):
+            host, _ = self._idle.popitem(last=False)
+            state = self._hosts[host]
+            if state.blocked_until <= now and state.bucket.rate >= self.rate and state.bucket.is_full():
+                del self._hosts[host]
+            else:
+                self._idle[host] = None
+
+    def put_nowait(self, item: T):
+        host = self.key(item)
+        self._idle.pop(host, None)
+        self._evict_idle()
+        state = self._host(host)
+        if not state.pending:
+            self._ready.append(host)
+        if len(state.pending) < self.max_pending_per_host:
+            self._counted += 1
+        state.pending.append(item)
+        self._size += 1
+        self._report_depth(host, state)
+        self._changed.set()
+
+    def _pop(self) -> typing.Tuple[typing.Optional[T], typing.Optional[float]]:
+        now = time.monotonic()
+        wait = None
+        for _ in range(len(self._ready)):
+            host = self._ready[0]
+            self._ready.rotate(-1)
+            state = self._hosts[host]
+            if state.in_flight >= self.max_concurrency:
+                continue
+            if state.blocked_until > now:
+                delay = state.blocked_until - now
+            else:
+                delay = state.bucket.try_consume()
+            if delay:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            if len(state.pending) <= self.max_pending_per_host:
+                self._counted -= 1
+            item = state.pending.popleft()
+            state.in_flight += 1
+            self._size -= 1
+            if not state.pending:
+                # Rotated to the back just above.
+                self._ready.pop()
+            self._report_depth(host, state)
+            return item, None
+        return None, wait
+
+    async def get(self) -> T:
+        while True:
+            item, wait = self._pop()
+            if item is not None:
+                return item
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, host: str, status_code: typing.Optional[int] = None, retry_after: typing.Optional[str] = None):
+        state = self._hosts.get(host)
+        if state is None:
+            return
+        state.in_flight -= 1
+        bucket = state.bucket
+        if status_code in THROTTLING_STATUS_CODES:
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = 1 / bucket.rate
+            state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+            logger.warning("Host is throttling us, slowing down.", hostname=host, rate=bucket.rate, delay=delay)
+            if self.stats is not None:
+                self.stats.incr(f'throttled_crawls,status={status_code},hostname={host}')
+        elif status_code is not None and status_code < 400 and bucket.rate < self.rate:
+            bucket.rate = min(self.rate, bucket.rate + self.rate / 20)
+
+        if not state.pending and not state.in_flight:
+            self._idle[host] = None
+        self._changed.set()
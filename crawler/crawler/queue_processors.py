@@ -2,18 +2,55 @@ import typing
 import abc
 import aiokafka
 import kafka.errors
-import msgpack
-import json
 import structlog
 import asyncio
 import redis
+import redis.asyncio
+from sqlalchemy.ext.asyncio import AsyncEngine
 from crawler import settings
+from crawler.codecs import Codec, codec_from_settings
+from crawler.database import get_async_engine
 
 logger = structlog.getLogger()
 
 T = typing.TypeVar('T')
 
 
+class WorkItem(typing.NamedTuple):
+    partition: aiokafka.TopicPartition
+    offset: int
+    message: typing.Any
+
+
+class _PartitionOffsets:
+    """
+    Tracks the offsets of a partition that are still being worked on.
+
+    Messages finish out of order, so the offset that is safe to commit
+    is the lowest one still in flight, or one past the highest offset
+    seen once everything has finished.
+    """
+
+    def __init__(self):
+        self.in_flight: typing.Set[int] = set()
+        self.next_offset: typing.Optional[int] = None
+        self.committed: typing.Optional[int] = None
+
+    def start(self, offset: int):
+        self.in_flight.add(offset)
+        if self.next_offset is None or offset >= self.next_offset:
+            self.next_offset = offset + 1
+
+    def finish(self, offset: int):
+        self.in_flight.discard(offset)
+
+    def committable(self) -> typing.Optional[int]:
+        offset = min(self.in_flight) if self.in_flight else self.next_offset
+        if offset is None or offset == self.committed:
+            return None
+        return offset
+
+
 class QueueProcessor:
 
     read_topic: str
@@ -23,6 +60,15 @@ class QueueProcessor:
     kafka_consumer_config: typing.Optional[typing.Dict[str, str]] = None
     redis_config: typing.Optional[typing.Dict[str, typing.Any]] = None
     cache: typing.Optional[redis.Redis] = None
+    async_cache: typing.Optional[redis.asyncio.Redis] = None
+    # Writes the values of produced messages, and reads consumed ones in any format.
+    codec: typing.Optional[Codec] = None
+
+    # Number of messages processed concurrently, and how many decoded messages
+    # may wait for a worker before the consumer is paused.
+    concurrency: typing.Optional[int] = None
+    max_pending: typing.Optional[int] = None
+    commit_interval: typing.Optional[float] = None
 
     _consumer: typing.Optional[aiokafka.AIOKafkaConsumer] = None
     _producer: typing.Optional[aiokafka.AIOKafkaProducer] = None
@@ -37,7 +83,7 @@ class QueueProcessor:
         if "kafka-producer" in settings.config:
             base_producer_config = {**settings.config["kafka-producer"]}
 
-        int_overrides = {"max_request_size"}
+        int_overrides = {"max_request_size", "linger_ms", "max_batch_size"}
 
         for key in int_overrides:
             if key in base_consumer_config:
@@ -45,6 +91,9 @@ class QueueProcessor:
             if key in base_producer_config:
                 base_producer_config[key] = int(base_producer_config[key])
 
+        # Offsets are committed by us once the work for a message has finished.
+        base_consumer_config.setdefault("enable_auto_commit", False)
+
         self.kafka_consumer_config = base_consumer_config
         self.kafka_producer_config = base_producer_config
         if self.kafka_config:
@@ -52,6 +101,21 @@ class QueueProcessor:
         self.kafka_config = base_kafka_config
         self.redis_config = {**settings.config["redis"]}
         self.cache = redis.Redis(**self.redis_config)
+        self.async_cache = redis.asyncio.Redis(**self.redis_config)
+
+        if self.codec is None:
+            self.codec = codec_from_settings()
+        if self.concurrency is None:
+            self.concurrency = settings.config.getint("queue-processor", "concurrency", fallback=16)
+        if self.max_pending is None:
+            self.max_pending = settings.config.getint("queue-processor", "max_pending", fallback=64)
+        if self.commit_interval is None:
+            self.commit_interval = settings.config.getfloat("queue-processor", "commit_interval", fallback=5.0)
+
+        self._offsets: typing.Dict[aiokafka.TopicPartition, _PartitionOffsets] = dict()
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._room_available: typing.Optional[asyncio.Event] = None
+        self._paused = False
 
     @property
     def consumer(self) -> aiokafka.AIOKafkaConsumer:
@@ -72,6 +136,10 @@ class QueueProcessor:
             )
         return self._consumer
 
+    @property
+    def database(self) -> AsyncEngine:
+        return get_async_engine()
+
     @property
     def producer(self) -> aiokafka.AIOKafkaProducer:
         if self._producer is None:
@@ -86,7 +154,14 @@ class QueueProcessor:
         return self._producer
 
     def decode_message(self, message: typing.Any) -> T:
-        raise NotImplementedError("Should be implemented by subclasses.")
+        return self.codec.decode(message)
+
+    async def send(self, topic: str, value: typing.Any) -> asyncio.Future:
+        """
+        Queue `value` for `topic`. The returned future resolves once the
+        broker has it, or raises if it couldn't be delivered.
+        """
+        return await self.producer.send(topic, self.codec.encode(value))
 
     async def process_message(self, message: T):
         raise NotImplementedError("Should be implemented by subclasses.")
@@ -107,18 +182,126 @@ class QueueProcessor:
             logger.exception("kafka error", exception=exc)
             await self.producer.stop()
 
+    def create_work_queue(self) -> asyncio.Queue:
+        """
+        The queue that decoded messages wait in for a free worker.
+
+        Subclasses may return any object with the `put_nowait`, `get` and
+        `qsize` methods of an `asyncio.Queue` to change the order in which
+        messages are processed. The consumer stops reading while `qsize`
+        is at least `max_pending`, so a queue may leave items out of it to
+        keep reading past them.
+        """
+        return asyncio.Queue()
+
+    def _pause(self):
+        if self._paused:
+            return
+        partitions = self.consumer.assignment()
+        self.consumer.pause(*partitions)
+        self._paused = True
+        logger.debug("Work queue is full, pausing consumer.", pending=self._queue.qsize())
+
+    def _resume(self):
+        if not self._paused:
+            return
+        self.consumer.resume(*self.consumer.paused())
+        self._paused = False
+        logger.debug("Resuming consumer.", pending=self._queue.qsize())
+
+    async def _consume(self):
+        logger.debug("Listening for messages...")
+        while True:
+            if self._queue.qsize() >= self.max_pending:
+                self._pause()
+                self._room_available.clear()
+                try:
+                    await asyncio.wait_for(self._room_available.wait(), timeout=self.commit_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._resume()
+
+            batch = await self.consumer.getmany(
+                timeout_ms=1000,
+                max_records=self.max_pending - self._queue.qsize()
+            )
+            for partition, records in batch.items():
+                for msg in records:
+                    msg: aiokafka.ConsumerRecord = msg
+                    logger.debug("Message received:", message=msg)
+                    message_decoded = self.decode_message(msg.value)
+                    if partition not in self._offsets:
+                        self._offsets[partition] = _PartitionOffsets()
+                    self._offsets[partition].start(msg.offset)
+                    self._queue.put_nowait(WorkItem(partition, msg.offset, message_decoded))
+
+    async def _work(self):
+        while True:
+            item: WorkItem = await self._queue.get()
+            if self._queue.qsize() <= self.max_pending // 2:
+                self._room_available.set()
+            try:
+                await self.process_message(item.message)
+            except asyncio.CancelledError:
+                # Unfinished work must not be committed.
+                raise
+            except Exception as exc:  # noqa
+                logger.exception(
+                    "Failed to process message",
+                    exception=exc,
+                    partition=item.partition,
+                    offset=item.offset
+                )
+            offsets = self._offsets.get(item.partition)
+            if offsets is not None:
+                offsets.finish(item.offset)
+
+    async def commit_offsets(self):
+        if self.group_id is None:
+            return
+        assignment = self.consumer.assignment()
+        to_commit = dict()
+        for partition, offsets in list(self._offsets.items()):
+            if partition not in assignment:
+                # Revoked in a rebalance, whoever owns it now commits for it.
+                del self._offsets[partition]
+                continue
+            offset = offsets.committable()
+            if offset is not None:
+                to_commit[partition] = offset
+        if not to_commit:
+            return
+        try:
+            await self.consumer.commit(to_commit)
+        except kafka.errors.KafkaError as exc:
+            logger.warning("Failed to commit offsets", exception=exc, offsets=to_commit)
+            return
+        for partition, offset in to_commit.items():
+            if partition in self._offsets:
+                self._offsets[partition].committed = offset
+
+    async def _commit_periodically(self):
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            await self.commit_offsets()
+
     async def run(self):
         await self.setup_consumer()
         await self.setup_producer()
+        self._queue = self.create_work_queue()
+        self._room_available = asyncio.Event()
+        tasks = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+        tasks.append(asyncio.ensure_future(self._commit_periodically()))
         try:
-            logger.debug("Listening for messages...")
-            async for msg in self.consumer:
-                msg: aiokafka.ConsumerRecord = msg
-                message_decoded = self.decode_message(msg.value)
-                logger.debug("Message received:", message=msg)
-                asyncio.ensure_future(self.process_message(message_decoded))
-                logger.debug("waiting for next message")
+            await self._consume()
         finally:
-            logger.debug("awaiting consumer.stop()")
-            await self.consumer.stop()
-            await self.producer.stop()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                await self.commit_offsets()
+            finally:
+                logger.debug("awaiting consumer.stop()")
+                await self.consumer.stop()
+                await self.producer.stop()
@@ -0,0 +1,176 @@
+import asyncio
+import dataclasses
+import datetime
+import time
+import typing
+import uuid
+
+import redis.asyncio
+import structlog
+
+from crawler import settings
+from crawler.politeness import TokenBucket
+
+logger = structlog.get_logger()
+
+
+@dataclasses.dataclass(frozen=True)
+class TTLRule:
+    """
+    Keys matching `pattern` should expire after `ttl`. With `only_persistent`
+    only keys without any expiry are touched, otherwise the expiry of every
+    matching key is pushed out to `ttl` from now, which swept periodically
+    means they never expire.
+    """
+    pattern: str
+    ttl: datetime.timedelta
+    only_persistent: bool = True
+
+
+@dataclasses.dataclass
+class TTLReport:
+    pattern: str
+    scanned: int = 0
+    updated: int = 0
+
+
+def ttl_rules_from_settings() -> typing.List[TTLRule]:
+    """
+    One rule per `[ttl:<pattern>]` section, e.g.
+
+        [ttl:visited__*]
+        ttl = 604800
+        only_persistent = true
+
+    where `only_persistent` defaults to true.
+    """
+    rules = []
+    for section in settings.config.sections():
+        if not section.startswith("ttl:"):
+            continue
+        rules.append(TTLRule(
+            pattern=section[len("ttl:"):],
+            ttl=datetime.timedelta(seconds=settings.config.getint(section, "ttl")),
+            only_persistent=settings.config.getboolean(section, "only_persistent", fallback=True),
+        ))
+    return rules
+
+
+class LockLost(Exception):
+    pass
+
+
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class TTLManager:
+    """
+    Applies `TTLRule`s by walking the keyspace with SCAN, `chunk_size` keys
+    at a time, and setting expiries through one non-transactional pipeline
+    per chunk, so Redis is never blocked for long. At most
+    `max_keys_per_second` keys are looked at when set.
+    """
+
+    LOCK_KEY = "ttl_manager:lock"
+    # Renewed before every chunk, so a sweeper that died only holds up the next one this long.
+    LOCK_SECONDS = 60
+
+    def __init__(
+        self,
+        cache: redis.asyncio.Redis,
+        rules: typing.List[TTLRule],
+        chunk_size: int = 1000,
+        max_keys_per_second: typing.Optional[float] = None,
+        dry_run: bool = False,
+    ):
+        self.cache = cache
+        self.rules = rules
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self._bucket = None
+        self._lock_owner: typing.Optional[str] = None
+        if max_keys_per_second:
+            self._bucket = TokenBucket(max_keys_per_second, capacity=max(max_keys_per_second, chunk_size))
+
+    async def _renew_lock(self, seconds: int):
+        if not await self.cache.eval(_RENEW_SCRIPT, 1, self.LOCK_KEY, self._lock_owner, seconds):
+            raise LockLost("Lost the TTL sweep lock.")
+
+    async def _apply_chunk(self, rule: TTLRule, keys: typing.List[bytes]) -> int:
+        if self._lock_owner is not None:
+            await self._renew_lock(self.LOCK_SECONDS)
+        if self._bucket is not None:
+            await self._bucket.consume(len(keys))
+        if self.dry_run:
+            if not rule.only_persistent:
+                return len(keys)
+            pipe = self.cache.pipeline(transaction=False)
+            for key in keys:
+                pipe.ttl(key)
+            # -1 is a key without an expiry, -2 one that's gone since it was scanned.
+            return sum(ttl == -1 for ttl in await pipe.execute())
+        pipe = self.cache.pipeline(transaction=False)
+        for key in keys:
+            # NX only sets an expiry on keys that have none.
+            pipe.expire(key, rule.ttl, nx=rule.only_persistent)
+        return sum(map(bool, await pipe.execute()))
+
+    async def apply(self, rule: TTLRule) -> TTLReport:
+        report = TTLReport(pattern=rule.pattern)
+        chunk = []
+        async for key in self.cache.scan_iter(match=rule.pattern, count=self.chunk_size):
+            chunk.append(key)
+            if len(chunk) >= self.chunk_size:
+                report.updated += await self._apply_chunk(rule, chunk)
+                report.scanned += len(chunk)
+                chunk = []
+        if chunk:
+            report.updated += await self._apply_chunk(rule, chunk)
+            report.scanned += len(chunk)
+        return report
+
+    async def run_once(self) -> typing.List[TTLReport]:
+        reports = []
+        for rule in self.rules:
+            report = await self.apply(rule)
+            logger.info(
+                "Applied TTL rule.",
+                pattern=report.pattern,
+                scanned=report.scanned,
+                updated=report.updated,
+                dry_run=self.dry_run,
+            )
+            reports.append(report)
+        return reports
+
+    async def run_periodically(self, interval: float):
+        """
+        Apply the rules every `interval` seconds until cancelled. When several
+        processes do this against the same Redis, only one of them sweeps at
+        a time, and the next sweep starts an interval after the last one did.
+        """
+        owner = uuid.uuid4().hex
+        while True:
+            started = time.monotonic()
+            try:
+                if await self.cache.set(self.LOCK_KEY, owner, ex=self.LOCK_SECONDS, nx=True):
+                    self._lock_owner = owner
+                    try:
+                        await self.run_once()
+                    finally:
+                        self._lock_owner = None
+                    # Held on to for the rest of the interval, so nobody sweeps again before it's over.
+                    remaining = int(interval - (time.monotonic() - started))
+                    await self.cache.eval(_RENEW_SCRIPT, 1, self.LOCK_KEY, owner, max(1, remaining))
+            except asyncio.CancelledError:
+                raise
+            except LockLost:
+                logger.warning("Lost the TTL sweep lock, stopped sweeping.")
+            except Exception as exc:  # noqa
+                logger.exception("TTL sweep failed.", exception=exc)
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
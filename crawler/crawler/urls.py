@@ -0,0 +1,101 @@
+import dataclasses
+import fnmatch
+import functools
+import re
+import typing
+import urllib.parse
+
+from crawler import settings
+
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+}
+
+DEFAULT_STRIP_PARAMS = "utm_*, fbclid, gclid, dclid, msclkid, mc_cid, mc_eid, _ga, igshid"
+
+
+@dataclasses.dataclass(frozen=True)
+class CanonicalizationRules:
+    strip_params: typing.Optional[typing.Pattern[str]]
+    strip_trailing_slash: bool
+    sort_query: bool
+    lowercase_path: bool
+
+
+def _compile_param_patterns(value: str) -> typing.Optional[typing.Pattern[str]]:
+    patterns = [pattern.strip() for pattern in value.split(",") if pattern.strip()]
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=4096)
+def rules_for_host(hostname: str) -> CanonicalizationRules:
+    """
+    The rules in `[canonicalize]`, overridden by the ones in
+    `[canonicalize:<hostname>]` when that section exists.
+    """
+    options = {
+        "strip_params": DEFAULT_STRIP_PARAMS,
+        "strip_trailing_slash": "true",
+        "sort_query": "true",
+        "lowercase_path": "false",
+    }
+    for section in ("canonicalize", f"canonicalize:{hostname}"):
+        if section in settings.config:
+            options.update(settings.config[section])
+
+    def _boolean(key: str) -> bool:
+        return settings.config.BOOLEAN_STATES[options[key].strip().lower()]
+
+    return CanonicalizationRules(
+        strip_params=_compile_param_patterns(options["strip_params"]),
+        strip_trailing_slash=_boolean("strip_trailing_slash"),
+        sort_query=_boolean("sort_query"),
+        lowercase_path=_boolean("lowercase_path"),
+    )
+
+
+@functools.lru_cache(maxsize=65536)
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize `url` so that the different spellings of the same page
+    share one dedupe key: the scheme and host are lowercased, default
+    ports, fragments and tracking parameters are dropped, and the
+    query and trailing slash are handled per the host's rules.
+    """
+    try:
+        parts = urllib.parse.urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    hostname = (parts.hostname or '').rstrip('.')
+    if not hostname:
+        return url
+    rules = rules_for_host(hostname)
+
+    # IPv6 addresses keep their brackets, or the port would read as part of them.
+    netloc = f"[{hostname}]" if ':' in hostname else hostname
+    if parts.username or parts.password:
+        netloc = parts.netloc.rsplit('@', 1)[0] + '@' + netloc
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f"{netloc}:{port}"
+
+    path = parts.path or '/'
+    if rules.lowercase_path:
+        path = path.lower()
+    if rules.strip_trailing_slash and len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    query = parts.query
+    if query:
+        params = urllib.parse.parse_qsl(query, keep_blank_values=True)
+        if rules.strip_params is not None:
+            params = [(key, value) for key, value in params if not rules.strip_params.match(key)]
+        if rules.sort_query:
+            params.sort()
+        query = urllib.parse.urlencode(params)
+
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
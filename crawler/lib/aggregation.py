@@ -0,0 +1,68 @@
+import dataclasses
+import typing
+
+from sqlalchemy import Float, Integer, column, func, select, values
+from sqlalchemy.dialects import postgresql
+
+from lib.recipes import Ingredient, MeasurementUnit, RecipeIngredient
+from lib.units import to_base_unit
+
+
+@dataclasses.dataclass
+class ShoppingItem:
+    canonical_name: str
+    unit: str
+    # None when none of the recipes say how much, e.g. "salt, to taste".
+    quantity: typing.Optional[float]
+    recipe_ids: typing.Set[int]
+
+
+def _plan(servings: typing.Dict[int, float]):
+    return values(
+        column("recipe_id", Integer),
+        column("multiplier", Float),
+        name="plan",
+    ).data([(recipe_id, float(multiplier)) for recipe_id, multiplier in servings.items()])
+
+
+def aggregate_query(servings: typing.Dict[int, float]):
+    """
+    The scaled amount of every ingredient and unit across the recipes of
+    `servings`, which maps recipe ids to how many times each is made.
+    """
+    plan = _plan(servings)
+    return (
+        select(
+            Ingredient.canonical_name,
+            MeasurementUnit.name,
+            func.sum(RecipeIngredient.quantity * plan.c.multiplier),
+            postgresql.array_agg(func.distinct(RecipeIngredient.recipe_id)),
+        )
+        .select_from(RecipeIngredient)
+        .join(plan, plan.c.recipe_id == RecipeIngredient.recipe_id)
+        .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+        .join(MeasurementUnit, MeasurementUnit.id == RecipeIngredient.measurement_unit_id)
+        .group_by(Ingredient.canonical_name, MeasurementUnit.name)
+    )
+
+
+def shopping_list(session, servings: typing.Dict[int, float]) -> typing.List[ShoppingItem]:
+    """
+    The combined ingredients of the recipes in `servings`, in one query.
+    Amounts in units that convert into each other (cups and tablespoons,
+    ounces and pounds) are added up in milliliters or grams, others are
+    added up per unit.
+    """
+    if not servings:
+        return []
+    items: typing.Dict[typing.Tuple[str, str], ShoppingItem] = dict()
+    for name, unit, quantity, recipe_ids in session.execute(aggregate_query(servings)):
+        base, quantity = to_base_unit(unit, quantity)
+        item = items.get((name, base))
+        if item is None:
+            items[(name, base)] = ShoppingItem(name, base, quantity, set(recipe_ids))
+            continue
+        if quantity is not None:
+            item.quantity = quantity if item.quantity is None else item.quantity + quantity
+        item.recipe_ids.update(recipe_ids)
+    return sorted(items.values(), key=lambda item: (item.canonical_name, item.unit))
@@ -0,0 +1,216 @@
+"""
+A read API over the recipe tables.
+
+Run with `uvicorn lib.api:app`. Responses for recipe details and shopping
+lists are cached in Redis under keys holding the version of every recipe
+they were built from, so they go stale as soon as write_cleaned_data_to_db
+rewrites one of those recipes.
+"""
+
+import contextlib
+import hashlib
+import json
+import math
+import typing
+
+import redis.asyncio
+from sqlalchemy import select
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from crawler import settings
+from crawler.database import get_async_engine, get_async_sessionmaker
+from lib.aggregation import shopping_list
+from lib.recipe_versions import recipe_versions
+from lib.recipes import Ingredient, MeasurementUnit, Recipe, RecipeIngredient
+from lib.search import search_recipes
+
+CACHE_TTL = settings.config.getint("api", "cache_ttl", fallback=3600)
+PAGE_SIZE = settings.config.getint("api", "page_size", fallback=20)
+MAX_PAGE_SIZE = settings.config.getint("api", "max_page_size", fallback=100)
+MAX_SHOPPING_LIST_RECIPES = settings.config.getint("api", "max_shopping_list_recipes", fallback=100)
+
+
+def _dumps(value: typing.Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _json(body: bytes) -> Response:
+    return Response(body, media_type="application/json")
+
+
+def _int_param(request: Request, name: str, default: typing.Optional[int]) -> typing.Optional[int]:
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(400, f"{name} must be an integer.")
+
+
+def _limit(request: Request) -> int:
+    limit = _int_param(request, "limit", PAGE_SIZE)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(400, f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return limit
+
+
+async def _ingredients(session, recipe_ids: typing.List[int]) -> typing.Dict[int, typing.List[dict]]:
+    """
+    The ingredients of all `recipe_ids`, in one query.
+    """
+    ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+    if not recipe_ids:
+        return ingredients
+    stmt = (
+        select(
+            RecipeIngredient.recipe_id,
+            Ingredient.canonical_name,
+            RecipeIngredient.quantity,
+            MeasurementUnit.name,
+            RecipeIngredient.extra_notes,
+        )
+        .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+        .join(MeasurementUnit, MeasurementUnit.id == RecipeIngredient.measurement_unit_id)
+        .where(RecipeIngredient.recipe_id.in_(recipe_ids))
+        .order_by(RecipeIngredient.recipe_id, RecipeIngredient.id)
+    )
+    for recipe_id, name, quantity, unit, extra_notes in await session.execute(stmt):
+        ingredients[recipe_id].append(dict(name=name, quantity=quantity, unit=unit, extra_notes=extra_notes))
+    return ingredients
+
+
+async def list_recipes(request: Request) -> Response:
+    """
+    Recipes in id order, a page at a time: pass the `cursor` of a page as
+    `after` to get the next one.
+    """
+    after = _int_param(request, "after", None)
+    limit = _limit(request)
+    stmt = select(Recipe.id, Recipe.name, Recipe.description, Recipe.url).order_by(Recipe.id).limit(limit + 1)
+    if after is not None:
+        stmt = stmt.where(Recipe.id > after)
+
+    async with request.app.state.sessionmaker() as session:
+        rows = (await session.execute(stmt)).all()
+        page = rows[:limit]
+        ingredients = await _ingredients(session, [row.id for row in page])
+
+    return _json(_dumps(dict(
+        recipes=[
+            dict(id=row.id, name=row.name, description=row.description, url=row.url, ingredients=ingredients[row.id])
+            for row in page
+        ],
+        cursor=page[-1].id if len(rows) > limit else None,
+    )))
+
+
+async def get_recipe(request: Request) -> Response:
+    recipe_id = request.path_params["recipe_id"]
+    cache: redis.asyncio.Redis = request.app.state.cache
+    version, = await recipe_versions(cache, [recipe_id])
+    key = f"api:recipe:{recipe_id}:v{version}"
+    body = await cache.get(key)
+    if body is not None:
+        return _json(body)
+
+    async with request.app.state.sessionmaker() as session:
+        recipe = (await session.execute(
+            select(Recipe.id, Recipe.name, Recipe.description, Recipe.url, Recipe.instructions)
+            .where(Recipe.id == recipe_id)
+        )).one_or_none()
+        if recipe is None:
+            raise HTTPException(404, f"No recipe {recipe_id}.")
+        ingredients = await _ingredients(session, [recipe_id])
+
+    body = _dumps(dict(recipe._asdict(), ingredients=ingredients[recipe_id]))
+    await cache.set(key, body, ex=CACHE_TTL)
+    return _json(body)
+
+
+def _servings(payload: typing.Any) -> typing.Dict[int, float]:
+    servings = payload.get("servings") if isinstance(payload, dict) else None
+    if not isinstance(servings, dict) or not servings:
+        raise HTTPException(400, 'Expected {"servings": {"<recipe id>": <times made>, ...}}.')
+    if len(servings) > MAX_SHOPPING_LIST_RECIPES:
+        raise HTTPException(400, f"At most {MAX_SHOPPING_LIST_RECIPES} recipes per shopping list.")
+    try:
+        servings = {int(recipe_id): float(multiplier) for recipe_id, multiplier in servings.items()}
+    except (TypeError, ValueError):
+        raise HTTPException(400, "Recipe ids must be integers and servings numbers.")
+    # NaN compares false to everything, and JSON bodies may contain NaN and Infinity.
+    if not all(math.isfinite(multiplier) and multiplier > 0 for multiplier in servings.values()):
+        raise HTTPException(400, "Servings must be positive numbers.")
+    return servings
+
+
+async def get_shopping_list(request: Request) -> Response:
+    try:
+        servings = _servings(await request.json())
+    except json.JSONDecodeError:
+        raise HTTPException(400, "Expected a JSON body.")
+
+    cache: redis.asyncio.Redis = request.app.state.cache
+    recipe_ids = sorted(servings)
+    versions = await recipe_versions(cache, recipe_ids)
+    plan = [[recipe_id, servings[recipe_id], version] for recipe_id, version in zip(recipe_ids, versions)]
+    key = f"api:shopping_list:{hashlib.blake2b(_dumps(plan), digest_size=16).hexdigest()}"
+    body = await cache.get(key)
+    if body is not None:
+        return _json(body)
+
+    async with request.app.state.sessionmaker() as session:
+        items = await session.run_sync(shopping_list, servings)
+
+    body = _dumps(dict(items=[
+        dict(name=item.canonical_name, unit=item.unit, quantity=item.quantity, recipe_ids=sorted(item.recipe_ids))
+        for item in items
+    ]))
+    await cache.set(key, body, ex=CACHE_TTL)
+    return _json(body)
+
+
+async def search(request: Request) -> Response:
+    text = request.query_params.get("q", "")
+    limit = _limit(request)
+    async with request.app.state.sessionmaker() as session:
+        try:
+            page = await session.run_sync(search_recipes, text, limit, request.query_params.get("after"))
+        except ValueError as err:
+            raise HTTPException(400, str(err))
+
+    return _json(_dumps(dict(
+        recipes=[dict(id=result.id, name=result.name, description=result.description) for result in page.results],
+        cursor=page.cursor,
+    )))
+
+
+async def http_error(request: Request, exc: HTTPException) -> Response:
+    return JSONResponse(dict(error=exc.detail), status_code=exc.status_code)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    app.state.sessionmaker = get_async_sessionmaker()
+    app.state.cache = redis.asyncio.Redis(**settings.config["redis"])
+    try:
+        yield
+    finally:
+        await app.state.cache.close()
+        await get_async_engine().dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/recipes", list_recipes),
+        Route("/recipes/{recipe_id:int}", get_recipe),
+        Route("/shopping-list", get_shopping_list, methods=["POST"]),
+        Route("/search", search),
+    ],
+    exception_handlers={HTTPException: http_error},
+    lifespan=lifespan,
+)
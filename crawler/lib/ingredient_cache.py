@@ -0,0 +1,103 @@
+import collections
+import datetime
+import hashlib
+import json
+import typing
+
+import redis
+
+from lib.ingredient_grammar import normalize_line
+
+
+class IngredientLineCache:
+    """
+    Parsed ingredient lines keyed by a hash of the normalized line, so a
+    line is only ever parsed once no matter how many recipes use it.
+
+    The lines live in Redis hashes `ingredient_lines:{digest[:2]}`, with
+    the last `lru_size` lines used held in process in front of them.
+    """
+
+    PREFIX = "ingredient_lines"
+    TTL = datetime.timedelta(days=180)
+
+    def __init__(self, cache: redis.Redis, lru_size: int = 100000):
+        self.cache = cache
+        self.lru_size = lru_size
+        self._lru: "collections.OrderedDict[str, typing.Dict[str, typing.Any]]" = collections.OrderedDict()
+        self.lru_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(line: str) -> str:
+        return hashlib.blake2b(normalize_line(line).casefold().encode('utf-8'), digest_size=16).hexdigest()
+
+    @classmethod
+    def key(cls, digest: str) -> str:
+        return f"{cls.PREFIX}:{digest[:2]}"
+
+    def _remember(self, digest: str, parsed: typing.Dict[str, typing.Any]):
+        self._lru[digest] = parsed
+        self._lru.move_to_end(digest)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, lines: typing.Iterable[str]) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """
+        The parsed ingredient of every line in `lines` that's been cached.
+        """
+        found = dict()
+        missing: typing.Dict[str, typing.List[str]] = dict()
+        for line in lines:
+            digest = self.digest(line)
+            parsed = self._lru.get(digest)
+            if parsed is not None:
+                self._lru.move_to_end(digest)
+                found[line] = parsed
+                self.lru_hits += 1
+            else:
+                missing.setdefault(digest, []).append(line)
+        if not missing:
+            return found
+
+        pipe = self.cache.pipeline(transaction=False)
+        for digest in missing:
+            pipe.hget(self.key(digest), digest)
+        for (digest, same_lines), value in zip(missing.items(), pipe.execute()):
+            if value is None:
+                self.misses += len(same_lines)
+                continue
+            parsed = json.loads(value)
+            self._remember(digest, parsed)
+            for line in same_lines:
+                found[line] = parsed
+            self.redis_hits += len(same_lines)
+        return found
+
+    def put_many(self, parsed_lines: typing.Dict[str, typing.Dict[str, typing.Any]]):
+        if not parsed_lines:
+            return
+        buckets: typing.Dict[str, typing.Dict[str, str]] = dict()
+        for line, parsed in parsed_lines.items():
+            digest = self.digest(line)
+            self._remember(digest, parsed)
+            buckets.setdefault(self.key(digest), dict())[digest] = json.dumps(parsed)
+        pipe = self.cache.pipeline(transaction=False)
+        for key, mapping in buckets.items():
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, self.TTL)
+        pipe.execute()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.lru_hits + self.redis_hits + self.misses
+        return (self.lru_hits + self.redis_hits) / lookups if lookups else 0.0
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        return dict(
+            lru_hits=self.lru_hits,
+            redis_hits=self.redis_hits,
+            misses=self.misses,
+            hit_rate=round(self.hit_rate, 4),
+        )
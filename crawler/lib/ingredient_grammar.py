@@ -0,0 +1,205 @@
+import dataclasses
+import re
+import typing
+
+from lib.units import CONVERSIONS, UNIT_ALIASES, canonical_unit
+
+UNICODE_FRACTIONS = {
+    "½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4",
+    "⅕": "1/5", "⅖": "2/5", "⅗": "3/5", "⅘": "4/5", "⅙": "1/6",
+    "⅚": "5/6", "⅛": "1/8", "⅜": "3/8", "⅝": "5/8", "⅞": "7/8",
+}
+
+NUMBER_WORDS = {
+    "a": 1.0, "an": 1.0, "one": 1.0, "two": 2.0, "three": 3.0, "four": 4.0,
+    "five": 5.0, "six": 6.0, "seven": 7.0, "eight": 8.0, "nine": 9.0,
+    "ten": 10.0, "eleven": 11.0, "twelve": 12.0, "half": 0.5, "dozen": 12.0,
+}
+
+ARTICLES = {"a", "an"}
+
+# Words that make "a" vague rather than one, as in "a few sprigs".
+QUANTIFIERS = {"few", "couple", "little", "bit", "several", "some", "good", "generous", "splash", "touch"}
+
+# Units that are containers of a size given before them, as in "a 14 oz can".
+CONTAINERS = {"can", "jar", "package", "bag", "box"}
+
+# Preparation words that describe the ingredient rather than name it.
+PREPARATIONS = {
+    "chopped", "finely", "coarsely", "roughly", "thinly", "diced", "minced", "sliced", "grated",
+    "shredded", "crushed", "melted", "softened", "beaten", "peeled", "cubed", "halved",
+    "quartered", "packed", "sifted", "divided", "fresh", "freshly", "large", "medium", "small",
+    "heaping", "level", "cooked", "uncooked", "frozen", "thawed", "drained", "rinsed", "toasted",
+}
+
+# Lines that are about seasoning to taste rather than measuring anything.
+_UNMEASURED = re.compile(r"\b(to taste|as needed|for serving|for garnish|optional)\b", re.IGNORECASE)
+
+_FRACTION_CHARACTERS = re.compile("(\\d)?([" + "".join(UNICODE_FRACTIONS) + "])")
+# "1-1/2" is one and a half, written the way some sites do, and not a range.
+_NUMBER = r"(?:\d+-\d+/\d+|\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+)"
+_WORD_NUMBER = "|".join(sorted(NUMBER_WORDS, key=len, reverse=True))
+_UNIT = "|".join(re.escape(alias) for alias in sorted(UNIT_ALIASES, key=len, reverse=True))
+
+_LINE = re.compile(
+    rf"""^\s*
+    (?:(?P<quantity>{_NUMBER}|(?:{_WORD_NUMBER})\b)
+       (?:\s*(?:-|to|or)\s*(?P<upper>{_NUMBER}))?\s*)?
+    (?:\((?P<size>[^)]*)\)\s*)?
+    (?:(?P<unit>{_UNIT})(?![a-z])\.?\s*)?
+    (?:of\s+)?
+    (?P<rest>.*?)\s*$""",
+    re.IGNORECASE | re.VERBOSE,
+)
+_MEASURE = "|".join(
+    re.escape(alias) for alias in sorted(UNIT_ALIASES, key=len, reverse=True) if UNIT_ALIASES[alias] in CONVERSIONS
+)
+_CONTAINER = "|".join(
+    re.escape(alias) for alias in sorted(UNIT_ALIASES, key=len, reverse=True) if UNIT_ALIASES[alias] in CONTAINERS
+)
+# "12 oz. package", "a 14-ounce can", "2 15 oz cans": the size goes in parentheses, like "1 (12 oz.) package".
+_SIZED_CONTAINER = re.compile(
+    rf"""^(?:(?P<count>\d+)\s+(?=\d+(?:\.\d+)?\s*-?\s*(?:{_MEASURE})(?![a-z]))|(?:a|an|one)\s+)?
+    (?P<size>{_NUMBER}\s*-?\s*(?:{_MEASURE})(?![a-z])\.?)\s+
+    (?P<container>(?:{_CONTAINER})(?![a-z]))""",
+    re.IGNORECASE | re.VERBOSE,
+)
+_DOZEN = re.compile(r"^(?:(?P<half>half)\s+)?(?:a|an|one)\s+dozen\b", re.IGNORECASE)
+_HALF_ARTICLE = re.compile(r"^half\s+(?:a|an)\b", re.IGNORECASE)
+_QUANTIFIER = re.compile(rf"^(?:{'|'.join(QUANTIFIERS)})\b(?:\s+of\b)?\s*", re.IGNORECASE)
+_PARENTHESES = re.compile(r"\s*\(([^)]*)\)\s*")
+_SPACES = re.compile(r"\s+")
+
+
+@dataclasses.dataclass
+class LineParse:
+    quantity: typing.Optional[float]
+    unit: typing.Optional[str]
+    canonical_name: typing.Optional[str]
+    extra_notes: typing.Optional[str]
+    confidence: float
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "quantity": self.quantity,
+            "unit": self.unit,
+            "canonical_name": self.canonical_name,
+            "extra_notes": self.extra_notes,
+        }
+
+
+def _replace_fraction(match: "re.Match") -> str:
+    whole, fraction = match.groups()
+    return f"{whole} {UNICODE_FRACTIONS[fraction]}" if whole else UNICODE_FRACTIONS[fraction]
+
+
+def normalize_line(line: str) -> str:
+    line = _FRACTION_CHARACTERS.sub(_replace_fraction, line)
+    line = line.replace("⁄", "/").replace("–", "-").replace("—", "-").replace(" ", " ")
+    return _SPACES.sub(" ", line).strip()
+
+
+def parse_number(text: str) -> typing.Optional[float]:
+    text = text.strip().lower()
+    if text in NUMBER_WORDS:
+        return NUMBER_WORDS[text]
+    total = 0.0
+    for part in text.replace("-", " ").split():
+        numerator, slash, denominator = part.partition("/")
+        try:
+            if slash:
+                total += float(numerator) / float(denominator)
+            else:
+                total += float(numerator)
+        except (ValueError, ZeroDivisionError):
+            return None
+    return total
+
+
+def parse_line(line: str) -> LineParse:
+    """
+    Parse a free form ingredient line like "1 ½ cups flour, sifted" by rule.
+
+    The confidence is 1.0 for lines that look like "<quantity> <unit>
+    <name>[, <notes>]" and drops with everything that doesn't fit that
+    shape, which leaves vague amounts ("a few", "a little") and ranges
+    that don't go up to whoever parses the lines this can't. Ranges are
+    read as their upper bound, and "1-1/2" as one and a half. Count-like
+    lines ("2 eggs") get the unit "piece", and sized containers ("12 oz.
+    package") the container as their unit.
+    """
+    line = normalize_line(line)
+    line = _DOZEN.sub(lambda dozen: "6" if dozen.group("half") else "12", line)
+    line = _HALF_ARTICLE.sub("1/2", line)
+    line = _SIZED_CONTAINER.sub(
+        lambda sized: f"{sized.group('count') or 1} ({sized.group('size')}) {sized.group('container')}", line
+    )
+    match = _LINE.match(line)
+    rest = match.group("rest")
+    notes: typing.List[str] = []
+    confidence = 1.0
+
+    quantity = None
+    quantifier = None
+    if match.group("quantity") and match.group("quantity").lower() in ARTICLES:
+        quantifier = _QUANTIFIER.match(rest)
+    if quantifier:
+        # "a few", "a couple of": some amount, but not one.
+        notes.append(f"{match.group('quantity')} {quantifier.group(0).strip()}".lower())
+        rest = rest[quantifier.end():]
+        confidence -= 0.3
+    elif match.group("quantity"):
+        quantity = parse_number(match.group("upper") or match.group("quantity"))
+        if match.group("upper"):
+            notes.append(f"{match.group('quantity')}-{match.group('upper')}")
+            lower = parse_number(match.group("quantity"))
+            if lower is None or quantity is None or quantity <= lower:
+                confidence -= 0.5
+    if match.group("size"):
+        notes.append(match.group("size").strip())
+
+    unit = canonical_unit(match.group("unit"))
+
+    name, comma, trailing = rest.partition(",")
+    if comma:
+        notes.append(trailing.strip())
+    for parenthetical in _PARENTHESES.findall(name):
+        notes.append(parenthetical.strip())
+    name = _PARENTHESES.sub(" ", name)
+    unmeasured = _UNMEASURED.search(name)
+    if unmeasured:
+        notes.append(unmeasured.group(0).lower())
+        name = name[:unmeasured.start()] + name[unmeasured.end():]
+
+    words = name.lower().split()
+    leading = []
+    while len(words) > 1 and words[0].strip(",") in PREPARATIONS:
+        leading.append(words.pop(0))
+    if leading:
+        notes.insert(0, " ".join(leading))
+    name = " ".join(words).strip(" .;:*-")
+
+    if quantity is None:
+        confidence -= 0.1 if _UNMEASURED.search(line) else 0.4
+    if unit is None:
+        if quantity is not None:
+            unit = "piece"
+            confidence -= 0.1
+        else:
+            confidence -= 0.2
+    if not name:
+        return LineParse(quantity, unit, None, "; ".join(notes) or None, 0.0)
+    if any(character.isdigit() for character in name):
+        confidence -= 0.4
+    if len(words) > 4:
+        confidence -= 0.1 * (len(words) - 4)
+    if " or " in f" {name} " or " and " in f" {name} ":
+        confidence -= 0.3
+
+    return LineParse(
+        quantity=quantity,
+        unit=unit,
+        canonical_name=name,
+        extra_notes="; ".join(note for note in notes if note) or None,
+        confidence=max(0.0, round(confidence, 2)),
+    )
@@ -0,0 +1,188 @@
+import asyncio
+import dataclasses
+import json
+import random
+import typing
+
+import openai
+import structlog
+
+from crawler.politeness import TokenBucket
+
+logger = structlog.get_logger()
+
+PROMPT = """Given the following free form ingredients of one or more recipes, transform each ingredient into four
+categories called "quantity" (as a float or null), a "unit", "canonical_name", and "extra_notes". Respond with
+a JSON object that maps each recipe's number to the list of its transformed ingredients, in the order they are
+given. Please only return valid JSON data and no other text in the response.
+
+"""
+
+# Rough size of the answer for one ingredient line.
+COMPLETION_TOKENS_PER_LINE = 40
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _recipe_prompt(number: int, lines: typing.List[str]) -> str:
+    return f"Recipe {number}:\n" + "".join(f"- {line}\n" for line in lines) + "\n"
+
+
+@dataclasses.dataclass
+class _Request:
+    recipe_id: int
+    lines: typing.List[str]
+    prompt_tokens: int
+    completion_tokens: int
+    future: asyncio.Future
+
+
+class IngredientParser:
+    """
+    Parses the ingredient lists of recipes through the completion API.
+
+    Lists submitted within `pack_delay` seconds of each other are packed
+    into shared prompts as long as the prompt stays under
+    `max_prompt_tokens` and the expected answer under
+    `max_completion_tokens`. At most `concurrency` completions are in
+    flight, and they are held to `requests_per_minute` and
+    `tokens_per_minute`. Transient API errors are retried with jittered
+    exponential backoff up to `max_attempts` times.
+
+    Within a pack, lists are numbered by their place in it rather than by
+    recipe id, as the same recipe may have several lists in one pack.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        concurrency: int,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_prompt_tokens: int,
+        max_completion_tokens: int,
+        max_attempts: int = 5,
+        pack_delay: float = 0.05,
+        api_base: typing.Optional[str] = None,
+    ):
+        self.model = model
+        self.api_base = api_base
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_completion_tokens = max_completion_tokens
+        self.max_attempts = max_attempts
+        self.pack_delay = pack_delay
+        self._concurrency = asyncio.Semaphore(concurrency)
+        self._requests = TokenBucket(requests_per_minute / 60, capacity=max(1.0, requests_per_minute))
+        self._tokens = TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute)
+        self._pending: typing.List[_Request] = []
+        self._pending_tokens = 0
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+
+    async def parse(self, recipe_id: int, lines: typing.List[str]) -> typing.Optional[typing.List[typing.Any]]:
+        """
+        The parsed ingredients of a recipe, or None if the answer wasn't usable.
+        Raises `openai.error.OpenAIError` if the API kept failing.
+        """
+        loop = asyncio.get_running_loop()
+        request = _Request(
+            recipe_id=recipe_id,
+            lines=lines,
+            prompt_tokens=estimate_tokens(_recipe_prompt(recipe_id, lines)),
+            completion_tokens=COMPLETION_TOKENS_PER_LINE * len(lines),
+            future=loop.create_future(),
+        )
+        self._pending.append(request)
+        self._pending_tokens += request.prompt_tokens
+        if self._pending_tokens >= self.max_prompt_tokens:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.pack_delay, self._dispatch)
+        return await request.future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pack: typing.List[_Request] = []
+        prompt_tokens = estimate_tokens(PROMPT)
+        completion_tokens = 0
+        for request in self._pending:
+            if pack and (
+                prompt_tokens + request.prompt_tokens > self.max_prompt_tokens
+                or completion_tokens + request.completion_tokens > self.max_completion_tokens
+            ):
+                asyncio.ensure_future(self._complete(pack))
+                pack, prompt_tokens, completion_tokens = [], estimate_tokens(PROMPT), 0
+            pack.append(request)
+            prompt_tokens += request.prompt_tokens
+            completion_tokens += request.completion_tokens
+        if pack:
+            asyncio.ensure_future(self._complete(pack))
+        self._pending = []
+        self._pending_tokens = 0
+
+    async def _create_completion(self, prompt: str, max_tokens: int) -> typing.Dict[str, typing.Any]:
+        async with self._concurrency:
+            await self._requests.consume()
+            await self._tokens.consume(min(self._tokens.capacity, estimate_tokens(prompt) + max_tokens))
+            return await openai.Completion.acreate(
+                model=self.model,
+                prompt=prompt,
+                max_tokens=max_tokens,
+                api_base=self.api_base,
+            )
+
+    async def _complete(self, pack: typing.List[_Request]):
+        prompt = PROMPT + "".join(_recipe_prompt(number, request.lines) for number, request in enumerate(pack, 1))
+        max_tokens = min(self.max_completion_tokens, sum(request.completion_tokens for request in pack) * 2)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self._create_completion(prompt, max_tokens)
+                break
+            except RETRYABLE_ERRORS as err:
+                if attempt >= self.max_attempts:
+                    self._fail(pack, err)
+                    return
+                delay = random.uniform(0, min(60.0, 2.0 ** attempt))
+                logger.warning("Retrying completion.", error=str(err), attempt=attempt, delay=delay)
+                await asyncio.sleep(delay)
+            except openai.error.OpenAIError as err:
+                self._fail(pack, err)
+                return
+
+        answers = self._answers(response)
+        for number, request in enumerate(pack, 1):
+            if not request.future.done():
+                request.future.set_result(answers.get(str(number)))
+
+    @staticmethod
+    def _answers(response: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        choices = response.get("choices", [])
+        if not len(choices):
+            return {}
+        try:
+            answers = json.loads(choices[0]["text"])
+        except Exception:  # noqa
+            return {}
+        if not isinstance(answers, dict):
+            return {}
+        return answers
+
+    @staticmethod
+    def _fail(pack: typing.List[_Request], err: Exception):
+        for request in pack:
+            if not request.future.done():
+                request.future.set_exception(err)
@@ -0,0 +1,186 @@
+import dataclasses
+import hashlib
+import math
+import random
+import re
+import struct
+import typing
+
+import redis
+
+from lib.units import UNIT_ALIASES
+
+_WORDS = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+STOP_WORDS = {
+    "a", "an", "and", "the", "of", "or", "with", "to", "for", "in", "on", "into", "from", "at", "by",
+    "recipe", "best", "easy", "homemade", "simple", "quick", "about", "plus", "more", "taste", "optional",
+}
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def recipe_tokens(title: typing.Optional[str], ingredients: typing.Optional[typing.Iterable[typing.Any]]) -> typing.Set[str]:
+    """
+    The words of the title and of the ingredient lines, lowercased and
+    without quantities, units and stop words, as the set a recipe is
+    compared by.
+    """
+    tokens = set()
+    for word in _WORDS.findall((title or "").lower()):
+        if word not in STOP_WORDS:
+            tokens.add(f"t:{word}")
+    for line in ingredients or []:
+        for word in _WORDS.findall(str(line).lower()):
+            if word not in STOP_WORDS and word not in UNIT_ALIASES:
+                tokens.add(f"i:{word}")
+    return tokens
+
+
+class MinHasher:
+    """
+    MinHash signatures of token sets, whose share of equal positions
+    estimates the Jaccard similarity of the sets. Signatures are only
+    comparable between hashers with the same `num_perm` and `seed`.
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        rng = random.Random(seed)
+        self._permutations = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        self._format = f"<{num_perm}Q"
+
+    @staticmethod
+    def _hash(token: str) -> int:
+        return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), "little")
+
+    def signature(self, tokens: typing.Iterable[str]) -> bytes:
+        hashes = [self._hash(token) for token in tokens]
+        if not hashes:
+            return struct.pack(self._format, *([_MERSENNE_PRIME] * self.num_perm))
+        return struct.pack(self._format, *(
+            min((a * value + b) % _MERSENNE_PRIME for value in hashes)
+            for a, b in self._permutations
+        ))
+
+    def similarity(self, first: bytes, second: bytes) -> float:
+        first, second = struct.unpack(self._format, first), struct.unpack(self._format, second)
+        return sum(a == b for a, b in zip(first, second)) / self.num_perm
+
+
+@dataclasses.dataclass
+class Match:
+    url: str
+    # None when the recipe isn't a near duplicate of one seen before.
+    canonical_url: typing.Optional[str]
+    similarity: float = 0.0
+
+
+# Matches one recipe against the canonical ones in its buckets, and registers
+# it as canonical if none is similar enough, all in one go so that two
+# workers can't both miss each other and register the same cluster twice.
+# KEYS are the signatures hash and the band buckets, ARGV the url, the
+# signature, the number of equal positions needed and the band hashes.
+# Returns the best match and its number of equal positions, or nothing.
+_ADD_SCRIPT = """
+local url, signature, needed = ARGV[1], ARGV[2], tonumber(ARGV[3])
+local best, best_equal = false, -1
+local seen = {}
+for band = 2, #KEYS do
+    local candidate = redis.call('HGET', KEYS[band], ARGV[band + 2])
+    if candidate and candidate ~= url and not seen[candidate] then
+        seen[candidate] = true
+        local other = redis.call('HGET', KEYS[1], candidate)
+        if other then
+            local equal = 0
+            for i = 1, #signature, 8 do
+                if string.sub(signature, i, i + 7) == string.sub(other, i, i + 7) then
+                    equal = equal + 1
+                end
+            end
+            if equal >= needed and (equal > best_equal or (equal == best_equal and candidate < best)) then
+                best, best_equal = candidate, equal
+            end
+        end
+    end
+end
+if best then
+    return {best, best_equal}
+end
+for band = 2, #KEYS do
+    redis.call('HSETNX', KEYS[band], ARGV[band + 2], url)
+end
+redis.call('HSET', KEYS[1], url, signature)
+return false
+"""
+
+
+class RedisLSH:
+    """
+    Locality sensitive hashing of MinHash signatures over Redis, so that
+    near duplicates are found by looking up `bands` buckets per recipe
+    rather than by comparing it against every other recipe.
+
+    Only the first recipe of a cluster, its canonical one, is put in the
+    buckets (`lsh:{band}` hashes) and keeps its signature
+    (`minhash_signatures`), so every match is against a canonical recipe.
+    Candidates from the buckets are confirmed with the estimated
+    similarity of their signatures, which has to reach `threshold`.
+    Looking a recipe up and registering it is atomic, so any number of
+    workers can add recipes at the same time.
+    """
+
+    def __init__(
+        self,
+        cache: redis.Redis,
+        hasher: MinHasher,
+        bands: int = 16,
+        threshold: float = 0.8,
+    ):
+        if hasher.num_perm % bands:
+            raise ValueError(f"{hasher.num_perm} permutations can't be split into {bands} bands.")
+        self.cache = cache
+        self.hasher = hasher
+        self.bands = bands
+        self.threshold = threshold
+        self._band_bytes = hasher.num_perm // bands * 8
+        self._add = cache.register_script(_ADD_SCRIPT)
+
+    SIGNATURES_KEY = "minhash_signatures"
+
+    @staticmethod
+    def bucket_key(band: int) -> str:
+        return f"lsh:{band}"
+
+    def _band_hashes(self, signature: bytes) -> typing.List[str]:
+        return [
+            hashlib.blake2b(signature[i:i + self._band_bytes], digest_size=8).hexdigest()
+            for i in range(0, len(signature), self._band_bytes)
+        ]
+
+    def add_many(self, recipes: typing.List[typing.Tuple[str, bytes]]) -> typing.List[Match]:
+        """
+        Match each `(url, signature)` against the canonical recipes seen so
+        far, including the ones earlier in `recipes`, and register those
+        that aren't near duplicates as canonical.
+        """
+        if not recipes:
+            return []
+        keys = [self.SIGNATURES_KEY] + [self.bucket_key(band) for band in range(self.bands)]
+        # Rounded down first, so that e.g. 0.7 * 100 positions still needs only 70.
+        needed = math.ceil(round(self.threshold * self.hasher.num_perm, 6))
+        pipe = self.cache.pipeline(transaction=False)
+        for url, signature in recipes:
+            self._add(keys=keys, args=[url, signature, needed, *self._band_hashes(signature)], client=pipe)
+
+        matches = []
+        for (url, _), found in zip(recipes, pipe.execute()):
+            if found:
+                canonical_url, equal = found
+                matches.append(Match(url, canonical_url.decode('utf-8'), equal / self.hasher.num_perm))
+            else:
+                matches.append(Match(url, None))
+        return matches
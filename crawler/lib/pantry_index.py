@@ -0,0 +1,340 @@
+import array
+import bisect
+import collections
+import os
+import re
+import typing
+
+import msgpack
+from sqlalchemy import select
+
+from lib.recipes import Ingredient, RecipeIngredient
+
+SNAPSHOT_VERSION = 2
+
+# A posting is a bitset, or the ascending positions of its recipes.
+Posting = typing.Union[int, "array.array[int]"]
+
+# Postings of fewer recipes than one in this many are kept as positions,
+# where 4 bytes a recipe take less room than a bit for every recipe there is.
+SPARSE_RATIO = 32
+
+
+def _popcount(bits: int) -> int:
+    return bin(bits).count("1")
+
+
+# The set bits of every byte value, lowest first.
+_BYTE_POSITIONS = [tuple(i for i in range(8) if (byte >> i) & 1) for byte in range(256)]
+
+_NONZERO_BYTES = re.compile(b"[^\x00]+")
+
+
+def _positions(bits: int) -> typing.Iterator[int]:
+    # A byte at a time: peeling bits off the int would copy all of it per bit.
+    data = _to_bytes(bits)
+    for run in _NONZERO_BYTES.finditer(data):
+        for offset in range(run.start(), run.end()):
+            base = offset * 8
+            for i in _BYTE_POSITIONS[data[offset]]:
+                yield base + i
+
+
+def _bits(positions: typing.List[int]) -> int:
+    """
+    The bitset of ascending `positions`, built at once rather than a bit
+    at a time.
+    """
+    if not positions:
+        return 0
+    data = bytearray(positions[-1] // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return _from_bytes(data)
+
+
+def _to_bytes(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def _from_bytes(data: bytes) -> int:
+    return int.from_bytes(data, "little")
+
+
+def _posting_size(posting: Posting) -> int:
+    return _popcount(posting) if isinstance(posting, int) else len(posting)
+
+
+class PantryIndex:
+    """
+    An inverted index from ingredients to the recipes that use them, for
+    "what can I cook with what I have" queries.
+
+    Recipes get a dense position each, and every ingredient a bitset of
+    the positions of its recipes, held in a Python int so set operations
+    run over whole machine words at a time. Recipes are also grouped into
+    bitsets by how many ingredients they have, which lets "missing at most
+    k" queries only ever look at the pantry's own bitsets.
+
+    Most ingredients are in few recipes, and a bitset takes a bit for every
+    recipe there is, so those below `SPARSE_RATIO` keep an array of their
+    positions instead. Queries turn those into bitsets, the most recently
+    used of which are kept up to `cache_bytes`. An array that grows past
+    the ratio becomes a bitset, and stays one until the index is rebuilt,
+    as do positions of removed recipes.
+    """
+
+    def __init__(self, cache_bytes: int = 64 << 20):
+        self.cache_bytes = cache_bytes
+        self._materialized: typing.OrderedDict[int, int] = collections.OrderedDict()
+        self._materialized_bytes = 0
+        self._recipe_ids: typing.List[int] = []
+        self._positions: typing.Dict[int, int] = dict()
+        self._alive = 0
+        self._postings: typing.Dict[int, Posting] = dict()
+        self._by_size: typing.Dict[int, int] = dict()
+        self._recipe_ingredients: typing.Dict[int, typing.FrozenSet[int]] = dict()
+
+    def __len__(self) -> int:
+        return len(self._recipe_ingredients)
+
+    def _is_sparse(self, size: int) -> bool:
+        return size * SPARSE_RATIO < len(self._recipe_ids)
+
+    def _position(self, recipe_id: int) -> int:
+        position = self._positions.get(recipe_id)
+        if position is None:
+            position = self._positions[recipe_id] = len(self._recipe_ids)
+            self._recipe_ids.append(recipe_id)
+        return position
+
+    def remove_recipe(self, recipe_id: int):
+        ingredient_ids = self._recipe_ingredients.pop(recipe_id, None)
+        if ingredient_ids is None:
+            return
+        position = self._positions[recipe_id]
+        bit = 1 << position
+        self._alive &= ~bit
+        for ingredient_id in ingredient_ids:
+            posting = self._postings[ingredient_id]
+            if isinstance(posting, int):
+                self._postings[ingredient_id] = posting & ~bit
+            else:
+                del posting[bisect.bisect_left(posting, position)]
+                self._forget(ingredient_id)
+        self._by_size[len(ingredient_ids)] &= ~bit
+
+    def set_recipe(self, recipe_id: int, ingredient_ids: typing.Iterable[int]):
+        """
+        Add a recipe, or replace the ingredients of one already indexed.
+        """
+        self.remove_recipe(recipe_id)
+        ingredient_ids = frozenset(ingredient_ids)
+        if not ingredient_ids:
+            return
+        position = self._position(recipe_id)
+        bit = 1 << position
+        self._alive |= bit
+        for ingredient_id in ingredient_ids:
+            posting = self._postings.get(ingredient_id)
+            if posting is None:
+                self._postings[ingredient_id] = array.array("I", [position])
+            elif isinstance(posting, int):
+                self._postings[ingredient_id] = posting | bit
+            else:
+                posting.insert(bisect.bisect_left(posting, position), position)
+                self._forget(ingredient_id)
+                if not self._is_sparse(len(posting)):
+                    self._postings[ingredient_id] = _bits(posting)
+        self._by_size[len(ingredient_ids)] = self._by_size.get(len(ingredient_ids), 0) | bit
+        self._recipe_ingredients[recipe_id] = ingredient_ids
+
+    def ingredient_counts(self) -> typing.Dict[int, int]:
+        """
+        How many recipes use each ingredient.
+        """
+        counts = {ingredient_id: _posting_size(posting) for ingredient_id, posting in self._postings.items()}
+        return {ingredient_id: count for ingredient_id, count in counts.items() if count}
+
+    def _recipes(self, bits: int, limit: typing.Optional[int]) -> typing.List[int]:
+        recipe_ids = []
+        for position in _positions(bits):
+            recipe_ids.append(self._recipe_ids[position])
+            if limit is not None and len(recipe_ids) >= limit:
+                break
+        return recipe_ids
+
+    def _forget(self, ingredient_id: int):
+        bits = self._materialized.pop(ingredient_id, None)
+        if bits is not None:
+            self._materialized_bytes -= (bits.bit_length() + 7) // 8
+
+    def _bits_of(self, ingredient_id: int) -> int:
+        posting = self._postings.get(ingredient_id, 0)
+        if isinstance(posting, int):
+            return posting
+        bits = self._materialized.get(ingredient_id)
+        if bits is not None:
+            self._materialized.move_to_end(ingredient_id)
+            return bits
+        bits = self._materialized[ingredient_id] = _bits(posting)
+        self._materialized_bytes += (bits.bit_length() + 7) // 8
+        while self._materialized_bytes > self.cache_bytes:
+            _, evicted = self._materialized.popitem(last=False)
+            self._materialized_bytes -= (evicted.bit_length() + 7) // 8
+        return bits
+
+    def _excluding(self, bits: int, allergen_ids: typing.Iterable[int]) -> int:
+        for ingredient_id in allergen_ids:
+            bits &= ~self._bits_of(ingredient_id)
+        return bits
+
+    def containing_all(
+        self,
+        ingredient_ids: typing.Iterable[int],
+        allergen_ids: typing.Iterable[int] = (),
+        limit: typing.Optional[int] = None,
+    ) -> typing.List[int]:
+        """
+        The recipes using every one of `ingredient_ids` and none of `allergen_ids`.
+        """
+        bits = self._alive
+        for ingredient_id in ingredient_ids:
+            bits &= self._bits_of(ingredient_id)
+            if not bits:
+                return []
+        return self._recipes(self._excluding(bits, allergen_ids), limit)
+
+    def _pantry_counts(self, pantry_ids: typing.Iterable[int]) -> typing.List[int]:
+        """
+        How many pantry ingredients every recipe uses, as a bit-sliced
+        counter: bit i of a recipe's count is its bit in slice i.
+        """
+        slices: typing.List[int] = []
+        for ingredient_id in set(pantry_ids):
+            carry = self._bits_of(ingredient_id)
+            i = 0
+            while carry:
+                if i == len(slices):
+                    slices.append(0)
+                slices[i], carry = slices[i] ^ carry, slices[i] & carry
+                i += 1
+        return slices
+
+    @staticmethod
+    def _at_least(slices: typing.List[int], threshold: int, candidates: int) -> int:
+        """
+        The `candidates` whose count in `slices` is at least `threshold`.
+        """
+        if threshold <= 0:
+            return candidates
+        if threshold >= 1 << len(slices):
+            return 0
+        greater, equal = 0, candidates
+        for i in reversed(range(len(slices))):
+            if (threshold >> i) & 1:
+                equal &= slices[i]
+            else:
+                greater |= equal & slices[i]
+                equal &= ~slices[i]
+        return greater | equal
+
+    def missing_at_most(
+        self,
+        pantry_ids: typing.Iterable[int],
+        k: int,
+        allergen_ids: typing.Iterable[int] = (),
+        limit: typing.Optional[int] = None,
+    ) -> typing.List[int]:
+        """
+        The recipes that need at most `k` ingredients beyond `pantry_ids`,
+        and none of `allergen_ids`.
+        """
+        slices = self._pantry_counts(pantry_ids)
+        bits = 0
+        for size, recipes in self._by_size.items():
+            bits |= self._at_least(slices, size - k, recipes)
+        return self._recipes(self._excluding(bits, allergen_ids), limit)
+
+    @classmethod
+    def build(cls, session, chunk_size: int = 100000) -> "PantryIndex":
+        index = cls()
+        recipe_ingredients: typing.Dict[int, typing.Set[int]] = dict()
+        stmt = select(
+            RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id
+        ).execution_options(yield_per=chunk_size)
+        for recipe_id, ingredient_id in session.execute(stmt):
+            recipe_ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+
+        # Every bitset is made once from its positions, as setting bits one
+        # recipe at a time would copy the whole int for each of them.
+        postings: typing.Dict[int, typing.List[int]] = dict()
+        by_size: typing.Dict[int, typing.List[int]] = dict()
+        for position, recipe_id in enumerate(sorted(recipe_ingredients)):
+            ingredient_ids = frozenset(recipe_ingredients[recipe_id])
+            index._recipe_ids.append(recipe_id)
+            index._positions[recipe_id] = position
+            index._recipe_ingredients[recipe_id] = ingredient_ids
+            for ingredient_id in ingredient_ids:
+                postings.setdefault(ingredient_id, []).append(position)
+            by_size.setdefault(len(ingredient_ids), []).append(position)
+        index._alive = (1 << len(index._recipe_ids)) - 1
+        index._postings = {
+            ingredient_id: array.array("I", positions) if index._is_sparse(len(positions)) else _bits(positions)
+            for ingredient_id, positions in postings.items()
+        }
+        index._by_size = {size: _bits(positions) for size, positions in by_size.items()}
+        return index
+
+    def save(self, path: str):
+        """
+        Write a snapshot, atomically replacing the one at `path`.
+        """
+        recipe_ids = list(self._recipe_ingredients)
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "recipe_ids": self._recipe_ids,
+            "alive": _to_bytes(self._alive),
+            "postings": {
+                ingredient_id: _to_bytes(posting)
+                for ingredient_id, posting in self._postings.items() if isinstance(posting, int) and posting
+            },
+            "sparse_postings": {
+                ingredient_id: posting.tolist()
+                for ingredient_id, posting in self._postings.items() if not isinstance(posting, int) and posting
+            },
+            "by_size": {size: _to_bytes(bits) for size, bits in self._by_size.items() if bits},
+            "recipes": recipe_ids,
+            "ingredients": [list(self._recipe_ingredients[recipe_id]) for recipe_id in recipe_ids],
+        }
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            msgpack.pack(snapshot, f, use_bin_type=True)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PantryIndex":
+        with open(path, "rb") as f:
+            snapshot = msgpack.unpack(f, raw=False, strict_map_key=False)
+        # Version 1 only had bitsets.
+        if snapshot["version"] not in (1, SNAPSHOT_VERSION):
+            raise ValueError(f"Unknown pantry index snapshot version: {snapshot['version']}")
+        index = cls()
+        index._recipe_ids = snapshot["recipe_ids"]
+        index._positions = {recipe_id: position for position, recipe_id in enumerate(index._recipe_ids)}
+        index._alive = _from_bytes(snapshot["alive"])
+        index._postings = {ingredient_id: _from_bytes(data) for ingredient_id, data in snapshot["postings"].items()}
+        for ingredient_id, positions in snapshot.get("sparse_postings", {}).items():
+            index._postings[ingredient_id] = array.array("I", positions)
+        index._by_size = {size: _from_bytes(data) for size, data in snapshot["by_size"].items()}
+        index._recipe_ingredients = dict(zip(snapshot["recipes"], map(frozenset, snapshot["ingredients"])))
+        return index
+
+
+def ingredient_ids_by_name(session, names: typing.Iterable[str]) -> typing.Dict[str, int]:
+    names = [name.strip().lower() for name in names]
+    if not names:
+        return dict()
+    return dict(session.execute(
+        select(Ingredient.canonical_name, Ingredient.id).where(Ingredient.canonical_name.in_(names))
+    ).all())
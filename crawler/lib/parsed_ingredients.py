@@ -0,0 +1,207 @@
+import dataclasses
+import typing
+
+import msgpack
+import structlog
+from sqlalchemy import Integer, or_, select, func
+from sqlalchemy.dialects import postgresql
+
+from lib.recipes import ParsedIngredients
+
+logger = structlog.get_logger()
+
+# Hours until a recipe that failed to parse is asked about again, doubling with every failure.
+RETRY_HOURS = 1
+MAX_RETRY_HOURS = 7 * 24
+
+# Bump when the layout written by `encode` changes, and teach `decode` the old one.
+FORMAT_VERSION = 1
+
+
+@dataclasses.dataclass
+class ParsedIngredient:
+    quantity: typing.Optional[float]
+    unit: typing.Optional[str]
+    canonical_name: typing.Optional[str]
+    extra_notes: typing.Optional[str]
+
+
+def _as_float(value: typing.Any) -> typing.Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_text(value: typing.Any) -> typing.Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def validate(recipe_id: int, parsed_ingredients: typing.Any) -> typing.List[ParsedIngredient]:
+    """
+    The usable ingredients out of whatever shape the model answered with.
+    Ingredients without a name or unit are dropped.
+    """
+    if parsed_ingredients is None:
+        return []
+    if isinstance(parsed_ingredients, dict):
+        parsed_ingredients = list(parsed_ingredients.values())
+        if len(parsed_ingredients) == 1:
+            parsed_ingredients = parsed_ingredients[0]
+        if len(parsed_ingredients) == 1:
+            return []
+    if not isinstance(parsed_ingredients, list):
+        return []
+
+    ingredients = []
+    for parsed_ingredient in parsed_ingredients:
+        try:
+            ingredient = ParsedIngredient(**parsed_ingredient)
+        except TypeError as err:
+            logger.error(f"malformed data generated by GPT-3: {err}", recipe=recipe_id)
+            continue
+
+        ingredient.canonical_name = _as_text(ingredient.canonical_name)
+        ingredient.unit = _as_text(ingredient.unit)
+        if ingredient.canonical_name is None:
+            logger.error("Canonical name does not exist.", ingredient=ingredient, recipe=recipe_id)
+            continue
+        if ingredient.unit is None:
+            logger.error("No unit exists.", ingredient=ingredient, recipe=recipe_id)
+            continue
+        ingredient.quantity = _as_float(ingredient.quantity)
+        ingredient.extra_notes = _as_text(ingredient.extra_notes)
+        ingredients.append(ingredient)
+    return ingredients
+
+
+def encode(ingredients: typing.List[ParsedIngredient]) -> bytes:
+    """
+    Pack validated ingredients column by column, as
+    `[quantities, units, canonical_names, extra_notes]`.
+    """
+    return msgpack.packb([
+        [ingredient.quantity for ingredient in ingredients],
+        [ingredient.unit for ingredient in ingredients],
+        [ingredient.canonical_name for ingredient in ingredients],
+        [ingredient.extra_notes for ingredient in ingredients],
+    ], use_bin_type=True)
+
+
+def decode(format_version: int, data: bytes) -> typing.List[ParsedIngredient]:
+    if format_version != FORMAT_VERSION:
+        raise ValueError(f"Unknown parsed ingredients format: {format_version}")
+    quantities, units, names, notes = msgpack.unpackb(data, raw=False)
+    return list(map(ParsedIngredient, quantities, units, names, notes))
+
+
+def parsed_recipe_ids(session, recipe_ids: typing.Iterable[int]) -> typing.Set[int]:
+    """
+    The recipes of `recipe_ids` that don't need parsing: those parsed, and
+    those that failed to and aren't due to be tried again yet.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return set()
+    return set(session.scalars(
+        select(ParsedIngredients.recipe_id).where(
+            ParsedIngredients.recipe_id.in_(recipe_ids),
+            or_(ParsedIngredients.retry_after.is_(None), ParsedIngredients.retry_after > func.now()),
+        )
+    ))
+
+
+def due_parse_failures(session, limit: typing.Optional[int] = None) -> typing.List[int]:
+    """
+    The recipes that failed to parse and are due to be tried again, oldest first.
+    """
+    return list(session.scalars(
+        select(ParsedIngredients.recipe_id)
+        .where(ParsedIngredients.retry_after <= func.now())
+        .order_by(ParsedIngredients.retry_after)
+        .limit(limit)
+    ))
+
+
+def save_parsed_ingredients(
+    session,
+    records: typing.Dict[int, typing.List[ParsedIngredient]],
+    overwrite: bool = True,
+):
+    """
+    Store the validated ingredients of every recipe in `records`, replacing
+    what's there unless `overwrite` is off, in which case only failures to
+    parse are replaced. Commits with the session.
+    """
+    if not records:
+        return
+    stmt = postgresql.insert(ParsedIngredients).values([
+        dict(recipe_id=recipe_id, format_version=FORMAT_VERSION, data=encode(ingredients), updated_at=func.now())
+        for recipe_id, ingredients in records.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ParsedIngredients.recipe_id],
+        set_=dict(
+            format_version=stmt.excluded.format_version,
+            data=stmt.excluded.data,
+            updated_at=stmt.excluded.updated_at,
+            failed_attempts=0,
+            retry_after=None,
+        ),
+        # Failures are always replaced, they are only placeholders.
+        where=None if overwrite else ParsedIngredients.retry_after.isnot(None),
+    )
+    session.execute(stmt)
+
+
+def save_parse_failures(session, recipe_ids: typing.Iterable[int]):
+    """
+    Record that the ingredients of `recipe_ids` couldn't be parsed, so they
+    are tried again after a delay that doubles with every failure, rather
+    than straight away or never. Parsed ingredients are left alone.
+    Commits with the session.
+    """
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return
+    stmt = postgresql.insert(ParsedIngredients).values([
+        dict(
+            recipe_id=recipe_id,
+            format_version=FORMAT_VERSION,
+            data=encode([]),
+            updated_at=func.now(),
+            failed_attempts=1,
+            retry_after=func.now() + func.make_interval(0, 0, 0, 0, RETRY_HOURS),
+        )
+        for recipe_id in recipe_ids
+    ])
+    delay_hours = func.least(
+        RETRY_HOURS * func.power(2, ParsedIngredients.failed_attempts),
+        MAX_RETRY_HOURS,
+    ).cast(Integer)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[ParsedIngredients.recipe_id],
+        set_=dict(
+            updated_at=stmt.excluded.updated_at,
+            failed_attempts=ParsedIngredients.failed_attempts + 1,
+            retry_after=func.now() + func.make_interval(0, 0, 0, 0, delay_hours),
+        ),
+        where=ParsedIngredients.retry_after.isnot(None),
+    ))
+
+
+def load_parsed_ingredients(
+    session,
+    recipe_ids: typing.Iterable[int]
+) -> typing.Dict[int, typing.List[ParsedIngredient]]:
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return dict()
+    rows = session.execute(
+        select(ParsedIngredients.recipe_id, ParsedIngredients.format_version, ParsedIngredients.data)
+        .where(ParsedIngredients.recipe_id.in_(recipe_ids), ParsedIngredients.retry_after.is_(None))
+    )
+    return {recipe_id: decode(format_version, data) for recipe_id, format_version, data in rows}
@@ -0,0 +1,286 @@
+import argparse
+import concurrent.futures
+import dataclasses
+import datetime
+import functools
+import time
+import typing
+import uuid
+
+import redis
+import structlog
+from tqdm import tqdm
+
+from crawler import settings
+from lib.recipes import engine, raw_recipe_id_bounds
+
+logger = structlog.get_logger()
+
+T = typing.TypeVar('T')
+
+
+@dataclasses.dataclass(frozen=True)
+class Partition:
+    min_id: int
+    max_id: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.min_id}-{self.max_id}"
+
+
+def split_id_space(min_id: int, max_id: int, partition_size: int) -> typing.List[Partition]:
+    return [
+        Partition(start, min(start + partition_size - 1, max_id))
+        for start in range(min_id, max_id + 1, partition_size)
+    ]
+
+
+# Only touch a lease if we still own it.
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLost(Exception):
+    pass
+
+
+_lease_cache: typing.Optional[redis.Redis] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Lease:
+    """
+    The lease on a partition, as handed to the worker processing it.
+    """
+    key: str
+    owner: str
+    lease_seconds: int
+
+    def renew(self):
+        """
+        Extend the lease, or raise `LeaseLost` if it ran out and someone
+        else may be working on the partition now.
+        """
+        global _lease_cache
+        if _lease_cache is None:
+            _lease_cache = redis.Redis(**settings.config["redis"])
+        if not _lease_cache.eval(_RENEW_SCRIPT, 1, self.key, self.owner, self.lease_seconds):
+            raise LeaseLost(f"Lost the lease {self.key}.")
+
+    def guard(self, chunks: typing.Iterable[T]) -> typing.Iterator[T]:
+        """
+        Renew the lease before every chunk, so a chunk is only written while
+        the lease is held, provided writing one takes less than `lease_seconds`.
+        """
+        for chunk in chunks:
+            self.renew()
+            yield chunk
+
+
+class PartitionLeases:
+    """
+    Hands out the partitions of a job through Redis, so that any number of
+    runners on any number of hosts never work on the same range at once.
+
+    A claimed partition is leased for `lease_seconds` and has to be renewed
+    while it is being worked on, so the partitions of a runner that died
+    are picked up by the others once its leases run out. Which partitions
+    are done is remembered for `RETENTION`, so an interrupted job picks up
+    where it left off when started again.
+    """
+
+    RETENTION = datetime.timedelta(days=7)
+
+    def __init__(self, cache: redis.Redis, job: str, lease_seconds: int):
+        self.cache = cache
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        self._renew = cache.register_script(_RENEW_SCRIPT)
+        self._release = cache.register_script(_RELEASE_SCRIPT)
+
+    def _lease_key(self, partition: Partition) -> str:
+        return f"partition_lease:{self.job}:{partition.key}"
+
+    @property
+    def _done_key(self) -> str:
+        return f"partition_done:{self.job}"
+
+    @property
+    def _failures_key(self) -> str:
+        return f"partition_failures:{self.job}"
+
+    def is_done(self, partition: Partition) -> bool:
+        return bool(self.cache.sismember(self._done_key, partition.key))
+
+    def done_count(self) -> int:
+        return self.cache.scard(self._done_key)
+
+    def claim(self, partition: Partition) -> bool:
+        if self.is_done(partition):
+            return False
+        return bool(self.cache.set(self._lease_key(partition), self.owner, ex=self.lease_seconds, nx=True))
+
+    def renew(self, partition: Partition) -> bool:
+        return bool(self._renew(keys=[self._lease_key(partition)], args=[self.owner, self.lease_seconds]))
+
+    def lease(self, partition: Partition) -> Lease:
+        return Lease(self._lease_key(partition), self.owner, self.lease_seconds)
+
+    def release(self, partition: Partition):
+        self._release(keys=[self._lease_key(partition)], args=[self.owner])
+
+    def complete(self, partition: Partition):
+        pipe = self.cache.pipeline(transaction=False)
+        pipe.sadd(self._done_key, partition.key)
+        pipe.expire(self._done_key, self.RETENTION)
+        pipe.execute()
+        self.release(partition)
+
+    def fail(self, partition: Partition) -> int:
+        """
+        Give the partition back and return how often it failed so far, across all runners.
+        """
+        pipe = self.cache.pipeline(transaction=False)
+        pipe.hincrby(self._failures_key, partition.key, 1)
+        pipe.expire(self._failures_key, self.RETENTION)
+        failures, _ = pipe.execute()
+        self.release(partition)
+        return failures
+
+    def reset(self):
+        self.cache.delete(self._done_key, self._failures_key)
+
+
+def add_partition_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Split the id range into partitions and process them in this many processes."
+    )
+    parser.add_argument("--partition-size", type=int, default=10000)
+    parser.add_argument("--lease-seconds", type=int, default=300)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Forget which partitions of this range earlier runs finished."
+    )
+
+
+def run_partitioned(
+    leases: PartitionLeases,
+    partitions: typing.List[Partition],
+    worker: typing.Callable[[Partition], int],
+    processes: int,
+    max_attempts: int = 3,
+    initializer: typing.Optional[typing.Callable[[], None]] = None,
+) -> typing.List[Partition]:
+    """
+    Run `worker(partition, lease=...)` over every partition not done yet in
+    a pool of `processes`, retrying each up to `max_attempts` times. `worker`
+    returns the number of rows it processed, has to be safe to run again on
+    a partition it failed on, and has to stop with `LeaseLost` once renewing
+    its `Lease` fails. Returns the partitions that were given up on.
+    """
+    pending = [partition for partition in partitions if not leases.is_done(partition)]
+    running: typing.Dict[concurrent.futures.Future, Partition] = dict()
+    failed: typing.List[Partition] = []
+    rows = 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=initializer) as executor, \
+            tqdm(total=len(partitions), initial=leases.done_count(), unit="partition") as progress:
+        while pending or running:
+            for partition in list(pending):
+                if len(running) >= processes:
+                    break
+                if leases.is_done(partition):
+                    pending.remove(partition)
+                elif leases.claim(partition):
+                    pending.remove(partition)
+                    running[executor.submit(worker, partition, lease=leases.lease(partition))] = partition
+
+            if not running:
+                # Everything left is leased by other runners, wait for them to finish or die.
+                time.sleep(leases.lease_seconds / 3)
+                continue
+
+            finished, _ = concurrent.futures.wait(
+                running,
+                timeout=leases.lease_seconds / 3,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                partition = running.pop(future)
+                try:
+                    rows += future.result()
+                except LeaseLost:
+                    # Not the partition's fault, whoever holds it now finishes it, or we do later.
+                    logger.warning("Lost the lease of a partition.", partition=partition.key)
+                    pending.append(partition)
+                except Exception as exc:  # noqa
+                    failures = leases.fail(partition)
+                    logger.exception("Partition failed.", partition=partition.key, failures=failures, exception=exc)
+                    if failures < max_attempts:
+                        pending.append(partition)
+                    else:
+                        failed.append(partition)
+                else:
+                    leases.complete(partition)
+            for partition in running.values():
+                if not leases.renew(partition):
+                    # Its worker stops before writing its next chunk.
+                    logger.warning("Failed to renew the lease of a partition.", partition=partition.key)
+
+            progress.n = leases.done_count()
+            progress.set_postfix(rows=rows)
+            progress.refresh()
+
+    return failed
+
+
+def _forget_inherited_connections():
+    # Pooled connections of the parent can't be shared with a forked worker.
+    engine.dispose(close=False)
+
+
+def run_stage_partitioned(
+    cache: redis.Redis,
+    stage: str,
+    args: argparse.Namespace,
+    worker: typing.Callable[..., int],
+    **worker_kwargs,
+) -> typing.Tuple[typing.List[Partition], typing.Optional[int]]:
+    """
+    Run `worker(partition, since=args.since, lease=..., **worker_kwargs)` over the
+    scraped recipe id range selected by `args`, split into partitions.
+    Returns the partitions given up on, and the highest id in the range.
+    """
+    min_id, max_id = raw_recipe_id_bounds(args.min_id, args.max_id, args.since)
+    if min_id is None:
+        return [], None
+    leases = PartitionLeases(cache, f"{stage}:{min_id}-{max_id}", lease_seconds=args.lease_seconds)
+    if args.fresh:
+        leases.reset()
+    failed = run_partitioned(
+        leases,
+        split_id_space(min_id, max_id, args.partition_size),
+        functools.partial(worker, since=args.since, **worker_kwargs),
+        processes=args.processes,
+        max_attempts=args.max_attempts,
+        initializer=_forget_inherited_connections,
+    )
+    return failed, max_id
@@ -0,0 +1,29 @@
+import typing
+
+import redis
+import redis.asyncio
+
+
+def version_key(recipe_id: int) -> str:
+    return f"recipe_version:{recipe_id}"
+
+
+def bump_recipe_versions(cache: redis.Redis, recipe_ids: typing.Iterable[int]):
+    """
+    Invalidate everything cached about `recipe_ids`, after rewriting them.
+    """
+    pipe = cache.pipeline(transaction=False)
+    for recipe_id in recipe_ids:
+        pipe.incr(version_key(recipe_id))
+    pipe.execute()
+
+
+async def recipe_versions(cache: redis.asyncio.Redis, recipe_ids: typing.List[int]) -> typing.List[int]:
+    """
+    The current version of each recipe, for keys of cached responses that
+    should go stale when the recipe changes.
+    """
+    if not recipe_ids:
+        return []
+    values = await cache.mget([version_key(recipe_id) for recipe_id in recipe_ids])
+    return [int(value) if value is not None else 0 for value in values]
@@ -1,29 +1,20 @@
+import argparse
 import datetime
 import typing
 
-from sqlalchemy import Integer, String, ForeignKey, JSON, Table, Column, ARRAY, Text
+from sqlalchemy import Integer, String, ForeignKey, JSON, Table, Column, ARRAY, Text, LargeBinary, exists, select, func
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy import create_engine
-from crawler import settings
-from urllib.parse import quote_plus
+from sqlalchemy.dialects import postgresql
+from crawler.database import get_engine_url, get_pool_options
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 
 
-def _get_engine_url():
-    postgres_config = settings.config["postgres"]
-    user = quote_plus(postgres_config["user"])
-    password = quote_plus(postgres_config["password"])
-    host = quote_plus(postgres_config["host"])
-    port = quote_plus(postgres_config["port"])
-    database = quote_plus(postgres_config["database"])
-    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
-
-
-engine = create_engine(_get_engine_url(), echo=False)
+engine = create_engine(get_engine_url(), echo=False, **get_pool_options())
 
 Session = sessionmaker(engine)
 
@@ -50,16 +41,18 @@ class Recipe(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
     description: Mapped[str]
-    url: Mapped[str]
+    url: Mapped[str] = mapped_column(unique=True)
     instructions: Mapped[list[str]]
     scraped_extra: Mapped[dict[str, typing.Any]]
+    # Maintained by triggers, see lib.search.
+    search_vector: Mapped[typing.Optional[str]] = mapped_column(postgresql.TSVECTOR, deferred=True)
 
 
 class Ingredient(Base):
     __tablename__ = "ingredient"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    canonical_name: Mapped[str]
+    canonical_name: Mapped[str] = mapped_column(unique=True)
 
     def __repr__(self):
         return f"Ingredient(id={self.id!r}, canonical_name={self.canonical_name!r})"
@@ -69,7 +62,7 @@ class MeasurementUnit(Base):
     __tablename__ = "measurement_unit"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str]
+    name: Mapped[str] = mapped_column(unique=True)
 
     def __repr__(self):
         return f"Unit(id={self.id!r}, name={self.canonical_name!r})"
@@ -78,8 +71,211 @@ class MeasurementUnit(Base):
 class RecipeIngredient(Base):
     __tablename__ = "recipe_ingredient"
     id: Mapped[int] = mapped_column(primary_key=True)
-    recipe_id: Mapped[int] = mapped_column(ForeignKey("recipe.id"))
+    recipe_id: Mapped[int] = mapped_column(ForeignKey("recipe.id"), index=True)
     ingredient_id: Mapped[int] = mapped_column(ForeignKey("ingredient.id"))
     measurement_unit_id: Mapped[int] = mapped_column(ForeignKey("measurement_unit.id"))
     quantity: Mapped[float]
     extra_notes: Mapped[str]
+
+
+class ParsedIngredients(Base):
+    """
+    The validated ingredients of a scraped recipe, in the record format of
+    `lib.parsed_ingredients`. Recipes whose ingredients couldn't be parsed
+    have a row without ingredients and a `retry_after`.
+    """
+    __tablename__ = "parsed_ingredients"
+
+    recipe_id: Mapped[int] = mapped_column(ForeignKey("scraped_recipe.id", ondelete="CASCADE"), primary_key=True)
+    format_version: Mapped[int]
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+    updated_at: Mapped[datetime.datetime]
+    failed_attempts: Mapped[int] = mapped_column(server_default="0")
+    retry_after: Mapped[typing.Optional[datetime.datetime]]
+
+    def __repr__(self):
+        return f"ParsedIngredients(recipe_id={self.recipe_id!r}, format_version={self.format_version!r})"
+
+
+class RecipeDuplicate(Base):
+    """
+    A scraped recipe that is a near duplicate of the one at `canonical_url`,
+    see lib.near_duplicates.
+    """
+    __tablename__ = "recipe_duplicate"
+
+    url: Mapped[str] = mapped_column(primary_key=True)
+    canonical_url: Mapped[str] = mapped_column(index=True)
+    similarity: Mapped[float]
+    detected_at: Mapped[datetime.datetime]
+
+    def __repr__(self):
+        return f"RecipeDuplicate(url={self.url!r}, canonical_url={self.canonical_url!r})"
+
+
+def save_duplicates(session, matches: typing.Iterable[typing.Any]):
+    """
+    Record the near duplicates among `matches` (of lib.near_duplicates).
+    Commits with the session.
+    """
+    # The same page may have been scraped more than once, but can only be upserted once per statement.
+    rows = {
+        match.url: dict(
+            url=match.url,
+            canonical_url=match.canonical_url,
+            similarity=match.similarity,
+            detected_at=func.now(),
+        )
+        for match in matches
+        if match.canonical_url is not None
+    }
+    if not rows:
+        return
+    stmt = postgresql.insert(RecipeDuplicate).values(list(rows.values()))
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[RecipeDuplicate.url],
+        set_=dict(canonical_url=stmt.excluded.canonical_url, similarity=stmt.excluded.similarity),
+    ))
+
+
+class PipelineCheckpoint(Base):
+    __tablename__ = "pipeline_checkpoint"
+
+    stage: Mapped[str] = mapped_column(primary_key=True)
+    high_water_id: Mapped[int]
+    updated_at: Mapped[datetime.datetime]
+
+    def __repr__(self):
+        return f"PipelineCheckpoint(stage={self.stage!r}, high_water_id={self.high_water_id!r})"
+
+
+def get_checkpoint(session, stage: str) -> typing.Optional[int]:
+    return session.scalar(select(PipelineCheckpoint.high_water_id).where(PipelineCheckpoint.stage == stage))
+
+
+def save_checkpoint(session, stage: str, high_water_id: int):
+    """
+    Record that `stage` is done with every scraped recipe up to `high_water_id`.
+    Commits together with whatever else the session holds.
+    """
+    stmt = postgresql.insert(PipelineCheckpoint).values(
+        stage=stage,
+        high_water_id=high_water_id,
+        updated_at=func.now(),
+    )
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[PipelineCheckpoint.stage],
+            set_=dict(high_water_id=stmt.excluded.high_water_id, updated_at=stmt.excluded.updated_at),
+        )
+    )
+
+
+def _raw_recipe_filters(
+    min_id: typing.Optional[int],
+    max_id: typing.Optional[int],
+    since: typing.Optional[datetime.datetime] = None,
+    skip_duplicates: bool = False,
+) -> list:
+    filters = []
+    if skip_duplicates:
+        filters.append(~exists().where(
+            RecipeDuplicate.url == func.trim(RecipeRaw.payload["canonical_url"].as_string())
+        ))
+    if min_id is not None:
+        filters.append(RecipeRaw.id >= min_id)
+    if max_id is not None:
+        filters.append(RecipeRaw.id <= max_id)
+    if since is not None:
+        filters.append(RecipeRaw.create_date >= since)
+    return filters
+
+
+def count_raw_recipes(
+    min_id: typing.Optional[int] = None,
+    max_id: typing.Optional[int] = None,
+    since: typing.Optional[datetime.datetime] = None,
+) -> int:
+    with Session() as session:
+        return session.scalar(
+            select(func.count()).select_from(RecipeRaw).where(*_raw_recipe_filters(min_id, max_id, since))
+        )
+
+
+def raw_recipe_id_bounds(
+    min_id: typing.Optional[int] = None,
+    max_id: typing.Optional[int] = None,
+    since: typing.Optional[datetime.datetime] = None,
+) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    with Session() as session:
+        return tuple(session.execute(
+            select(func.min(RecipeRaw.id), func.max(RecipeRaw.id)).where(*_raw_recipe_filters(min_id, max_id, since))
+        ).one())
+
+
+def stream_raw_recipes(
+    *columns,
+    chunk_size: int = 1000,
+    min_id: typing.Optional[int] = None,
+    max_id: typing.Optional[int] = None,
+    since: typing.Optional[datetime.datetime] = None,
+    skip_duplicates: bool = False,
+) -> typing.Iterator[typing.List[typing.Any]]:
+    """
+    Yield the scraped recipes with `min_id <= id <= max_id` (and created at
+    or after `since`) in chunks of `chunk_size`, in id order, from a
+    server-side cursor. With `skip_duplicates`, recipes recorded as near
+    duplicates of another are left out.
+
+    Without `columns` the chunks hold `RecipeRaw` objects, otherwise rows of
+    just those columns, e.g. `RecipeRaw.id, RecipeRaw.payload["ingredients"]`.
+    The cursor lives in a session of its own, so callers are free to commit
+    in theirs while iterating.
+    """
+    stmt = (
+        select(*columns) if columns else select(RecipeRaw)
+    ).where(
+        *_raw_recipe_filters(min_id, max_id, since, skip_duplicates)
+    ).order_by(
+        RecipeRaw.id
+    ).execution_options(
+        yield_per=chunk_size
+    )
+    with Session() as session:
+        result = session.execute(stmt) if columns else session.scalars(stmt)
+        for chunk in result.partitions():
+            yield chunk
+
+
+def add_range_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--min-id", type=int, default=None)
+    parser.add_argument("--max-id", type=int, default=None)
+    parser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        default=None,
+        help="Only process recipes scraped at or after this ISO date."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Only process recipes after the last checkpoint of this stage."
+    )
+
+
+def resolve_range(session, args: argparse.Namespace, stage: str) -> bool:
+    """
+    Apply `--resume` to `args.min_id`, and tell whether the run covers
+    everything past the stage's checkpoint, so that it may move it.
+    """
+    complete = args.max_id is None and args.since is None
+    if args.resume:
+        checkpoint = get_checkpoint(session, stage)
+        resume_from = 0 if checkpoint is None else checkpoint + 1
+        if args.min_id is not None and args.min_id > resume_from:
+            complete = False
+        args.min_id = max(args.min_id or 0, resume_from)
+    elif args.min_id is not None:
+        complete = False
+    return complete
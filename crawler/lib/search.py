@@ -0,0 +1,128 @@
+import base64
+import dataclasses
+import decimal
+import json
+import re
+import typing
+
+from sqlalchemy import Numeric, and_, func, or_, select
+
+from lib.recipes import Ingredient, Recipe, RecipeIngredient
+
+TEXT_SEARCH_CONFIG = "english"
+
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclasses.dataclass
+class SearchResult:
+    id: int
+    name: str
+    description: typing.Optional[str]
+    rank: decimal.Decimal
+
+
+@dataclasses.dataclass
+class SearchPage:
+    results: typing.List[SearchResult]
+    # Pass as `after` to get the next page, None on the last one.
+    cursor: typing.Optional[str]
+
+
+def _encode_cursor(mode: str, result: SearchResult) -> str:
+    return base64.urlsafe_b64encode(json.dumps([mode, str(result.rank), result.id]).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> typing.Tuple[str, decimal.Decimal, int]:
+    try:
+        mode, rank, recipe_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return mode, decimal.Decimal(rank), int(recipe_id)
+    except (ValueError, TypeError, decimal.InvalidOperation) as err:
+        raise ValueError(f"Invalid search cursor: {cursor!r}") from err
+
+
+def prefix_query(text: str) -> typing.Optional[str]:
+    """
+    A tsquery matching every word of `text`, each as a prefix,
+    e.g. "chick curr" -> "chick:* & curr:*".
+    """
+    words = _WORDS.findall(text.lower())
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def _page(session, mode: str, rank, where, limit: int, after) -> SearchPage:
+    # Ranks are rounded so they survive the trip through the cursor exactly.
+    rank = func.round(rank.cast(Numeric), 6)
+    stmt = select(Recipe.id, Recipe.name, Recipe.description, rank).where(where)
+    if after is not None:
+        _, after_rank, after_id = after
+        stmt = stmt.where(or_(rank < after_rank, and_(rank == after_rank, Recipe.id > after_id)))
+    stmt = stmt.order_by(rank.desc(), Recipe.id).limit(limit + 1)
+
+    results = [SearchResult(*row) for row in session.execute(stmt)]
+    cursor = _encode_cursor(mode, results[limit - 1]) if len(results) > limit else None
+    return SearchPage(results[:limit], cursor)
+
+
+def search_recipes(session, text: str, limit: int = 20, after: typing.Optional[str] = None) -> SearchPage:
+    """
+    Recipes whose name, ingredients or description match every word of
+    `text`, best first. When nothing matches, recipes with a name close to
+    `text`, or an ingredient or description with a part close to it, are
+    returned instead, so typos still find something. Pages are keyset
+    paginated: pass the `cursor` of a page as `after`.
+    """
+    decoded = _decode_cursor(after) if after is not None else None
+    mode = decoded[0] if decoded is not None else "text"
+
+    if mode == "text":
+        query = prefix_query(text)
+        if query is None:
+            return SearchPage([], None)
+        tsquery = func.to_tsquery(TEXT_SEARCH_CONFIG, query)
+        page = _page(
+            session,
+            "text",
+            func.ts_rank_cd(Recipe.search_vector, tsquery),
+            Recipe.search_vector.op("@@")(tsquery),
+            limit,
+            decoded,
+        )
+        if page.results or decoded is not None:
+            return page
+
+    text = text.strip()
+    if not text:
+        return SearchPage([], None)
+    ingredients = (
+        select(RecipeIngredient.recipe_id)
+        .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+        .where(RecipeIngredient.recipe_id == Recipe.id)
+    )
+    ingredient_similarity = (
+        ingredients.with_only_columns(func.max(func.word_similarity(text, Ingredient.canonical_name)))
+        .scalar_subquery()
+    )
+    return _page(
+        session,
+        "similar",
+        func.greatest(
+            func.similarity(Recipe.name, text),
+            func.coalesce(ingredient_similarity, 0),
+            func.coalesce(func.word_similarity(text, Recipe.description), 0),
+        ),
+        # Each uses its trigram index. Names are compared whole, with
+        # pg_trgm.similarity_threshold as the cut off. Descriptions and
+        # ingredients are much longer than a query, so `text` only has to be
+        # close to some part of them (`column %> text` is `text <% column`),
+        # with pg_trgm.word_similarity_threshold as the cut off.
+        or_(
+            Recipe.name.op("%")(text),
+            Recipe.description.op("%>")(text),
+            ingredients.where(Ingredient.canonical_name.op("%>")(text)).exists(),
+        ),
+        limit,
+        decoded if mode == "similar" else None,
+    )
@@ -0,0 +1,179 @@
+import dataclasses
+import re
+import typing
+
+from crawler import settings
+
+# Canonical unit name -> the ways recipes spell it.
+UNIT_SPELLINGS: typing.Dict[str, typing.Tuple[str, ...]] = {
+    "teaspoon": ("teaspoon", "teaspoons", "tsp", "tsps", "tsp.", "tspn", "t", "t."),
+    "tablespoon": ("tablespoon", "tablespoons", "tbsp", "tbsps", "tbsp.", "tbs", "tbs.", "tbl", "tbl.", "tblsp", "T", "T."),
+    "cup": ("cup", "cups", "c", "c."),
+    "fluid ounce": ("fluid ounce", "fluid ounces", "fl oz", "fl. oz.", "fl. oz", "fl.oz.", "floz"),
+    "pint": ("pint", "pints", "pt", "pt.", "pts"),
+    "quart": ("quart", "quarts", "qt", "qt.", "qts"),
+    "gallon": ("gallon", "gallons", "gal", "gal."),
+    "milliliter": ("milliliter", "milliliters", "millilitre", "millilitres", "ml", "ml.", "mL"),
+    "liter": ("liter", "liters", "litre", "litres", "l", "L"),
+    "milligram": ("milligram", "milligrams", "mg", "mg."),
+    "gram": ("gram", "grams", "g", "g.", "gr", "gr.", "gm", "gms"),
+    "kilogram": ("kilogram", "kilograms", "kg", "kg.", "kgs", "kilo", "kilos"),
+    "ounce": ("ounce", "ounces", "oz", "oz."),
+    "pound": ("pound", "pounds", "lb", "lb.", "lbs", "lbs."),
+    "pinch": ("pinch", "pinches"),
+    "dash": ("dash", "dashes"),
+    "drop": ("drop", "drops"),
+    "clove": ("clove", "cloves"),
+    "can": ("can", "cans", "tin", "tins"),
+    "jar": ("jar", "jars"),
+    "package": ("package", "packages", "pkg", "pkg.", "packet", "packets", "pack", "packs"),
+    "bag": ("bag", "bags"),
+    "box": ("box", "boxes"),
+    "stick": ("stick", "sticks"),
+    "slice": ("slice", "slices"),
+    "piece": ("piece", "pieces", "pc", "pcs", "whole"),
+    "bunch": ("bunch", "bunches"),
+    "sprig": ("sprig", "sprigs"),
+    "head": ("head", "heads"),
+    "stalk": ("stalk", "stalks"),
+    "handful": ("handful", "handfuls"),
+    "sheet": ("sheet", "sheets"),
+    "fillet": ("fillet", "fillets"),
+}
+
+# Canonical unit -> the unit amounts of it are added up in, and how many of those it is.
+CONVERSIONS: typing.Dict[str, typing.Tuple[str, float]] = {
+    "teaspoon": ("milliliter", 4.92892),
+    "tablespoon": ("milliliter", 14.7868),
+    "cup": ("milliliter", 236.588),
+    "fluid ounce": ("milliliter", 29.5735),
+    "pint": ("milliliter", 473.176),
+    "quart": ("milliliter", 946.353),
+    "gallon": ("milliliter", 3785.41),
+    "milliliter": ("milliliter", 1.0),
+    "liter": ("milliliter", 1000.0),
+    "pinch": ("milliliter", 0.31),
+    "dash": ("milliliter", 0.62),
+    "drop": ("milliliter", 0.05),
+    "milligram": ("gram", 0.001),
+    "gram": ("gram", 1.0),
+    "kilogram": ("gram", 1000.0),
+    "ounce": ("gram", 28.3495),
+    "pound": ("gram", 453.592),
+}
+
+
+_DIMENSIONS = {"milliliter": "volume", "gram": "mass"}
+
+# Single letters where the case is what tells teaspoons and tablespoons apart.
+_CASE_SENSITIVE = {"t", "t.", "T", "T."}
+
+_SPACES = re.compile(r"\s+")
+
+
+@dataclasses.dataclass(frozen=True)
+class Unit:
+    name: str
+    # "volume", "mass" or "count".
+    dimension: str
+    # The unit amounts of this one are added up in, and how many of those one is.
+    base: str
+    factor: float
+
+
+class UnitRegistry:
+    """
+    Maps the many spellings of units to one canonical `Unit` each, with a
+    dimension and a precomputed factor to the base unit of the dimension.
+    Units of the "count" dimension, like cloves or cans, only convert to
+    themselves.
+    """
+
+    def __init__(
+        self,
+        spellings: typing.Dict[str, typing.Iterable[str]],
+        conversions: typing.Dict[str, typing.Tuple[str, float]],
+    ):
+        self.units: typing.Dict[str, Unit] = dict()
+        for name in spellings:
+            base, factor = conversions.get(name, (name, 1.0))
+            self.units[name] = Unit(name, _DIMENSIONS.get(base, "count"), base, factor)
+
+        self._aliases: typing.Dict[str, Unit] = dict()
+        for name, names in spellings.items():
+            unit = self.units[name]
+            self._aliases.setdefault(name, unit)
+            for spelling in names:
+                if spelling in _CASE_SENSITIVE:
+                    self._aliases[spelling] = unit
+                else:
+                    self._aliases.setdefault(spelling.lower(), unit)
+
+    @classmethod
+    def from_settings(cls) -> "UnitRegistry":
+        """
+        The built-in units, plus the extra spellings of `[unit-aliases]`,
+        given as `<spelling> = <canonical unit>`.
+        """
+        spellings = {name: list(names) for name, names in UNIT_SPELLINGS.items()}
+        if "unit-aliases" in settings.config:
+            for spelling, name in settings.config["unit-aliases"].items():
+                spellings.setdefault(name.strip(), []).append(spelling)
+        return cls(spellings, CONVERSIONS)
+
+    @property
+    def aliases(self) -> typing.Dict[str, str]:
+        return {spelling: unit.name for spelling, unit in self._aliases.items()}
+
+    def get(self, name: typing.Optional[str]) -> typing.Optional[Unit]:
+        if not name:
+            return None
+        name = _SPACES.sub(" ", name.strip())
+        if name in _CASE_SENSITIVE:
+            return self._aliases[name]
+        return self._aliases.get(name.lower())
+
+    def normalize(self, name: str) -> str:
+        """
+        The canonical name of `name`, or `name` tidied up if it's unknown.
+        """
+        unit = self.get(name)
+        if unit is not None:
+            return unit.name
+        return _SPACES.sub(" ", name.strip().lower()).rstrip(".")
+
+    def to_base(self, name: str, quantity: typing.Optional[float]) -> typing.Tuple[str, typing.Optional[float]]:
+        unit = self.get(name)
+        if unit is None:
+            return self.normalize(name), quantity
+        return unit.base, None if quantity is None else quantity * unit.factor
+
+    def convert(self, quantity: float, source: str, target: str) -> typing.Optional[float]:
+        """
+        `quantity` of `source` in `target`, or None if they don't convert.
+        """
+        source_unit, target_unit = self.get(source), self.get(target)
+        if source_unit is None or target_unit is None or source_unit.base != target_unit.base:
+            return None
+        return quantity * source_unit.factor / target_unit.factor
+
+
+REGISTRY = UnitRegistry.from_settings()
+
+UNIT_ALIASES: typing.Dict[str, str] = REGISTRY.aliases
+
+
+def canonical_unit(name: typing.Optional[str]) -> typing.Optional[str]:
+    """
+    The canonical name of a unit spelled `name`, or None if it isn't known.
+    """
+    unit = REGISTRY.get(name)
+    return None if unit is None else unit.name
+
+
+def to_base_unit(unit: str, quantity: typing.Optional[float]) -> typing.Tuple[str, typing.Optional[float]]:
+    """
+    Express `quantity` of `unit` in the unit it's added up in. Units that
+    can't be converted, like "clove", are only normalized.
+    """
+    return REGISTRY.to_base(unit, quantity)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Copy the parsed ingredients still held in `chat_gpt3_parsed:{id}` Redis
+keys into the `parsed_ingredients` table, validating them on the way.
+Recipes that already have a row there are left alone.
+"""
+
+import argparse
+import json
+
+import redis
+import structlog
+from sqlalchemy import select
+from tqdm import tqdm
+
+from crawler import settings
+from lib.parsed_ingredients import save_parsed_ingredients, validate
+from lib.recipes import Session, RecipeRaw
+
+logger = structlog.getLogger()
+
+PREFIX = "chat_gpt3_parsed:"
+
+
+cache = redis.StrictRedis(
+    host=settings.config["redis"]["host"],
+    port=settings.config["redis"]["port"]
+)
+
+
+def backfill(keys, dry_run: bool) -> int:
+    if not keys:
+        return 0
+    recipe_ids = [int(key.decode('utf-8')[len(PREFIX):]) for key in keys]
+    values = cache.mget(keys)
+    with Session() as session:
+        # Recipes scraped into another database, or deleted since, can't be referenced.
+        known = set(session.scalars(select(RecipeRaw.id).where(RecipeRaw.id.in_(recipe_ids))))
+        records = {
+            recipe_id: validate(recipe_id, json.loads(value))
+            for recipe_id, value in zip(recipe_ids, values)
+            if value is not None and recipe_id in known
+        }
+        if not dry_run:
+            save_parsed_ingredients(session, records, overwrite=False)
+            session.commit()
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    copied = 0
+    chunk = []
+    with tqdm() as progress:
+        for key in cache.scan_iter(match=f"{PREFIX}*", count=args.chunk_size):
+            chunk.append(key)
+            if len(chunk) >= args.chunk_size:
+                copied += backfill(chunk, args.dry_run)
+                progress.update(len(chunk))
+                chunk = []
+        copied += backfill(chunk, args.dry_run)
+        progress.update(len(chunk))
+    logger.info("Backfilled parsed ingredients.", copied=copied, dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
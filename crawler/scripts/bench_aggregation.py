@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Time shopping lists for random meal plans of recipes that have ingredients.
+"""
+
+import argparse
+import random
+import statistics
+from time import perf_counter
+
+from sqlalchemy import select
+
+from lib.aggregation import shopping_list
+from lib.recipes import Session, RecipeIngredient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recipes", type=int, default=50, help="Recipes per plan.")
+    parser.add_argument("--plans", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with Session() as session:
+        recipe_ids = list(session.scalars(select(RecipeIngredient.recipe_id).distinct()))
+        if len(recipe_ids) < args.recipes:
+            print(f"Only {len(recipe_ids)} recipes have ingredients.")
+            return
+
+        timings = []
+        items = 0
+        for _ in range(args.plans):
+            servings = {recipe_id: rng.choice([0.5, 1, 1, 2, 3]) for recipe_id in rng.sample(recipe_ids, args.recipes)}
+            start = perf_counter()
+            items += len(shopping_list(session, servings))
+            timings.append((perf_counter() - start) * 1000)
+
+    timings.sort()
+    print(f"{args.plans} plans of {args.recipes} recipes, {items / args.plans:.0f} items per list")
+    print(
+        f"p50 {statistics.median(timings):.2f}ms  "
+        f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f}ms  "
+        f"max {timings[-1]:.2f}ms"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Compare parsing a corpus of saved pages the old way (a BeautifulSoup tree
+for the links, plus recipe_scrapers on every page) with the single-pass
+extractor that only hands pages declaring a Recipe to recipe_scrapers.
+"""
+
+import argparse
+import pathlib
+from time import perf_counter
+
+import bs4
+import recipe_scrapers
+
+from crawler.extract import extract_page, has_recipe_schema
+
+
+def soup_path(document: str) -> bool:
+    soup = bs4.BeautifulSoup(document, "html.parser")
+    _ = [anchor.get('href') for anchor in soup.find_all("a")]
+    try:
+        recipe_scrapers.scrape_html(document).to_json()
+    except recipe_scrapers.NoSchemaFoundInWildMode:
+        return False
+    return True
+
+
+def extractor_path(document: str) -> bool:
+    page = extract_page(document)
+    if not has_recipe_schema(page):
+        return False
+    try:
+        recipe_scrapers.scrape_html(document).to_json()
+    except recipe_scrapers.NoSchemaFoundInWildMode:
+        return False
+    return True
+
+
+def links_only_soup(document: str):
+    soup = bs4.BeautifulSoup(document, "html.parser")
+    return [anchor.get('href') for anchor in soup.find_all("a")]
+
+
+def links_only_extractor(document: str):
+    return extract_page(document).hrefs
+
+
+def bench(name, func, documents, repeat):
+    results = None
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        results = [func(document) for document in documents]
+        best = min(best, perf_counter() - start)
+    print(f"{name:<24} {best:>9.3f}s {len(documents) / best:>10.1f} pages/s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("corpus", type=pathlib.Path, help="Directory of saved .html pages.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    documents = [
+        path.read_bytes().decode('utf-8', errors='replace')
+        for path in sorted(args.corpus.glob("**/*.html"))
+    ]
+    print(f"{len(documents)} pages, {sum(map(len, documents)) / 1e6:.1f} MB")
+
+    bench("links: BeautifulSoup", links_only_soup, documents, args.repeat)
+    bench("links: extractor", links_only_extractor, documents, args.repeat)
+    old = bench("page: BeautifulSoup", soup_path, documents, args.repeat)
+    new = bench("page: extractor", extractor_path, documents, args.repeat)
+
+    disagreements = sum(a != b for a, b in zip(old, new))
+    print(f"{sum(old)} recipes found before, {sum(new)} after, {disagreements} pages disagree")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Compare the local ingredient grammar with the answers of the model cached
+under `chat_gpt3_parsed:{id}`, and measure how many lines a second it parses.
+
+Only recipes where the model answered with one ingredient per line are
+compared, since the lines can't be matched up otherwise.
+"""
+
+import argparse
+import json
+import typing
+from time import perf_counter
+
+from lib.ingredient_grammar import parse_line
+from lib.units import canonical_unit
+from scripts.parse_ingredients import _stream_ingredients, cache, ingredients_to_parse
+
+
+def _quantity(value: typing.Any) -> typing.Optional[float]:
+    try:
+        return round(float(value), 3)
+    except (TypeError, ValueError):
+        return None
+
+
+def _unit(value: typing.Any) -> typing.Optional[str]:
+    if not isinstance(value, str):
+        return None
+    return canonical_unit(value) or value.strip().lower()
+
+
+def _name(value: typing.Any) -> typing.Optional[str]:
+    if not isinstance(value, str):
+        return None
+    return value.strip().lower()
+
+
+def load_pairs(limit: int) -> typing.List[typing.Tuple[str, typing.Dict[str, typing.Any]]]:
+    pairs = []
+    for chunk in _stream_ingredients(chunk_size=1000):
+        recipes = [(row.id, ingredients_to_parse(row.id, row.language, row.ingredients)) for row in chunk]
+        recipes = [(recipe_id, lines) for recipe_id, lines in recipes if lines]
+        if not recipes:
+            continue
+        cached = cache.mget([f"chat_gpt3_parsed:{recipe_id}" for recipe_id, _ in recipes])
+        for (_, lines), value in zip(recipes, cached):
+            if value is None:
+                continue
+            answer = json.loads(value)
+            if not isinstance(answer, list) or len(answer) != len(lines):
+                continue
+            pairs.extend(
+                (line, expected) for line, expected in zip(lines, answer) if isinstance(expected, dict)
+            )
+            if len(pairs) >= limit:
+                return pairs[:limit]
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--limit", type=int, default=50000, help="Compare at most this many lines.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 1.0])
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.limit)
+    lines = [line for line, _ in pairs]
+    if not lines:
+        print("No cached answers to compare with.")
+        return
+
+    best = float('inf')
+    parsed = []
+    for _ in range(args.repeat):
+        start = perf_counter()
+        parsed = [parse_line(line) for line in lines]
+        best = min(best, perf_counter() - start)
+    print(f"{len(lines)} lines in {best:.3f}s, {len(lines) / best:.0f} lines/s")
+
+    print(f"{'min confidence':>14} {'coverage':>9} {'quantity':>9} {'unit':>9} {'name':>9} {'all':>9}")
+    for threshold in args.thresholds:
+        confident = [
+            (result, expected)
+            for result, (_, expected) in zip(parsed, pairs)
+            if result.confidence >= threshold
+        ]
+        if not confident:
+            print(f"{threshold:>14.2f} {0:>9.1%}")
+            continue
+        quantity = unit = name = exact = 0
+        for result, expected in confident:
+            same_quantity = _quantity(result.quantity) == _quantity(expected.get("quantity"))
+            same_unit = _unit(result.unit) == _unit(expected.get("unit"))
+            same_name = _name(result.canonical_name) == _name(expected.get("canonical_name"))
+            quantity += same_quantity
+            unit += same_unit
+            name += same_name
+            exact += same_quantity and same_unit and same_name
+        total = len(confident)
+        print(
+            f"{threshold:>14.2f} {total / len(pairs):>9.1%} {quantity / total:>9.1%} "
+            f"{unit / total:>9.1%} {name / total:>9.1%} {exact / total:>9.1%}"
+        )
+
+
+if __name__ == '__main__':
+    main()
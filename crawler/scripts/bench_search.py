@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Time recipe search against a synthetic corpus built in a scratch schema,
+with the same search column and indexes as the recipe table.
+
+The scratch schema is put first on the search_path of the benchmark's
+connection, so lib.search runs unchanged against it.
+"""
+
+import argparse
+import random
+import statistics
+from time import perf_counter
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from lib.recipes import engine
+from lib.search import search_recipes
+
+SCHEMA = "search_bench"
+
+WORDS = [
+    "chicken", "beef", "pork", "tofu", "salmon", "shrimp", "lentil", "chickpea", "rice", "noodle",
+    "pasta", "potato", "tomato", "onion", "garlic", "ginger", "lemon", "lime", "basil", "cilantro",
+    "curry", "stew", "soup", "salad", "roast", "grilled", "baked", "spicy", "creamy", "crispy",
+    "honey", "maple", "chocolate", "vanilla", "cinnamon", "apple", "banana", "berry", "coconut", "almond",
+    "mushroom", "spinach", "kale", "pepper", "cheese", "butter", "yogurt", "bread", "cake", "cookie",
+]
+
+
+def build(connection, rows: int, seed: int):
+    connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    connection.execute(text(
+        f"CREATE TABLE {SCHEMA}.recipe (id integer PRIMARY KEY, name text, description text, search_vector tsvector)"
+    ))
+    connection.execute(text("SELECT setseed(:seed)"), dict(seed=seed / 2 ** 31))
+    # Names of three words, descriptions of twelve, and five ingredient words weighted like the real column.
+    # The subqueries refer to `id` so they're evaluated, and random, for every row.
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO {SCHEMA}.recipe (id, name, description, search_vector)
+            SELECT id, name, description,
+                   setweight(to_tsvector('english', name), 'A')
+                || setweight(to_tsvector('english', ingredients), 'B')
+                || setweight(to_tsvector('english', description), 'C')
+            FROM (
+                SELECT id,
+                       (SELECT string_agg(words[1 + floor(random() * cardinality(words))::int], ' ')
+                        FROM generate_series(1, 3) WHERE id > 0) AS name,
+                       (SELECT string_agg(words[1 + floor(random() * cardinality(words))::int], ' ')
+                        FROM generate_series(1, 12) WHERE id > 0) AS description,
+                       (SELECT string_agg(words[1 + floor(random() * cardinality(words))::int], ' ')
+                        FROM generate_series(1, 5) WHERE id > 0) AS ingredients
+                FROM generate_series(1, :rows) AS id, (SELECT CAST(:words AS text[]) AS words) vocabulary
+            ) generated
+            """
+        ),
+        dict(rows=rows, words=WORDS),
+    )
+    connection.execute(text(f"CREATE INDEX ON {SCHEMA}.recipe USING gin (search_vector)"))
+    connection.execute(text(f"CREATE INDEX ON {SCHEMA}.recipe USING gin (name gin_trgm_ops)"))
+    connection.execute(text(f"CREATE INDEX ON {SCHEMA}.recipe USING gin (description gin_trgm_ops)"))
+    connection.execute(text(f"ANALYZE {SCHEMA}.recipe"))
+
+
+def typo(word: str, rng: random.Random) -> str:
+    position = rng.randrange(len(word))
+    return word[:position] + word[position + 1:]
+
+
+def bench(session, name: str, queries, pages: int):
+    timings = []
+    found = 0
+    for query in queries:
+        cursor = None
+        for _ in range(pages):
+            start = perf_counter()
+            page = search_recipes(session, query, after=cursor)
+            timings.append((perf_counter() - start) * 1000)
+            found += len(page.results)
+            cursor = page.cursor
+            if cursor is None:
+                break
+    timings.sort()
+    print(
+        f"{name:<24} {len(timings):>5} pages  {found / max(1, len(timings)):>5.1f} results/page  "
+        f"p50 {statistics.median(timings):>7.2f}ms  p95 {timings[int(len(timings) * 0.95) - 1]:>7.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=3, help="Pages fetched per query.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reuse", action="store_true", help="Search the corpus of an earlier run.")
+    parser.add_argument("--keep", action="store_true", help="Don't drop the scratch schema afterwards.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with engine.connect() as connection:
+        if not args.reuse:
+            start = perf_counter()
+            build(connection, args.rows, args.seed)
+            connection.commit()
+            print(f"Built {args.rows} recipes in {perf_counter() - start:.1f}s")
+
+        connection.execute(text(f"SET search_path TO {SCHEMA}, public"))
+        with Session(bind=connection) as session:
+            bench(session, "one word", [rng.choice(WORDS) for _ in range(args.queries)], args.pages)
+            bench(session, "two words", [" ".join(rng.sample(WORDS, 2)) for _ in range(args.queries)], args.pages)
+            bench(session, "prefix", [rng.choice(WORDS)[:3] for _ in range(args.queries)], args.pages)
+            bench(
+                session,
+                "typo (name similarity)",
+                [" ".join(typo(word, rng) for word in rng.sample(WORDS, 2)) for _ in range(args.queries)],
+                args.pages,
+            )
+
+        if not args.keep:
+            connection.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+            connection.commit()
+
+
+if __name__ == '__main__':
+    main()
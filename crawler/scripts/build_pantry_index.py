@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Build the pantry index from recipe_ingredient and write its snapshot, or
+time queries against the snapshot with --bench.
+"""
+
+import argparse
+import random
+import statistics
+from time import perf_counter
+
+from crawler import settings
+from lib.pantry_index import PantryIndex
+from lib.recipes import Session
+
+
+def bench(index: PantryIndex, queries: int, pantry_size: int, k: int, seed: int):
+    rng = random.Random(seed)
+    # Draw pantries from ingredients weighted by how many recipes use them, like real pantries.
+    ingredients = [
+        ingredient_id
+        for ingredient_id, count in index.ingredient_counts().items()
+        for _ in range(min(100, count))
+    ]
+    for name, query in (
+        ("containing all of 2", lambda pantry: index.containing_all(pantry[:2], limit=50)),
+        (f"missing at most {k}", lambda pantry: index.missing_at_most(pantry, k, limit=50)),
+        (f"missing at most {k}, 1 allergen", lambda pantry: index.missing_at_most(pantry[1:], k, pantry[:1], limit=50)),
+    ):
+        timings = []
+        for _ in range(queries):
+            pantry = list({rng.choice(ingredients) for _ in range(pantry_size)})
+            start = perf_counter()
+            query(pantry)
+            timings.append((perf_counter() - start) * 1e6)
+        timings.sort()
+        print(
+            f"{name:<32} p50 {statistics.median(timings):>8.1f}us  "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:>8.1f}us"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--snapshot", default=settings.config.get("pantry-index", "snapshot", fallback="pantry_index.msgpack"))
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--pantry-size", type=int, default=15)
+    parser.add_argument("-k", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.bench:
+        start = perf_counter()
+        index = PantryIndex.load(args.snapshot)
+        print(f"Loaded {len(index)} recipes in {perf_counter() - start:.2f}s")
+        bench(index, args.queries, args.pantry_size, args.k, args.seed)
+        return
+
+    start = perf_counter()
+    with Session() as session:
+        index = PantryIndex.build(session)
+    index.save(args.snapshot)
+    print(f"Indexed {len(index)} recipes in {perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
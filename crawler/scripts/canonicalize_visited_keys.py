@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Re-key the `visited__{url}` entries in Redis under their canonical URL,
+keeping the remaining TTL of the original key.
+"""
+
+import argparse
+
+import redis
+import structlog
+from tqdm import tqdm
+
+from crawler import settings
+from crawler.dedupe import VisitedLinks
+from crawler.urls import canonicalize_url
+
+logger = structlog.getLogger()
+
+PREFIX = VisitedLinks.key("")
+
+
+cache = redis.StrictRedis(
+    host=settings.config["redis"]["host"],
+    port=settings.config["redis"]["port"]
+)
+
+
+def rekey(keys, dry_run: bool) -> int:
+    renames = []
+    for key in keys:
+        key = key.decode('utf-8')
+        canonical = VisitedLinks.key(canonicalize_url(key[len(PREFIX):]))
+        if canonical != key:
+            renames.append((key, canonical))
+    if not renames or dry_run:
+        return len(renames)
+
+    pipe = cache.pipeline(transaction=False)
+    for key, _ in renames:
+        pipe.pttl(key)
+    ttls = pipe.execute()
+
+    pipe = cache.pipeline(transaction=False)
+    for (key, canonical), ttl in zip(renames, ttls):
+        if ttl == -2:
+            # Expired in the meantime.
+            continue
+        # An existing canonical key is kept as is, it was visited more recently.
+        pipe.set(canonical, 1, px=ttl if ttl > 0 else None, nx=True)
+        pipe.delete(key)
+    pipe.execute()
+    return len(renames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    renamed = 0
+    chunk = []
+    with tqdm() as progress:
+        for key in cache.scan_iter(match=f"{PREFIX}*", count=args.chunk_size):
+            chunk.append(key)
+            if len(chunk) >= args.chunk_size:
+                renamed += rekey(chunk, args.dry_run)
+                progress.update(len(chunk))
+                chunk = []
+        renamed += rekey(chunk, args.dry_run)
+        progress.update(len(chunk))
+    logger.info("Re-keyed visited links.", renamed=renamed, dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,7 @@ import typing
 
 import httpx
 import math
-import bs4
 import urllib.parse
-import json
-import recipe_scrapers
 from time import perf_counter
 
 import structlog
@@ -21,7 +18,12 @@ from crawler.models import (
     Link
 )
 from crawler import settings
-from crawler.queue_processors import QueueProcessor
+from crawler.dedupe import VisitedLinks
+from crawler.http_cache import HttpCache
+from crawler.parsing import DocumentParser, ParsedDocument
+from crawler.politeness import HostScheduler
+from crawler.queue_processors import QueueProcessor, WorkItem
+from crawler.urls import canonicalize_url
 
 logger = structlog.getLogger()
 
@@ -39,6 +41,10 @@ class Crawler(QueueProcessor):
     read_topic = "links"
     client: typing.Optional[httpx.AsyncClient] = None
     group_id = "crawler"
+    scheduler: typing.Optional[HostScheduler[WorkItem]] = None
+    visited: typing.Optional[VisitedLinks] = None
+    http_cache: typing.Optional[HttpCache] = None
+    parser: typing.Optional[DocumentParser] = None
 
     def __init__(self):
         super().__init__()
@@ -46,26 +52,70 @@ class Crawler(QueueProcessor):
             follow_redirects=True,
             timeout=30,
         )
+        self.visited = VisitedLinks(
+            self.async_cache,
+            period=CRAWL_RECENCY_PERIOD,
+            bloom_capacity=settings.config.getint("dedupe", "bloom_capacity", fallback=1_000_000),
+            bloom_error_rate=settings.config.getfloat("dedupe", "bloom_error_rate", fallback=0.001),
+            rebuild_interval=settings.config.getfloat("dedupe", "bloom_rebuild_interval", fallback=3600),
+        )
+        self.parser = DocumentParser(
+            workers=settings.config.getint("parser", "workers", fallback=4),
+            timeout=settings.config.getfloat("parser", "timeout", fallback=20),
+            max_timeouts=settings.config.getint("parser", "max_timeouts", fallback=3),
+        )
+        if settings.config.get("http-cache", "directory", fallback=None):
+            self.http_cache = HttpCache(
+                settings.config["http-cache"]["directory"],
+                max_entries=settings.config.getint("http-cache", "max_entries"),
+            )
+
+    def create_work_queue(self) -> HostScheduler[WorkItem]:
+        self.scheduler = HostScheduler(
+            key=lambda item: item.message.hostname,
+            rate=settings.config.getfloat("crawler", "host_rate", fallback=1.0),
+            burst=settings.config.getfloat("crawler", "host_burst", fallback=5),
+            max_concurrency=settings.config.getint("crawler", "host_concurrency", fallback=2),
+            min_rate=settings.config.getfloat("crawler", "host_min_rate", fallback=0.05),
+            max_pending_per_host=settings.config.getint("crawler", "host_max_pending", fallback=8),
+            max_size=settings.config.getint("crawler", "max_buffered", fallback=4096),
+            stats=stats,
+        )
+        return self.scheduler
 
     @stats.timer('crawl')
     async def crawl(self, link: Link) -> typing.Optional[CrawlResult]:
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml,application/xml',
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/114.0'
-        }
-        if link.metadata:
-            referrer = link.metadata.get("referrer", None)
-            if referrer:
-                headers["referrer"] = referrer
-
-        if self.cache.get(f"visited__{link.url}"):
-            stats.incr(f'duplicate_url,hostname={link.hostname}')
-
-        start_time = perf_counter()
-        response = await self.client.get(
-            link.url,
-            headers=headers
-        )
+        status_code, retry_after = None, None
+        # Links are handed to us by the scheduler, which needs the slot back
+        # whatever happens before the response is in.
+        try:
+            headers = {
+                'Accept': 'text/html,application/xhtml+xml,application/xml',
+                'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/114.0'
+            }
+            if link.metadata:
+                referrer = link.metadata.get("referrer", None)
+                if referrer:
+                    headers["referrer"] = referrer
+
+            if await self.async_cache.exists(VisitedLinks.key(link.canonical_url)):
+                stats.incr(f'duplicate_url,hostname={link.hostname}')
+
+            cached = None
+            if self.http_cache is not None:
+                cached = await self.http_cache.lookup(link.canonical_url)
+                if cached is not None:
+                    headers.update(cached.conditional_headers())
+
+            start_time = perf_counter()
+            response = await self.client.get(
+                link.url,
+                headers=headers
+            )
+            status_code, retry_after = response.status_code, response.headers.get('Retry-After')
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.release(link.hostname, status_code, retry_after)
         end_time = perf_counter()
         crawl_timestamp = datetime.datetime.now()
         elapsed = end_time - start_time
@@ -86,6 +136,15 @@ class Crawler(QueueProcessor):
 
         stats.incr(f'scraped_bytes,hostname={link.hostname}', count=len(response.content))
 
+        if self.http_cache is not None:
+            not_modified = cached is not None and response.status_code == httpx.codes.NOT_MODIFIED
+            stats.incr(f'http_cache,hit={not_modified},hostname={link.hostname}')
+            if not_modified:
+                # Nothing changed since the last crawl, so neither did the recipe or its links.
+                stats.incr(f'http_cache_bytes_saved,hostname={link.hostname}', count=cached.size)
+                await self.http_cache.touch(link.canonical_url)
+                return
+
         if not response.is_success:
             logger.error("Crawl failed", url=link.url, status=response.status_code)
             stats.incr(f'failed_crawls,status={response.status_code},hostname={link.hostname}')
@@ -96,87 +155,118 @@ class Crawler(QueueProcessor):
             elapsed_time=elapsed,
             contents=response.content,
             status_code=response.status_code,
-            timestamp=crawl_timestamp.isoformat()
+            timestamp=crawl_timestamp.isoformat(),
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
         )
         return result
 
+    async def remember_validators(self, link: Link, crawl_result: CrawlResult):
+        """
+        Make the next crawl of `link` conditional. Only done once its recipe
+        and links were sent on, since a 304 skips sending them again.
+        """
+        if self.http_cache is None:
+            return
+        await self.http_cache.store(
+            link.canonical_url,
+            etag=crawl_result.etag,
+            last_modified=crawl_result.last_modified,
+            size=len(crawl_result.contents),
+        )
+
     @stats.timer('has_link_been_visited_recently')
-    def has_link_been_visited_recently(self, url: str) -> bool:
-        if self.cache.get(f"visited__{url}"):
-            return True
-        self.cache.set(f"visited__{url}", 1, ex=CRAWL_RECENCY_PERIOD)
-        return False
+    async def has_link_been_visited_recently(self, url: str) -> bool:
+        return not await self.visited.mark_visited([canonicalize_url(url)])
 
     def is_url_nofollow(self, url: str, crawl_result: CrawlResult):  # noqa
-        return url == crawl_result.url
+        return url == canonicalize_url(crawl_result.url)
 
     @stats.timer('get_links')
-    def get_links(self, crawl_result: CrawlResult) -> typing.Generator[Link, None, None]:
-        soup = bs4.BeautifulSoup(crawl_result.contents.decode('utf-8'))
-        for anchor in soup.find_all("a"):
-            url = anchor.get('href', None)
-            if not url:
-                continue
-            url = urllib.parse.urljoin(crawl_result.url, url)
-            hostname = urllib.parse.urlparse(url).hostname or 'unknown'
-            if self.is_url_nofollow(url, crawl_result):
+    async def get_links(self, crawl_result: CrawlResult, urls: typing.Iterable[str]) -> typing.List[Link]:
+        # The canonical form is only the dedupe key, the page is fetched as linked.
+        candidates = dict()
+        for url in urls:
+            canonical_url = canonicalize_url(url)
+            if self.is_url_nofollow(canonical_url, crawl_result):
                 continue
-            if self.has_link_been_visited_recently(url):
+            candidates.setdefault(canonical_url, url)
+
+        unvisited = set(await self.visited.mark_visited(list(candidates)))
+        links = []
+        for canonical_url, url in candidates.items():
+            if canonical_url not in unvisited:
+                hostname = urllib.parse.urlparse(canonical_url).hostname or 'unknown'
                 stats.incr(f'prevented_duplicate_url,hostname={hostname}')
                 continue
-            yield Link(url=url, metadata={'referrer': crawl_result.url})
+            links.append(Link(url=url, metadata={'referrer': crawl_result.url}))
+        return links
 
     @stats.timer('decode_message')
     def decode_message(self, message: typing.Union[bytes, str]) -> Link:
-        if isinstance(message, bytes):
-            message = message.decode('utf-8')
-        return Link(**json.loads(message))
+        return Link.from_dict(self.codec.decode(message))
 
     @stats.timer('scrape_recipe_from_crawl_result')
-    async def try_scraping_recipe_from_crawl_result(self, crawl_result: CrawlResult) -> bool:
+    async def try_scraping_recipe_from_crawl_result(
+        self,
+        crawl_result: CrawlResult,
+        deliveries: typing.List[asyncio.Future],
+    ) -> typing.Optional[ParsedDocument]:
+        if crawl_result.contents is None:
+            stats.incr(f'crawls_without_content,hostname={crawl_result.hostname}')
+            return None
         try:
-            if crawl_result.contents is None:
-                stats.incr(f'crawls_without_content,hostname={crawl_result.hostname}')
-                return False
-            contents = crawl_result.contents.decode('utf-8')
-        except UnicodeError:
+            logger.debug("Trying to scrape recipe:", url=crawl_result.url)
+            document = await self.parser.parse(crawl_result.url, crawl_result.contents)
+        except asyncio.TimeoutError:
+            logger.error("Timed out parsing crawl result.", url=crawl_result.url)
+            stats.incr(f'parse_timeouts,hostname={crawl_result.hostname}')
+            return None
+
+        if document.error == "invalid_utf8":
             logger.error(f"Crawl for {crawl_result.url} yielded non-utf8 contents.")
             stats.incr(f'crawls_with_invalid_utf8_contents,hostname={crawl_result.hostname}')
-            return False
-        try:
-            logger.debug("Trying to scrape recipe:", url=crawl_result.url)
-            scraped = recipe_scrapers.scrape_html(contents)
-            stats.incr(f'recipe_scrapes,success=True,hostname={crawl_result.hostname}')
-        except recipe_scrapers.NoSchemaFoundInWildMode as exc:
+            return None
+        if document.recipe is None:
             logger.warn(
                 f"Failed to scrape URL.",
-                url=exc.url,
-                message=exc.message
+                url=crawl_result.url,
+                message=document.error
             )
             stats.incr(f'recipe_scrapes,success=False,hostname={crawl_result.hostname}')
-            return False
-        else:
-            scraped_contents = json.dumps(scraped.to_json())
-            logger.debug(
-                "Found recipe:",
-                author=scraped.author(),
-                url=scraped.url
-            )
-            await self.producer.send('recipes', scraped_contents.encode('utf-8'))
-            return True
+            return None
+
+        stats.incr(f'recipe_scrapes,success=True,hostname={crawl_result.hostname}')
+        logger.debug(
+            "Found recipe:",
+            author=document.recipe.get('author'),
+            url=crawl_result.url
+        )
+        deliveries.append(await self.send('recipes', document.recipe))
+        return document
 
     async def process_message(self, link: Link):
         logger.debug("Processing message:", link=link)
         crawl_result = await self.crawl(link)
         if crawl_result is None:
             return
-        could_scrape_recipe = await self.try_scraping_recipe_from_crawl_result(crawl_result)
-        if could_scrape_recipe:
+        deliveries = []
+        document = await self.try_scraping_recipe_from_crawl_result(crawl_result, deliveries)
+        if document is not None:
             links_found = 0
-            for link in self.get_links(crawl_result):
+            for found in await self.get_links(crawl_result, document.links):
                 links_found += 1
-                await self.producer.send('links', link.model_dump_json().encode('utf-8'))
+                deliveries.append(await self.send('links', found.to_dict()))
             stats.incr(f'outbound_links_discovered,hostname={crawl_result.hostname}', count=links_found)
+            # Raises if any of them couldn't be delivered, leaving the next crawl unconditional.
+            await asyncio.gather(*deliveries)
+            await self.remember_validators(link, crawl_result)
+
+    async def run(self):
+        try:
+            await super().run()
+        finally:
+            self.parser.shutdown()
 
 
 def main():
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Find scraped recipes that are near duplicates of one seen before, e.g. the
+same recipe syndicated across sites, and record them in recipe_duplicate
+so the later stages skip them.
+
+With --batch the scraped_recipe table is gone through in id order,
+otherwise new recipes are checked as they arrive on the 'recipes' topic.
+"""
+
+import argparse
+import asyncio
+import typing
+
+import redis
+import structlog
+from tqdm import tqdm
+
+from crawler import settings
+from crawler.queue_processors import QueueProcessor
+from lib.near_duplicates import Match, MinHasher, RedisLSH, recipe_tokens
+from lib.recipes import (
+    Session,
+    RecipeRaw,
+    add_range_arguments,
+    count_raw_recipes,
+    resolve_range,
+    save_checkpoint,
+    save_duplicates,
+    stream_raw_recipes,
+)
+
+logger = structlog.get_logger()
+
+STAGE = "dedupe_recipes"
+
+
+def create_lsh(cache: redis.Redis) -> RedisLSH:
+    return RedisLSH(
+        cache,
+        MinHasher(num_perm=settings.config.getint("near-duplicates", "num_perm", fallback=128)),
+        bands=settings.config.getint("near-duplicates", "bands", fallback=16),
+        threshold=settings.config.getfloat("near-duplicates", "threshold", fallback=0.8),
+    )
+
+
+def signature_of(lsh: RedisLSH, title: typing.Optional[str], ingredients: typing.Any) -> bytes:
+    return lsh.hasher.signature(recipe_tokens(title, ingredients if isinstance(ingredients, list) else None))
+
+
+class RecipeDeduper(QueueProcessor):
+    read_topic = 'recipes'
+    group_id = 'dedupe_recipes'
+
+    def __init__(self):
+        super().__init__()
+        self.lsh = create_lsh(self.cache)
+
+    def _match(self, message: typing.Dict[str, typing.Any]) -> typing.Optional[Match]:
+        url = (message.get("canonical_url") or "").strip()
+        if not url:
+            return None
+        signature = signature_of(self.lsh, message.get("title"), message.get("ingredients"))
+        return self.lsh.add_many([(url, signature)])[0]
+
+    @staticmethod
+    def _save(match: Match):
+        with Session() as session:
+            save_duplicates(session, [match])
+            session.commit()
+
+    async def process_message(self, message: typing.Dict[str, typing.Any]):
+        match = await asyncio.to_thread(self._match, message)
+        if match is None or match.canonical_url is None:
+            return
+        logger.info("Near duplicate recipe.", url=match.url, canonical_url=match.canonical_url)
+        await asyncio.to_thread(self._save, match)
+
+
+def dedupe_batch(lsh: RedisLSH, rows) -> typing.List[Match]:
+    recipes = []
+    for row in rows:
+        url = (row.url or "").strip()
+        if url:
+            recipes.append((url, signature_of(lsh, row.title, row.ingredients)))
+    return lsh.add_many(recipes)
+
+
+def run_batch(args: argparse.Namespace):
+    cache = redis.StrictRedis(
+        host=settings.config["redis"]["host"],
+        port=settings.config["redis"]["port"]
+    )
+    lsh = create_lsh(cache)
+    duplicates = 0
+    with Session() as session:
+        checkpointed = resolve_range(session, args, STAGE)
+        chunks = stream_raw_recipes(
+            RecipeRaw.id,
+            RecipeRaw.payload["title"].as_string().label("title"),
+            RecipeRaw.payload["canonical_url"].as_string().label("url"),
+            RecipeRaw.payload["ingredients"].label("ingredients"),
+            chunk_size=args.chunk_size,
+            min_id=args.min_id,
+            max_id=args.max_id,
+            since=args.since,
+        )
+        with tqdm(total=count_raw_recipes(args.min_id, args.max_id, args.since)) as progress:
+            for chunk in chunks:
+                matches = dedupe_batch(lsh, chunk)
+                save_duplicates(session, matches)
+                if checkpointed:
+                    save_checkpoint(session, STAGE, chunk[-1].id)
+                session.commit()
+                duplicates += sum(match.canonical_url is not None for match in matches)
+                progress.update(len(chunk))
+                progress.set_postfix(duplicates=duplicates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch", action="store_true")
+    add_range_arguments(parser)
+    args = parser.parse_args()
+
+    if args.batch:
+        run_batch(args)
+        return
+    asyncio.get_event_loop().run_until_complete(RecipeDeduper().run())
+
+
+if __name__ == '__main__':
+    main()
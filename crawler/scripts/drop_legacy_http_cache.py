@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Delete the response bodies that the HTTP cache stored before it only kept
+validators, from `[http-cache] directory` unless another one is given.
+"""
+
+import argparse
+
+import structlog
+
+from crawler import settings
+from crawler.http_cache import drop_legacy_entries
+
+logger = structlog.getLogger()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--directory", default=settings.config.get("http-cache", "directory", fallback=None))
+    args = parser.parse_args()
+    if not args.directory:
+        parser.error("No http cache directory configured.")
+
+    if drop_legacy_entries(args.directory):
+        logger.info("Dropped legacy http cache entries.", directory=args.directory)
+    else:
+        logger.info("No legacy http cache entries.", directory=args.directory)
+
+
+if __name__ == '__main__':
+    main()
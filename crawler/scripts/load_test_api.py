@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Load test the read API (lib/api.py) running against a local Postgres,
+e.g. one started with `uvicorn lib.api:app --workers 1`.
+
+Recipe ids are drawn from the recipe table, and requests are a mix of
+recipe details, list pages, shopping lists and searches, sent by a fixed
+number of concurrent clients for a fixed time.
+"""
+
+import argparse
+import asyncio
+import collections
+import random
+import statistics
+import typing
+from time import perf_counter
+
+import httpx
+from sqlalchemy import select
+
+from lib.recipes import Recipe, Session
+
+SEARCHES = ["chicken", "chocolate cake", "tomato soup", "garlic", "lemon", "curry", "pasta", "salad"]
+
+
+def _requests(recipe_ids: typing.List[int], rng: random.Random, max_recipes: int):
+    yield "detail", lambda client: client.get(f"/recipes/{rng.choice(recipe_ids)}")
+    yield "list", lambda client: client.get("/recipes", params=dict(after=rng.choice(recipe_ids)))
+    yield "shopping list", lambda client: client.post("/shopping-list", json=dict(servings={
+        recipe_id: rng.choice([1, 2]) for recipe_id in rng.sample(recipe_ids, rng.randint(1, min(max_recipes, len(recipe_ids))))
+    }))
+    yield "search", lambda client: client.get("/search", params=dict(q=rng.choice(SEARCHES)))
+
+
+async def _client(
+    client: httpx.AsyncClient,
+    requests: typing.List[typing.Tuple[str, typing.Callable]],
+    weights: typing.List[float],
+    rng: random.Random,
+    deadline: float,
+    timings: typing.Dict[str, typing.List[float]],
+    errors: typing.Counter[str],
+):
+    while perf_counter() < deadline:
+        name, request = rng.choices(requests, weights)[0]
+        start = perf_counter()
+        try:
+            response = await request(client)
+            if response.status_code >= 400:
+                errors[f"{name}: {response.status_code}"] += 1
+                continue
+        except httpx.HTTPError as err:
+            errors[f"{name}: {type(err).__name__}"] += 1
+            continue
+        timings[name].append((perf_counter() - start) * 1000)
+
+
+def report(timings: typing.Dict[str, typing.List[float]], errors: typing.Counter[str], duration: float):
+    total = sum(len(samples) for samples in timings.values())
+    print(f"{total} requests in {duration:.1f}s, {total / duration:.0f} requests/s, {sum(errors.values())} errors")
+    for name, samples in sorted(timings.items()):
+        samples.sort()
+        print(
+            f"{name:<16} {len(samples):>7}  p50 {statistics.median(samples):>7.2f}ms  "
+            f"p95 {samples[int(len(samples) * 0.95) - 1]:>7.2f}ms  p99 {samples[int(len(samples) * 0.99) - 1]:>7.2f}ms"
+        )
+    for error, count in errors.most_common():
+        print(f"{error:<32} {count:>7}")
+
+
+async def run(args: argparse.Namespace, recipe_ids: typing.List[int]):
+    rng = random.Random(args.seed)
+    requests = list(_requests(recipe_ids, rng, args.max_shopping_list_recipes))
+    weights = [args.detail, args.list, args.shopping_list, args.search]
+    timings: typing.Dict[str, typing.List[float]] = collections.defaultdict(list)
+    errors: typing.Counter[str] = collections.Counter()
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        start = perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            _client(client, requests, weights, random.Random(rng.random()), deadline, timings, errors)
+            for _ in range(args.concurrency)
+        ))
+        report(timings, errors, perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds.")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds.")
+    parser.add_argument("--recipes", type=int, default=1000, help="How many recipe ids to draw requests from.")
+    parser.add_argument("--max-shopping-list-recipes", type=int, default=7)
+    parser.add_argument("--detail", type=float, default=0.6, help="Share of recipe detail requests.")
+    parser.add_argument("--list", type=float, default=0.15, help="Share of list page requests.")
+    parser.add_argument("--shopping-list", type=float, default=0.15, help="Share of shopping list requests.")
+    parser.add_argument("--search", type=float, default=0.1, help="Share of search requests.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with Session() as session:
+        recipe_ids = list(session.scalars(select(Recipe.id).order_by(Recipe.id).limit(args.recipes)))
+    if not recipe_ids:
+        parser.error("There are no recipes to request.")
+    asyncio.run(run(args, recipe_ids))
+
+
+if __name__ == '__main__':
+    main()
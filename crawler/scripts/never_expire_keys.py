@@ -1,21 +1,65 @@
 #!/usr/bin/env python
+"""
+Set the expiry of Redis keys by pattern, walking the keyspace with SCAN.
 
+Without --pattern the `[ttl:<pattern>]` rules of settings.ini are applied.
+With --periodically they are applied again every `[ttl] interval` seconds,
+which is meant to be done by one process per Redis.
+"""
+
+import argparse
+import asyncio
 import datetime
 
-import redis
+import redis.asyncio
+
 from crawler import settings
+from crawler.ttl import TTLManager, TTLRule, ttl_rules_from_settings
 
 
-cache = redis.StrictRedis(
-    host=settings.config["redis"]["host"],
-    port=settings.config["redis"]["port"]
-)
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pattern", action="append", default=[], help="May be given more than once.")
+    parser.add_argument("--ttl", type=int, default=60 * 60 * 24 * 180, help="Seconds, for --pattern.")
+    parser.add_argument(
+        "--only-persistent",
+        action="store_true",
+        help="Only set an expiry on keys that have none, for --pattern."
+    )
+    parser.add_argument("--chunk-size", type=int, default=settings.config.getint("ttl", "chunk_size", fallback=1000))
+    parser.add_argument(
+        "--max-keys-per-second",
+        type=float,
+        default=settings.config.getfloat("ttl", "max_keys_per_second", fallback=0.0) or None
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--periodically", action="store_true", help="Keep applying the rules every [ttl] interval.")
+    args = parser.parse_args()
 
+    if args.pattern:
+        rules = [
+            TTLRule(pattern, datetime.timedelta(seconds=args.ttl), only_persistent=args.only_persistent)
+            for pattern in args.pattern
+        ]
+    else:
+        rules = ttl_rules_from_settings()
 
-if __name__ == '__main__':
-    keys = cache.keys('chat_gpt3_parsed:*')
-    pipe = cache.pipeline(transaction=True)
-    for key in keys:
-        pipe.expire(key.decode('utf-8'), datetime.timedelta(days=180))
-    pipe.execute(raise_on_error=True)
+    cache = redis.asyncio.Redis(
+        host=settings.config["redis"]["host"],
+        port=settings.config["redis"]["port"]
+    )
+    manager = TTLManager(
+        cache,
+        rules,
+        chunk_size=args.chunk_size,
+        max_keys_per_second=args.max_keys_per_second,
+        dry_run=args.dry_run,
+    )
+    if args.periodically:
+        asyncio.run(manager.run_periodically(settings.config.getfloat("ttl", "interval", fallback=3600)))
+    else:
+        asyncio.run(manager.run_once())
 
+
+if __name__ == '__main__':
+    main()
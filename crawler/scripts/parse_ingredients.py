@@ -1,7 +1,7 @@
 #!/usr/bin/env python
+import asyncio
 import dataclasses
 import datetime
-import json
 import logging
 import os
 import sys
@@ -9,13 +9,30 @@ import typing
 import re
 
 import openai
+from sqlalchemy import select
 from lib.recipes import (
     Session,
     RecipeRaw,
+    add_range_arguments,
+    count_raw_recipes,
+    resolve_range,
+    save_checkpoint,
+    stream_raw_recipes,
+)
+from lib.ingredient_cache import IngredientLineCache
+from lib.ingredient_grammar import parse_line
+from lib.ingredient_parsing import IngredientParser
+from lib.parsed_ingredients import (
+    due_parse_failures,
+    parsed_recipe_ids,
+    save_parse_failures,
+    save_parsed_ingredients,
+    validate,
 )
+from lib.partitions import Lease, Partition, add_partition_arguments, run_stage_partitioned
 from crawler import settings
-from sqlalchemy import select
 from tqdm import tqdm
+import argparse
 import redis
 import structlog
 import logging
@@ -38,54 +55,127 @@ structlog.configure()
 logger: structlog.stdlib.BoundLogger = structlog.get_logger()
 
 
-def main():
-    with Session(autoflush=True) as session:
-        for raw in tqdm(session.scalars(select(RecipeRaw)).all()):
-            parse_ingredients(raw)
-        session.rollback()
+STAGE = "parse_ingredients"
 
 
-IGNORE_INGREDIENTS = {
-    "Butter",
-    "Ice",
-    "Salt"
-}
+def _stream_ingredients(**kwargs):
+    return stream_raw_recipes(
+        RecipeRaw.id,
+        RecipeRaw.payload["language"].as_string().label("language"),
+        RecipeRaw.payload["ingredients"].label("ingredients"),
+        skip_duplicates=True,
+        **kwargs
+    )
 
 
-def ask_chat_gpt_to_parse_ingredients(recipe_id: int, raw_ingredients: typing.Iterable[str], cache: redis.StrictRedis):
-    """
+def _stream_due_failures(chunk_size: int):
+    with Session() as session:
+        recipe_ids = due_parse_failures(session)
+    for start in range(0, len(recipe_ids), chunk_size):
+        with Session() as session:
+            yield session.execute(
+                select(
+                    RecipeRaw.id,
+                    RecipeRaw.payload["language"].as_string().label("language"),
+                    RecipeRaw.payload["ingredients"].label("ingredients"),
+                )
+                .where(RecipeRaw.id.in_(recipe_ids[start:start + chunk_size]))
+                .order_by(RecipeRaw.id)
+            ).all()
 
-    @return:
-    """
 
-    prompt = f"""Given the following free form ingredients for a recipe, transform each of these into four
-    categories called "quantity" (as a float or null), a "unit", "canonical_name", and "extra_notes". Please 
-    only return valid JSON data and no other text in the response.
-    
+def create_parser(processes: int = 1) -> IngredientParser:
+    """
+    The configured rate limits are shared by `processes` parsers.
     """
+    config = settings.config["openai"]
+    return IngredientParser(
+        model=config.get("model", "text-davinci-003"),
+        api_base=config.get("api_base", None),
+        concurrency=config.getint("concurrency", 8),
+        requests_per_minute=config.getfloat("requests_per_minute", 3000) / processes,
+        tokens_per_minute=config.getfloat("tokens_per_minute", 250000) / processes,
+        max_prompt_tokens=config.getint("max_prompt_tokens", 1500),
+        max_completion_tokens=config.getint("max_completion_tokens", 2000),
+        max_attempts=config.getint("max_attempts", 5),
+    )
 
-    for ingredient in raw_ingredients:
-        prompt += "- " + ingredient + "\n"
 
-    try:
-        response = openai.Completion.create(
-            model="text-davinci-003",
-            prompt=prompt,
-            max_tokens=1000
+async def _parse_chunks(chunks, processes: int = 1, progress: typing.Optional[tqdm] = None, on_chunk=None) -> int:
+    ingredient_parser = create_parser(processes)
+    count = 0
+    asked = 0
+    for chunk in chunks:
+        asked += await parse_ingredients(ingredient_parser, chunk)
+        count += len(chunk)
+        if on_chunk is not None:
+            on_chunk(chunk)
+        if progress is not None:
+            progress.set_postfix(line_cache_hit_rate=f"{line_cache.hit_rate:.1%}", asked=asked)
+            progress.update(len(chunk))
+    logger.info("Parsed ingredients.", recipes=count, lines_asked=asked, **line_cache.stats())
+    return count
+
+
+def process_partition(
+    partition: Partition,
+    since: typing.Optional[datetime.datetime] = None,
+    processes: int = 1,
+    lease: typing.Optional[Lease] = None,
+) -> int:
+    chunks = _stream_ingredients(min_id=partition.min_id, max_id=partition.max_id, since=since)
+    if lease is not None:
+        chunks = lease.guard(chunks)
+    return asyncio.run(_parse_chunks(chunks, processes=processes))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_range_arguments(parser)
+    add_partition_arguments(parser)
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Only parse the recipes that failed to before and are due to be tried again. "
+             "Their ids are older than the checkpoint, so run write_cleaned_data_to_db over them afterwards."
+    )
+    args = parser.parse_args()
+
+    if args.retry_failed:
+        asyncio.run(_parse_chunks(_stream_due_failures(args.chunk_size)))
+        return
+
+    with Session() as session:
+        checkpointed = resolve_range(session, args, STAGE)
+        if args.processes:
+            failed, max_id = run_stage_partitioned(cache, STAGE, args, process_partition, processes=args.processes)
+            if failed:
+                logger.error("Gave up on partitions.", partitions=[partition.key for partition in failed])
+            elif checkpointed and max_id is not None:
+                save_checkpoint(session, STAGE, max_id)
+                session.commit()
+            return
+
+        def on_chunk(chunk):
+            if checkpointed:
+                save_checkpoint(session, STAGE, chunk[-1].id)
+                session.commit()
+
+        chunks = _stream_ingredients(
+            chunk_size=args.chunk_size,
+            min_id=args.min_id,
+            max_id=args.max_id,
+            since=args.since,
         )
-    except openai.error.OpenAIError as err:
-        logger.exception(f"OpenAI error: {err}", recipe_id=recipe_id)
-        cache.rpush(f"chat_gpt_parse_error", recipe_id)
-        raise
+        with tqdm(total=count_raw_recipes(args.min_id, args.max_id, args.since)) as progress:
+            asyncio.run(_parse_chunks(chunks, progress=progress, on_chunk=on_chunk))
 
-    choices = response.get("choices", [])
-    if not len(choices):
-        return None
-    contents = choices[0]["text"]
-    try:
-        return json.loads(contents)
-    except Exception:  # noqa
-        return None
+
+IGNORE_INGREDIENTS = {
+    "Butter",
+    "Ice",
+    "Salt"
+}
 
 
 def skip_stop_words(raw_ingredient: str):
@@ -99,43 +189,154 @@ def skip_stop_words(raw_ingredient: str):
     return True
 
 
-def parse_ingredients(recipe: RecipeRaw) -> typing.List[typing.Dict[str, typing.Any]]:
+def ingredients_to_parse(
+    recipe_id: int,
+    language: typing.Optional[str],
+    raw_ingredients: typing.Optional[typing.List[typing.Any]]
+) -> typing.List[str]:
     """
 
-    @param recipe:
+    @param recipe_id:
+    @param language:
+    @param raw_ingredients:
     @return:
     """
 
     # Only look at english recipes for now.
-    if not recipe.payload["language"].startswith("en-"):
+    if not (language or "").startswith("en-"):
         logger.error(
           "Rejecting recipe because it is not English",
-          language=recipe.scraped_extra["language"],
-          recipe=recipe.id
+          language=language,
+          recipe=recipe_id
         )
         return []
 
-    ingredients_to_parse = list(filter(
+    return list(filter(
         skip_stop_words,
-        map(str, recipe.payload["ingredients"])  # noqa
+        map(str, raw_ingredients or [])  # noqa
     ))
-    if not len(ingredients_to_parse):
-        return []
 
-    parsed_ingredients = cache.get(f"chat_gpt3_parsed:{recipe.id}")
-    if parsed_ingredients is None:
-        parsed_ingredients = ask_chat_gpt_to_parse_ingredients(recipe.id, ingredients_to_parse, cache=cache)
-        if not parsed_ingredients:
-            logger.error(
-                "GPT-3 failed to parse ingredients.",
-                recipe=recipe.id,
-                ingredients_to_parse=ingredients_to_parse
-            )
-        cache.setex(f"chat_gpt3_parsed:{recipe.id}", datetime.timedelta(days=180), json.dumps(parsed_ingredients))
-    else:
-        parsed_ingredients = json.loads(parsed_ingredients or [])
-
-    return parsed_ingredients
+
+MIN_CONFIDENCE = settings.config.getfloat("ingredient-parser", "min_confidence", fallback=0.8)
+
+line_cache = IngredientLineCache(
+    cache,
+    lru_size=settings.config.getint("ingredient-parser", "lru_size", fallback=100000)
+)
+
+
+async def _ask_chat_gpt_to_parse_lines(
+    ingredient_parser: IngredientParser,
+    recipe_id: int,
+    lines: typing.List[str]
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """
+    Ask about `lines` on behalf of `recipe_id` and cache every line that was
+    answered. Lines missing from the result couldn't be matched to an answer.
+    """
+    parsed_ingredients = await ingredient_parser.parse(recipe_id, lines)
+    if not isinstance(parsed_ingredients, list) or len(parsed_ingredients) != len(lines):
+        logger.error(
+            "GPT-3 failed to parse ingredients.",
+            recipe=recipe_id,
+            ingredients_to_parse=lines
+        )
+        return dict()
+    parsed_lines = {
+        line: parsed
+        for line, parsed in zip(lines, parsed_ingredients)
+        if isinstance(parsed, dict)
+    }
+    line_cache.put_many(parsed_lines)
+    return parsed_lines
+
+
+async def _ask_many(
+    ingredient_parser: IngredientParser,
+    requests: typing.List[typing.Tuple[int, typing.List[str]]],
+    resolved: typing.Dict[str, typing.Dict[str, typing.Any]],
+) -> typing.Set[str]:
+    """
+    Ask all `requests` at once and add the answers to `resolved`. Returns
+    the lines of the requests that failed with an OpenAI error.
+    """
+    results = await asyncio.gather(
+        *[_ask_chat_gpt_to_parse_lines(ingredient_parser, recipe_id, lines) for recipe_id, lines in requests],
+        return_exceptions=True
+    )
+    failed: typing.Set[str] = set()
+    for (recipe_id, lines), result in zip(requests, results):
+        if isinstance(result, openai.error.OpenAIError):
+            logger.error(f"OpenAI error: {result}", recipe_id=recipe_id)
+            failed.update(lines)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            resolved.update(result)
+    return failed
+
+
+async def parse_ingredients(ingredient_parser: IngredientParser, rows: typing.List[typing.Any]) -> int:
+    """
+    Make sure `parsed_ingredients` holds the validated ingredients of every
+    recipe in `rows`. Lines the local grammar is confident about are parsed
+    in process, the rest come from the line cache, and the lines that aren't
+    cached yet are asked about once for the whole chunk, then one by one if
+    that didn't answer them. Returns how many lines were sent to the model.
+    """
+    recipes = [(row.id, ingredients_to_parse(row.id, row.language, row.ingredients)) for row in rows]
+    recipes = [(recipe_id, lines) for recipe_id, lines in recipes if lines]
+    if not recipes:
+        return 0
+    with Session() as session:
+        parsed = parsed_recipe_ids(session, [recipe_id for recipe_id, _ in recipes])
+    recipes = [(recipe_id, lines) for recipe_id, lines in recipes if recipe_id not in parsed]
+
+    resolved: typing.Dict[str, typing.Dict[str, typing.Any]] = dict()
+    uncertain: typing.Set[str] = set()
+    for _, lines in recipes:
+        for line in lines:
+            if line in resolved or line in uncertain:
+                continue
+            parsed = parse_line(line)
+            if parsed.confidence >= MIN_CONFIDENCE:
+                resolved[line] = parsed.as_dict()
+            else:
+                uncertain.add(line)
+    resolved.update(line_cache.get_many(uncertain))
+
+    # Every line nobody has answered yet is asked about once, for the first recipe that has it.
+    requests: typing.Dict[int, typing.List[str]] = dict()
+    asked: typing.Set[str] = set()
+    for recipe_id, lines in recipes:
+        for line in lines:
+            if line not in resolved and line not in asked:
+                asked.add(line)
+                requests.setdefault(recipe_id, []).append(line)
+    await _ask_many(ingredient_parser, list(requests.items()), resolved)
+
+    # Lines of a request that failed, or whose answer didn't line up, are asked about
+    # again one by one, so a bad request only costs the recipes having the bad line.
+    retries = [(recipe_id, [line]) for recipe_id, lines in requests.items() for line in lines if line not in resolved]
+    failed = await _ask_many(ingredient_parser, retries, resolved)
+
+    records = dict()
+    failures = []
+    for recipe_id, lines in recipes:
+        if any(line in failed for line in lines):
+            cache.rpush(f"chat_gpt_parse_error", recipe_id)
+        parsed_ingredients = [resolved.get(line) for line in lines]
+        if any(parsed is None for parsed in parsed_ingredients):
+            # Tried again later, see --retry-failed.
+            failures.append(recipe_id)
+            continue
+        records[recipe_id] = validate(recipe_id, parsed_ingredients)
+
+    with Session() as session:
+        save_parsed_ingredients(session, records)
+        save_parse_failures(session, failures)
+        session.commit()
+    return len(asked) + len(retries)
 
 
 if __name__ == '__main__':
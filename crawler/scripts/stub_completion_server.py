@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+A stand-in for the completion API to run parse_ingredients against locally.
+
+Point `[openai] api_base` at http://localhost:<port>/v1. Every ingredient
+line comes back as its own canonical name, after an optional delay, and a
+share of requests can be made to fail with a 429 to exercise retries.
+"""
+
+import argparse
+import http.server
+import json
+import random
+import re
+import time
+
+RECIPE_HEADER = re.compile(r"^Recipe (\d+):$")
+
+
+def answer(prompt: str):
+    recipes = {}
+    current = None
+    for line in prompt.splitlines():
+        header = RECIPE_HEADER.match(line.strip())
+        if header:
+            current = recipes.setdefault(header.group(1), [])
+        elif current is not None and line.startswith("- "):
+            current.append({
+                "quantity": None,
+                "unit": None,
+                "canonical_name": line[2:].strip(),
+                "extra_notes": None,
+            })
+    return recipes
+
+
+def make_handler(delay: float, failure_rate: float):
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_POST(self):  # noqa
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(delay)
+            if random.random() < failure_rate:
+                self._respond(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+                return
+            self._respond(200, {
+                "id": "cmpl-stub",
+                "object": "text_completion",
+                "model": body.get("model"),
+                "choices": [{"text": json.dumps(answer(body.get("prompt", ""))), "index": 0}],
+            })
+
+        def _respond(self, status: int, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds every completion takes.")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(("localhost", args.port), make_handler(args.delay, args.failure_rate))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
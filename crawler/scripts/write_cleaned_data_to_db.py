@@ -1,22 +1,35 @@
 #!/usr/bin/env python
 
-import dataclasses
+import argparse
+import datetime
+import os
 import typing
 import sys
-from sqlalchemy import select
+from sqlalchemy import select, delete, insert
+from sqlalchemy.dialects import postgresql
 
 from lib.recipes import (
     Session,
     RecipeRaw,
+    add_range_arguments,
+    count_raw_recipes,
+    get_checkpoint,
+    resolve_range,
+    save_checkpoint,
+    stream_raw_recipes,
     Recipe,
     RecipeIngredient,
     Ingredient,
     MeasurementUnit
 )
+from lib.pantry_index import PantryIndex
+from lib.parsed_ingredients import load_parsed_ingredients
+from lib.recipe_versions import bump_recipe_versions
+from lib.units import REGISTRY as UNITS
+from lib.partitions import Lease, Partition, add_partition_arguments, run_stage_partitioned
 from tqdm import tqdm
 from crawler import settings
 import redis
-import json
 import structlog
 import logging
 
@@ -37,91 +50,236 @@ cache = redis.StrictRedis(
 )
 
 
-def get_ingredients(recipe_id: int) -> typing.Optional[typing.List[typing.Dict[str, typing.Any]]]:
-    value = cache.get(f"chat_gpt3_parsed:{recipe_id}")
-    if value is not None:
-        return json.loads(value.decode('utf-8'))
+def _normalize_name(name: str) -> str:
+    return name.strip().lower()
 
-@dataclasses.dataclass
-class ParsedIngredient:
-    quantity: typing.Optional[float]
-    unit: typing.Optional[str]
-    canonical_name: typing.Optional[str]
-    extra_notes: typing.Optional[str]
 
+class NameIds:
+    """
+    An in-memory mirror of a table mapping unique names to ids, that
+    creates the names it hasn't seen in bulk.
 
-def main():
-    with Session(autoflush=True) as session:
-        for raw in tqdm(session.scalars(select(RecipeRaw)).all()):
-            parsed_ingredients = get_ingredients(raw.id)
-            if parsed_ingredients is None:
-                continue
-            if isinstance(parsed_ingredients, dict):
-                parsed_ingredients = list(parsed_ingredients.values())
-                if len(parsed_ingredients) == 1:
-                    parsed_ingredients = parsed_ingredients[0]
-                if len(parsed_ingredients) == 1:
-                    continue
-
-            for parsed_ingredient in parsed_ingredients:
-                try:
-                    ingredient = ParsedIngredient(**parsed_ingredient)
-                except TypeError as err:
-                    logger.error(f"malformed data generated by GPT-3: {err}", recipe=raw.id)
-                    continue
-
-                if ingredient.canonical_name is None:
-                    logger.error("Canonical name does not exist.", ingredient=ingredient, recipe=raw.id)
-                    continue
-                if ingredient.unit is None:
-                    logger.error("No unit exists.", ingredient=ingredient, recipe=raw.id)
-                    continue
-
-                ingredient_record = _get_or_create_ingredient(session, ingredient.canonical_name)
-                unit_record = _get_or_create_measurement_unit(session, ingredient.unit)
-                recipe_record = parse_recipe(session, raw)
-
-                recipe_ingredient_record = RecipeIngredient(
-                    recipe_id=recipe_record.id,
-                    ingredient_id=ingredient_record.id,
-                    measurement_unit_id=unit_record.id,
-                    quantity=ingredient.quantity,
-                    extra_notes=ingredient.extra_notes
-                )
-                session.add(recipe_ingredient_record)
-
-        session.commit()
-
-
-def _get_or_create_ingredient(session, name: str) -> Ingredient:
-    stmt = (
-        select(Ingredient)
-        .where(Ingredient.canonical_name == name.strip().lower())
-    )
-    row = session.scalar(stmt)
-    if row:
-        return row
+    Tables too large to mirror whole aren't `preload`ed, the names at hand
+    are `fetch`ed instead.
+    """
+
+    def __init__(self, session, model, column, preload: bool = True):
+        self.model = model
+        self.column = column
+        self.ids: typing.Dict[str, int] = dict()
+        if preload:
+            self.ids.update(session.execute(select(column, model.id)).all())
+
+    def missing(self, names: typing.Iterable[str]) -> typing.Set[str]:
+        return {name for name in names if name not in self.ids}
+
+    def fetch(self, session, names: typing.Iterable[str]):
+        unknown = self.missing(names)
+        if unknown:
+            self.ids.update(
+                session.execute(select(self.column, self.model.id).where(self.column.in_(unknown))).all()
+            )
+
+    def create(self, session, names: typing.Set[str]):
+        if not names:
+            return
+        stmt = (
+            postgresql.insert(self.model)
+            # Sorted, so concurrent writers lock the same names in the same order rather than deadlock.
+            .values([{self.column.key: name} for name in sorted(names)])
+            .on_conflict_do_nothing(index_elements=[self.column.key])
+            .returning(self.column, self.model.id)
+        )
+        self.ids.update(session.execute(stmt).all())
+        # Rows created by someone else in the meantime aren't returned above.
+        self.fetch(session, names)
+
+
+class Lookups:
+
+    def __init__(self, session):
+        self.ingredient_ids = NameIds(session, Ingredient, Ingredient.canonical_name)
+        self.unit_ids = NameIds(session, MeasurementUnit, MeasurementUnit.name)
+        # One row per recipe, only the urls of the batch at hand are looked up.
+        self.recipe_ids = NameIds(session, Recipe, Recipe.url, preload=False)
 
-    row = Ingredient(canonical_name=name.strip().lower())
-    session.add(row)
-    return row
+    def fetch_recipes(self, session, urls: typing.Iterable[str]):
+        # Forgets the previous batch's, so the mirror doesn't grow into the whole table.
+        self.recipe_ids.ids.clear()
+        self.recipe_ids.fetch(session, urls)
 
+    def create_recipes(self, session, recipes: typing.List[typing.Dict[str, typing.Any]]):
+        if not recipes:
+            return
+        stmt = (
+            postgresql.insert(Recipe)
+            .values(sorted(recipes, key=lambda recipe: recipe["url"]))
+            .on_conflict_do_nothing(index_elements=[Recipe.url.key])
+            .returning(Recipe.url, Recipe.id)
+        )
+        self.recipe_ids.ids.update(session.execute(stmt).all())
+        self.recipe_ids.fetch(session, (recipe["url"] for recipe in recipes))
 
-def _get_or_create_measurement_unit(session, name: str) -> Ingredient:
-    stmt = (
-        select(MeasurementUnit)
-        .where(MeasurementUnit.name == name.strip().lower())
+
+def write_batch(session, batch: typing.List[RecipeRaw], lookups: Lookups) -> typing.Dict[int, typing.Set[int]]:
+    """
+    Write the recipes of `batch` and their ingredients, and return the
+    ingredient ids of every recipe whose ingredients were rewritten.
+    """
+    new_recipes = dict()
+    candidates = []
+    parsed_ingredients = load_parsed_ingredients(session, [raw.id for raw in batch])
+    recipes = [
+        (raw.id, parse_recipe(raw), parsed_ingredients[raw.id])
+        for raw in batch if parsed_ingredients.get(raw.id)
+    ]
+    lookups.fetch_recipes(session, (recipe["url"] for _, recipe, _ in recipes))
+    for raw_id, recipe, ingredients in recipes:
+        if recipe["url"] not in lookups.recipe_ids.ids:
+            new_recipes.setdefault(recipe["url"], recipe)
+        candidates.append((raw_id, recipe["url"], ingredients))
+
+    lookups.create_recipes(session, list(new_recipes.values()))
+
+    rows = []
+    for raw_id, url, ingredients in candidates:
+        if lookups.recipe_ids.ids[url] != raw_id:
+            # The same page scraped again, the recipe's ingredients come from the first scrape.
+            continue
+        for ingredient in ingredients:
+            rows.append({
+                "recipe_id": raw_id,
+                "ingredient": _normalize_name(ingredient.canonical_name),
+                "unit": UNITS.normalize(ingredient.unit),
+                "quantity": ingredient.quantity,
+                "extra_notes": ingredient.extra_notes,
+            })
+
+    lookups.ingredient_ids.create(session, lookups.ingredient_ids.missing(row["ingredient"] for row in rows))
+    lookups.unit_ids.create(session, lookups.unit_ids.missing(row["unit"] for row in rows))
+
+    rewritten: typing.Dict[int, typing.Set[int]] = dict()
+    for row in rows:
+        row["ingredient_id"] = lookups.ingredient_ids.ids[row["ingredient"]]
+        rewritten.setdefault(row["recipe_id"], set()).add(row["ingredient_id"])
+    if not rewritten:
+        return rewritten
+    session.execute(delete(RecipeIngredient).where(RecipeIngredient.recipe_id.in_(rewritten)))
+    session.execute(
+        insert(RecipeIngredient),
+        [
+            {
+                "recipe_id": row["recipe_id"],
+                "ingredient_id": row["ingredient_id"],
+                "measurement_unit_id": lookups.unit_ids.ids[row["unit"]],
+                "quantity": row["quantity"],
+                "extra_notes": row["extra_notes"],
+            }
+            for row in rows
+        ]
     )
-    row = session.scalar(stmt)
-    if row:
-        return row
+    return rewritten
+
+
+STAGE = "write_cleaned_data"
+PARSE_STAGE = "parse_ingredients"
+
+
+def _stream_recipes(**kwargs):
+    return stream_raw_recipes(RecipeRaw.id, RecipeRaw.payload, skip_duplicates=True, **kwargs)
 
-    record = MeasurementUnit(name=name.strip().lower())
-    session.add(record)
-    return record
 
+PANTRY_INDEX_SNAPSHOT = settings.config.get("pantry-index", "snapshot", fallback=None)
 
-def parse_recipe(session, raw: RecipeRaw) -> Recipe:
+
+def _load_pantry_index(session) -> typing.Optional[PantryIndex]:
+    if not PANTRY_INDEX_SNAPSHOT:
+        return None
+    if os.path.exists(PANTRY_INDEX_SNAPSHOT):
+        return PantryIndex.load(PANTRY_INDEX_SNAPSHOT)
+    return PantryIndex.build(session)
+
+
+_lookups: typing.Optional[Lookups] = None
+
+
+def process_partition(
+    partition: Partition,
+    since: typing.Optional[datetime.datetime] = None,
+    lease: typing.Optional[Lease] = None,
+) -> int:
+    global _lookups
+    count = 0
+    with Session(autoflush=True) as session:
+        if _lookups is None:
+            _lookups = Lookups(session)
+        try:
+            chunks = _stream_recipes(min_id=partition.min_id, max_id=partition.max_id, since=since)
+            if lease is not None:
+                chunks = lease.guard(chunks)
+            for chunk in chunks:
+                rewritten = write_batch(session, chunk, _lookups)
+                session.commit()
+                bump_recipe_versions(cache, rewritten)
+                count += len(chunk)
+        except Exception:
+            # Ids created in the rolled back chunk must not be reused.
+            _lookups = None
+            raise
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_range_arguments(parser)
+    add_partition_arguments(parser)
+    args = parser.parse_args()
+
+    with Session(autoflush=True) as session:
+        checkpointed = resolve_range(session, args, STAGE)
+        if args.resume and args.max_id is None:
+            # Recipes whose ingredients haven't been parsed yet are left for the next run.
+            args.max_id = get_checkpoint(session, PARSE_STAGE)
+
+        if args.processes:
+            failed, max_id = run_stage_partitioned(cache, STAGE, args, process_partition)
+            if failed:
+                logger.error("Gave up on partitions.", partitions=[partition.key for partition in failed])
+            elif checkpointed and max_id is not None:
+                save_checkpoint(session, STAGE, max_id)
+                session.commit()
+            if PANTRY_INDEX_SNAPSHOT:
+                # The partitions were written by other processes, start over from the table.
+                PantryIndex.build(session).save(PANTRY_INDEX_SNAPSHOT)
+            return
+
+        chunks = _stream_recipes(
+            chunk_size=args.chunk_size,
+            min_id=args.min_id,
+            max_id=args.max_id,
+            since=args.since,
+        )
+        lookups = Lookups(session)
+        pantry_index = _load_pantry_index(session)
+
+        try:
+            with tqdm(total=count_raw_recipes(args.min_id, args.max_id, args.since)) as progress:
+                for chunk in chunks:
+                    rewritten = write_batch(session, chunk, lookups)
+                    if checkpointed:
+                        save_checkpoint(session, STAGE, chunk[-1].id)
+                    session.commit()
+                    bump_recipe_versions(cache, rewritten)
+                    if pantry_index is not None:
+                        for recipe_id, ingredient_ids in rewritten.items():
+                            pantry_index.set_recipe(recipe_id, ingredient_ids)
+                    progress.update(len(chunk))
+        finally:
+            if pantry_index is not None:
+                pantry_index.save(PANTRY_INDEX_SNAPSHOT)
+
+
+def parse_recipe(raw: RecipeRaw) -> typing.Dict[str, typing.Any]:
     contents = dict(raw.payload)
     name = contents.pop("title", None)
     url = contents.pop("canonical_url", None)
@@ -129,17 +287,7 @@ def parse_recipe(session, raw: RecipeRaw) -> Recipe:
     instructions = contents.pop("instructions_list", None)
     extra = contents
 
-    # Get the recipe by url initially.
-    recipe_stmt = (
-        select(Recipe)
-        .where(Recipe.url == url.strip())
-    )
-
-    recipe = session.scalar(recipe_stmt)
-    if recipe:
-        return recipe
-
-    recipe = Recipe(
+    return dict(
         id=raw.id,
         url=url.strip(),
         name=name.strip(),
@@ -147,8 +295,6 @@ def parse_recipe(session, raw: RecipeRaw) -> Recipe:
         instructions=instructions,
         scraped_extra=extra
     )
-    session.add(recipe)
-    return recipe
 
 
 if __name__ == '__main__':
@@ -1,18 +1,18 @@
 import aiokafka
-import psycopg2
-from psycopg2.extras import Json
-from psycopg2.extensions import register_adapter
+import asyncpg
+import sqlalchemy.exc
 
 import asyncio
 import typing
+from crawler.batching import MicroBatcher
+from crawler.codecs import MsgpackCodec
+from crawler.database import health_check
 from crawler.queue_processors import QueueProcessor
 from crawler import settings
 import json
 import statsd
 import structlog
 
-register_adapter(dict, Json)
-
 logger = structlog.get_logger()
 
 stats = statsd.StatsClient(
@@ -20,14 +20,29 @@ stats = statsd.StatsClient(
     port=int(settings.config["statsd"]["port"]),
     prefix=settings.config["statsd"]["prefix"]
 )
-db = psycopg2.connect(
-    database=settings.config["postgres"]["database"],
-    host=settings.config["postgres"]["host"],
-    user=settings.config["postgres"]["user"],
-    password=settings.config["postgres"]["password"],
-    port=int(settings.config["postgres"]["port"]),
+
+
+# Errors that say nothing about the recipes, so writing them again later may work.
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.OperatorInterventionError,
+    asyncpg.InsufficientResourcesError,
+    asyncpg.SerializationError,
+    asyncpg.DeadlockDetectedError,
+    sqlalchemy.exc.OperationalError,
+    sqlalchemy.exc.InterfaceError,
+    sqlalchemy.exc.TimeoutError,
 )
-cursor = db.cursor()
+
+# Errors caused by the recipes themselves, e.g. text Postgres won't store.
+PERMANENT_ERRORS = (asyncpg.PostgresError, sqlalchemy.exc.SQLAlchemyError, TypeError, ValueError)
+
+DEAD_LETTER_KEY = "recipes_dead_letter"
 
 
 class RecipeCollector(QueueProcessor):
@@ -35,25 +50,83 @@ class RecipeCollector(QueueProcessor):
     group_id = 'persist_recipes_to_postgres'
     from_beginning = False
 
-    INSERT_RECIPE_SQL = """
-    INSERT INTO recipes (payload)
-    VALUES (%s);
-    """
+    table = 'recipes'
+
+    MAX_RETRY_DELAY = 30
 
     def __init__(self, from_beginning=False):
         super().__init__()
         self.from_beginning = from_beginning
+        self.batcher = MicroBatcher(
+            self.write_batch,
+            max_size=settings.config.getint("recipe-collector", "batch_size", fallback=500),
+            max_delay=settings.config.getint("recipe-collector", "batch_max_delay_ms", fallback=250) / 1000,
+        )
+        # Every message waits in process_message until its batch is written,
+        # so there need to be enough workers to fill a batch.
+        self.concurrency = max(self.concurrency, self.batcher.max_size)
+        self.max_pending = max(self.max_pending, self.concurrency)
 
     @stats.timer('decode_message')
     def decode_message(self, message: typing.Union[bytes, str]) -> typing.Dict[str, typing.Any]:
-        if isinstance(message, bytes):
-            message = message.decode('utf-8')
-        return json.loads(message)
+        return self.codec.decode(message)
+
+    async def _copy_recipes(self, messages: typing.List[typing.Dict[str, typing.Any]]):
+        async with self.database.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            # A single COPY is atomic, so there is no transaction to manage.
+            await raw_connection.driver_connection.copy_records_to_table(
+                self.table,
+                records=[(json.dumps(message),) for message in messages],
+                columns=['payload'],
+            )
+
+    async def _copy_until_written(self, messages: typing.List[typing.Dict[str, typing.Any]]):
+        delay = 1
+        while True:
+            try:
+                await self._copy_recipes(messages)
+            except TRANSIENT_ERRORS as exc:
+                logger.exception("Failed to write recipes, retrying.", exception=exc, batch_size=len(messages))
+                stats.incr('failed_recipe_batches')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.MAX_RETRY_DELAY)
+            else:
+                stats.incr('recipes_written', count=len(messages))
+                return
+
+    async def _dead_letter(self, message: typing.Dict[str, typing.Any], exc: Exception):
+        logger.error("Recipe can't be written, dead lettering it.", exception=exc, url=message.get("canonical_url"))
+        stats.incr('dead_lettered_recipes')
+        await self.async_cache.rpush(DEAD_LETTER_KEY, MsgpackCodec().encode({"error": repr(exc), "message": message}))
+
+    async def _write(self, messages: typing.List[typing.Dict[str, typing.Any]]):
+        try:
+            await self._copy_until_written(messages)
+        except PERMANENT_ERRORS as exc:
+            # Halve the batch until the recipes that can't be written are on their own.
+            if len(messages) == 1:
+                await self._dead_letter(messages[0], exc)
+                return
+            middle = len(messages) // 2
+            await self._write(messages[:middle])
+            await self._write(messages[middle:])
+
+    @stats.timer('write_recipes_batch_to_postgres')
+    async def write_batch(self, messages: typing.List[typing.Dict[str, typing.Any]]):
+        # Offsets are only committed once process_message returns, so a batch
+        # is retried until it is written, or its bad recipes dead lettered,
+        # rather than dropped.
+        await self._write(messages)
 
     @stats.timer('write_recipe_to_postgres')
     async def process_message(self, message: typing.Dict[str, typing.Any]):
-        cursor.execute(self.INSERT_RECIPE_SQL, (message,))
-        db.commit()
+        await self.batcher.submit(message)
+
+    async def run(self):
+        if not await health_check(self.database):
+            logger.error("Postgres is not reachable, batches will be retried until it is.")
+        await super().run()
 
     async def setup_consumer(self):
         await super().setup_consumer()
@@ -0,0 +1,31 @@
+import pytest
+from starlette.exceptions import HTTPException
+
+from lib.api import MAX_SHOPPING_LIST_RECIPES, _servings
+
+
+def test_servings():
+    assert _servings({"servings": {"1": 2, "7": "0.5"}}) == {1: 2.0, 7: 0.5}
+
+
+@pytest.mark.parametrize("payload", [
+    None,
+    [],
+    {},
+    {"servings": {}},
+    {"servings": [1, 2]},
+    {"servings": {"one": 1}},
+    {"servings": {"1": "a lot"}},
+    {"servings": {"1": None}},
+    {"servings": {"1": 0}},
+    {"servings": {"1": -2}},
+    {"servings": {"1": float("nan")}},
+    {"servings": {"1": "NaN"}},
+    {"servings": {"1": float("inf")}},
+    {"servings": {"1": "-Infinity"}},
+    {"servings": {str(recipe_id): 1 for recipe_id in range(MAX_SHOPPING_LIST_RECIPES + 1)}},
+])
+def test_invalid_servings(payload):
+    with pytest.raises(HTTPException) as raised:
+        _servings(payload)
+    assert raised.value.status_code == 400
@@ -0,0 +1,30 @@
+import json
+
+import msgpack
+import pytest
+
+from crawler.codecs import MARKER, SCHEMA_VERSION, JsonCodec, MsgpackCodec
+
+VALUE = {"url": "https://example.com/recipe", "metadata": {"referrer": None, "depth": 2}}
+
+
+@pytest.mark.parametrize("writer", [JsonCodec(), MsgpackCodec()])
+@pytest.mark.parametrize("reader", [JsonCodec(), MsgpackCodec()])
+def test_every_codec_reads_every_format(writer, reader):
+    assert reader.decode(writer.encode(VALUE)) == VALUE
+
+
+def test_msgpack_records_have_a_header():
+    data = MsgpackCodec().encode(VALUE)
+    assert data[:2] == bytes((MARKER, SCHEMA_VERSION))
+    assert msgpack.unpackb(data[2:], raw=False) == VALUE
+
+
+def test_reads_json_strings():
+    assert MsgpackCodec().decode(json.dumps(VALUE)) == VALUE
+
+
+def test_rejects_newer_schema_versions():
+    data = bytes((MARKER, SCHEMA_VERSION + 1)) + msgpack.packb(VALUE)
+    with pytest.raises(ValueError):
+        MsgpackCodec().decode(data)
@@ -0,0 +1,55 @@
+import pytest
+
+from lib.ingredient_grammar import parse_line, parse_number
+
+# The confidence parse_ingredients needs to skip the model, see [ingredient-parser] min_confidence.
+MIN_CONFIDENCE = 0.8
+
+
+@pytest.mark.parametrize("text, number", [
+    ("3", 3.0),
+    ("1/2", 0.5),
+    ("1 1/2", 1.5),
+    ("1-1/2", 1.5),
+    (".5", 0.5),
+    ("half", 0.5),
+    ("1/0", None),
+])
+def test_parse_number(text, number):
+    assert parse_number(text) == number
+
+
+@pytest.mark.parametrize("line, quantity, unit, name, notes", [
+    ("2 cups flour", 2.0, "cup", "flour", None),
+    ("1 ½ cups flour, sifted", 1.5, "cup", "flour", "sifted"),
+    ("1-1/2 cups milk", 1.5, "cup", "milk", None),
+    ("3-4 cloves garlic, minced", 4.0, "clove", "garlic", "3-4; minced"),
+    ("2 eggs", 2.0, "piece", "eggs", None),
+    ("12 oz. package chocolate chips", 1.0, "package", "chocolate chips", "12 oz."),
+    ("2 (15 oz) cans beans", 2.0, "can", "beans", "15 oz"),
+])
+def test_confident_lines(line, quantity, unit, name, notes):
+    parsed = parse_line(line)
+    assert (parsed.quantity, parsed.unit, parsed.canonical_name, parsed.extra_notes) == (quantity, unit, name, notes)
+    assert parsed.confidence >= MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("line", [
+    "a few sprigs thyme",
+    "a little olive oil",
+    "2 to 1 cups milk",
+    "salt and pepper to taste",
+    "1 can or 2 cups tomatoes",
+])
+def test_lines_left_to_the_model(line):
+    assert parse_line(line).confidence < MIN_CONFIDENCE
+
+
+def test_dozens():
+    assert parse_line("a dozen eggs").quantity == 12.0
+    assert parse_line("half a dozen eggs").quantity == 6.0
+
+
+def test_half_an_article():
+    parsed = parse_line("half an onion")
+    assert (parsed.quantity, parsed.canonical_name) == (0.5, "onion")
@@ -0,0 +1,43 @@
+import asyncio
+import json
+
+from lib.ingredient_parsing import IngredientParser
+from scripts.stub_completion_server import answer
+
+
+def _parser(prompts):
+    parser = IngredientParser(
+        model="test",
+        concurrency=4,
+        requests_per_minute=6000,
+        tokens_per_minute=1000000,
+        max_prompt_tokens=1500,
+        max_completion_tokens=2000,
+        pack_delay=0.01,
+    )
+
+    async def create_completion(prompt, max_tokens):
+        prompts.append(prompt)
+        return {"choices": [{"text": json.dumps(answer(prompt))}]}
+
+    parser._create_completion = create_completion
+    return parser
+
+
+def test_lines_of_one_recipe_asked_separately_in_one_pack():
+    prompts = []
+
+    async def ask():
+        parser = _parser(prompts)
+        return await asyncio.gather(
+            parser.parse(7, ["1 cup flour"]),
+            parser.parse(7, ["2 eggs"]),
+            parser.parse(8, ["1 tsp salt", "1 cup milk"]),
+        )
+
+    flour, eggs, salt_and_milk = asyncio.run(ask())
+
+    assert len(prompts) == 1
+    assert [parsed["canonical_name"] for parsed in flour] == ["1 cup flour"]
+    assert [parsed["canonical_name"] for parsed in eggs] == ["2 eggs"]
+    assert [parsed["canonical_name"] for parsed in salt_and_milk] == ["1 tsp salt", "1 cup milk"]
@@ -0,0 +1,99 @@
+import random
+import sys
+import threading
+
+import pytest
+
+from lib.near_duplicates import MinHasher, RedisLSH, recipe_tokens
+
+
+def test_recipe_tokens():
+    tokens = recipe_tokens("The Best Easy Banana Bread", ["2 cups flour", "3 ripe bananas", "1 tsp baking soda"])
+    assert tokens == {
+        "t:banana", "t:bread",
+        "i:flour", "i:ripe", "i:bananas", "i:baking", "i:soda",
+    }
+    assert recipe_tokens(None, None) == set()
+
+
+def test_signatures_are_deterministic():
+    tokens = {"t:banana", "i:flour"}
+    assert MinHasher(seed=3).signature(tokens) == MinHasher(seed=3).signature(tokens)
+    assert MinHasher(seed=3).signature(tokens) != MinHasher(seed=4).signature(tokens)
+    assert len(MinHasher(num_perm=64).signature(tokens)) == 64 * 8
+
+
+def test_similarity_estimates_jaccard():
+    hasher = MinHasher(num_perm=256)
+    rng = random.Random(0)
+    for shared in (0, 50, 80, 100):
+        first = {f"shared:{i}" for i in range(shared)} | {f"first:{i}" for i in range(100 - shared)}
+        second = {f"shared:{i}" for i in range(shared)} | {f"second:{i}" for i in range(100 - shared)}
+        jaccard = len(first & second) / len(first | second)
+        similarity = hasher.similarity(hasher.signature(rng.sample(sorted(first), len(first))), hasher.signature(second))
+        assert abs(similarity - jaccard) < 0.1
+
+
+def test_bands_must_divide_permutations():
+    with pytest.raises(ValueError):
+        RedisLSH(None, MinHasher(num_perm=100), bands=16)
+
+
+@pytest.fixture
+def cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis()
+
+
+def _signature(lsh: RedisLSH, *extra: str) -> bytes:
+    return lsh.hasher.signature(recipe_tokens(
+        "Chocolate cake",
+        ["2 cups flour", "1 cup sugar", "3 eggs", "cocoa powder", "butter", *extra],
+    ))
+
+
+def test_add_many(cache):
+    lsh = RedisLSH(cache, MinHasher())
+    matches = lsh.add_many([
+        ("a", _signature(lsh)),
+        ("b", _signature(lsh, "salt")),
+        ("c", lsh.hasher.signature({"t:soup", "i:leeks"})),
+    ])
+    assert [(match.url, match.canonical_url) for match in matches] == [("a", None), ("b", "a"), ("c", None)]
+    assert matches[1].similarity >= lsh.threshold
+    # Only canonical recipes are kept.
+    assert set(cache.hkeys(RedisLSH.SIGNATURES_KEY)) == {b"a", b"c"}
+
+    [match] = lsh.add_many([("d", _signature(lsh))])
+    assert (match.canonical_url, match.similarity) == ("a", 1.0)
+
+
+@pytest.fixture
+def switch_often():
+    # Switch threads as often as possible, so that their lookups interleave.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_workers_register_one_canonical(cache, switch_often):
+    lsh = RedisLSH(cache, MinHasher())
+    for cluster in range(20):
+        barrier = threading.Barrier(8)
+        matches = []
+
+        def add(url):
+            barrier.wait()
+            tokens = {f"i:cluster{cluster}x{i}" for i in range(20)}
+            matches.extend(lsh.add_many([(url, lsh.hasher.signature(tokens))]))
+
+        workers = [threading.Thread(target=add, args=(f"{cluster}-{i}",)) for i in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        canonical = [match.url for match in matches if match.canonical_url is None]
+        assert len(canonical) == 1
+        assert all(match.canonical_url in (None, canonical[0]) for match in matches)
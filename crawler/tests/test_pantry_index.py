@@ -0,0 +1,106 @@
+import random
+import typing
+
+import pytest
+
+from lib.pantry_index import PantryIndex
+
+INGREDIENTS = 60
+
+
+def _recipes(rng: random.Random, count: int) -> typing.Dict[int, typing.Set[int]]:
+    # A few common ingredients and a long tail, so postings are both dense and sparse.
+    weights = [1 / (i + 1) for i in range(INGREDIENTS)]
+    return {
+        recipe_id: set(rng.choices(range(INGREDIENTS), weights, k=rng.randint(1, 8)))
+        for recipe_id in rng.sample(range(10000), count)
+    }
+
+
+class _Session:
+
+    def __init__(self, recipes: typing.Dict[int, typing.Set[int]]):
+        self.rows = [
+            (recipe_id, ingredient_id) for recipe_id, ingredients in recipes.items() for ingredient_id in ingredients
+        ]
+
+    def execute(self, stmt):
+        return iter(self.rows)
+
+
+def _missing_at_most(recipes, pantry, k, allergens=()):
+    return sorted(
+        recipe_id for recipe_id, ingredients in recipes.items()
+        if len(ingredients - set(pantry)) <= k and not ingredients & set(allergens)
+    )
+
+
+def _containing_all(recipes, ingredient_ids, allergens=()):
+    return sorted(
+        recipe_id for recipe_id, ingredients in recipes.items()
+        if set(ingredient_ids) <= ingredients and not ingredients & set(allergens)
+    )
+
+
+def _check(index: PantryIndex, recipes, rng: random.Random):
+    assert len(index) == len(recipes)
+    for _ in range(50):
+        pantry = rng.sample(range(INGREDIENTS), rng.randint(0, INGREDIENTS))
+        allergens = rng.sample(range(INGREDIENTS), rng.randint(0, 2))
+        k = rng.randint(0, 3)
+        assert sorted(index.missing_at_most(pantry, k)) == _missing_at_most(recipes, pantry, k)
+        assert sorted(index.missing_at_most(pantry, k, allergens)) == _missing_at_most(recipes, pantry, k, allergens)
+        wanted = rng.sample(range(INGREDIENTS), rng.randint(1, 2))
+        assert sorted(index.containing_all(wanted, allergens)) == _containing_all(recipes, wanted, allergens)
+    counts = {}
+    for ingredients in recipes.values():
+        for ingredient_id in ingredients:
+            counts[ingredient_id] = counts.get(ingredient_id, 0) + 1
+    assert index.ingredient_counts() == counts
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_brute_force(seed):
+    rng = random.Random(seed)
+    recipes = _recipes(rng, 500)
+    index = PantryIndex.build(_Session(recipes))
+    assert any(isinstance(posting, int) for posting in index._postings.values())
+    assert any(not isinstance(posting, int) for posting in index._postings.values())
+    _check(index, recipes, rng)
+
+
+@pytest.mark.parametrize("cache_bytes", [0, 64 << 20])
+def test_matches_brute_force_after_changes(cache_bytes):
+    rng = random.Random(cache_bytes)
+    recipes = _recipes(rng, 500)
+    index = PantryIndex(cache_bytes=cache_bytes)
+    for recipe_id, ingredients in recipes.items():
+        index.set_recipe(recipe_id, ingredients)
+    _check(index, recipes, rng)
+
+    for recipe_id in rng.sample(sorted(recipes), 100):
+        del recipes[recipe_id]
+        index.remove_recipe(recipe_id)
+    for recipe_id, ingredients in _recipes(rng, 200).items():
+        recipes[recipe_id] = ingredients
+        index.set_recipe(recipe_id, ingredients)
+    _check(index, recipes, rng)
+
+
+def test_limit():
+    index = PantryIndex()
+    for recipe_id in range(10):
+        index.set_recipe(recipe_id, [1, 2])
+    assert index.missing_at_most([1, 2], 0, limit=3) == [0, 1, 2]
+    assert index.containing_all([1], limit=2) == [0, 1]
+
+
+def test_snapshot_round_trip(tmp_path):
+    rng = random.Random(0)
+    recipes = _recipes(rng, 500)
+    index = PantryIndex.build(_Session(recipes))
+    index.remove_recipe(next(iter(recipes)))
+    del recipes[next(iter(recipes))]
+    path = str(tmp_path / "pantry_index.msgpack")
+    index.save(path)
+    _check(PantryIndex.load(path), recipes, rng)
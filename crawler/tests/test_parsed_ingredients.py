@@ -0,0 +1,95 @@
+import msgpack
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from lib.parsed_ingredients import (
+    FORMAT_VERSION,
+    ParsedIngredient,
+    decode,
+    encode,
+    load_parsed_ingredients,
+    parsed_recipe_ids,
+    save_parse_failures,
+    save_parsed_ingredients,
+    validate,
+)
+
+FLOUR = {"quantity": "2", "unit": "cup", "canonical_name": " flour ", "extra_notes": ""}
+
+
+def test_validate():
+    assert validate(1, [FLOUR, {"quantity": None, "unit": "pinch", "canonical_name": "salt", "extra_notes": "to taste"}]) == [
+        ParsedIngredient(2.0, "cup", "flour", None),
+        ParsedIngredient(None, "pinch", "salt", "to taste"),
+    ]
+
+
+def test_validate_unwraps_a_dict():
+    salt = {"quantity": 1, "unit": "tsp", "canonical_name": "salt", "extra_notes": None}
+    assert validate(1, {"ingredients": [FLOUR, salt]}) == [
+        ParsedIngredient(2.0, "cup", "flour", None),
+        ParsedIngredient(1.0, "tsp", "salt", None),
+    ]
+
+
+@pytest.mark.parametrize("answer", [None, "flour", 3, [], {}])
+def test_validate_unusable_answers(answer):
+    assert validate(1, answer) == []
+
+
+def test_validate_drops_unusable_ingredients():
+    assert validate(1, [
+        {**FLOUR, "canonical_name": "  "},
+        {**FLOUR, "unit": None},
+        {**FLOUR, "colour": "white"},
+        {"canonical_name": "flour"},
+        {**FLOUR, "quantity": "a handful"},
+    ]) == [ParsedIngredient(None, "cup", "flour", None)]
+
+
+def test_round_trip():
+    ingredients = [ParsedIngredient(2.0, "cup", "flour", None), ParsedIngredient(None, "pinch", "salt", "to taste")]
+    assert decode(FORMAT_VERSION, encode(ingredients)) == ingredients
+    assert decode(FORMAT_VERSION, encode([])) == []
+    # Column by column.
+    assert msgpack.unpackb(encode(ingredients)) == [[2.0, None], ["cup", "pinch"], ["flour", "salt"], [None, "to taste"]]
+
+
+def test_decode_rejects_unknown_versions():
+    with pytest.raises(ValueError):
+        decode(FORMAT_VERSION + 1, encode([]))
+
+
+class _Session:
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, stmt):
+        self.statements.append(str(stmt.compile(dialect=postgresql.dialect())))
+
+
+def test_nothing_to_do():
+    session = _Session()
+    assert parsed_recipe_ids(session, []) == set()
+    assert load_parsed_ingredients(session, iter([])) == dict()
+    save_parsed_ingredients(session, dict())
+    save_parse_failures(session, [])
+    assert session.statements == []
+
+
+def test_failures_never_replace_parsed_ingredients():
+    session = _Session()
+    save_parse_failures(session, [3, 1, 3])
+    [stmt] = session.statements
+    assert "ON CONFLICT (recipe_id) DO UPDATE" in stmt
+    assert stmt.endswith("WHERE parsed_ingredients.retry_after IS NOT NULL")
+
+
+@pytest.mark.parametrize("overwrite", [True, False])
+def test_save_parsed_ingredients(overwrite):
+    session = _Session()
+    save_parsed_ingredients(session, {1: [ParsedIngredient(2.0, "cup", "flour", None)]}, overwrite=overwrite)
+    [stmt] = session.statements
+    assert "ON CONFLICT (recipe_id) DO UPDATE" in stmt
+    assert stmt.endswith("WHERE parsed_ingredients.retry_after IS NOT NULL") != overwrite
@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+import aiokafka
+
+from crawler.politeness import HostScheduler, TokenBucket, parse_retry_after
+from crawler.queue_processors import QueueProcessor, WorkItem
+
+
+def _scheduler(**kwargs) -> HostScheduler:
+    options = dict(
+        key=lambda item: item["host"],
+        rate=1000.0,
+        burst=1000.0,
+        max_concurrency=100,
+        min_rate=0.05,
+        max_pending_per_host=4,
+        max_size=1000,
+    )
+    options.update(kwargs)
+    return HostScheduler(**options)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2.0, capacity=2.0, clock=lambda: now[0])
+    assert bucket.try_consume() == 0.0
+    assert bucket.try_consume() == 0.0
+    assert bucket.try_consume() == 0.5
+    now[0] = 0.5
+    assert bucket.try_consume() == 0.0
+    assert not bucket.is_full()
+
+
+def test_qsize_counts_at_most_max_pending_per_host():
+    scheduler = _scheduler()
+    for i in range(100):
+        scheduler.put_nowait({"host": "a", "i": i})
+    assert scheduler.qsize() == 4
+    scheduler.put_nowait({"host": "b", "i": 0})
+    assert scheduler.qsize() == 5
+
+
+def test_qsize_is_the_total_past_max_size():
+    scheduler = _scheduler(max_size=50)
+    for i in range(50):
+        scheduler.put_nowait({"host": "a", "i": i})
+    assert scheduler.qsize() == 50
+
+
+def test_throttled_host_does_not_hold_up_others():
+    scheduler = _scheduler()
+
+    async def run():
+        scheduler.put_nowait({"host": "a", "i": 0})
+        first = await scheduler.get()
+        scheduler.release("a", 429, "60")
+        for i in range(1, 100):
+            scheduler.put_nowait({"host": "a", "i": i})
+        for i in range(3):
+            scheduler.put_nowait({"host": "b", "i": i})
+        return first, [await asyncio.wait_for(scheduler.get(), timeout=1) for _ in range(3)]
+
+    first, flowing = asyncio.run(run())
+    assert first == {"host": "a", "i": 0}
+    assert flowing == [{"host": "b", "i": i} for i in range(3)]
+    assert scheduler.qsize() == 4
+
+
+class _Record:
+
+    def __init__(self, offset: int, value: bytes):
+        self.offset = offset
+        self.value = value
+
+
+class _Consumer:
+    """
+    Hands out the records of one partition, unless paused.
+    """
+
+    def __init__(self, values):
+        self.partition = aiokafka.TopicPartition("links", 0)
+        self.records = [_Record(offset, json.dumps(value).encode('utf-8')) for offset, value in enumerate(values)]
+        self.paused_partitions = set()
+
+    def assignment(self):
+        return {self.partition}
+
+    def pause(self, *partitions):
+        self.paused_partitions.update(partitions)
+
+    def resume(self, *partitions):
+        self.paused_partitions.difference_update(partitions)
+
+    def paused(self):
+        return set(self.paused_partitions)
+
+    async def getmany(self, timeout_ms: int, max_records: int):
+        if self.partition in self.paused_partitions or not self.records:
+            await asyncio.sleep(timeout_ms / 1000)
+            return {}
+        records, self.records = self.records[:max_records], self.records[max_records:]
+        return {self.partition: records}
+
+
+def test_consumer_keeps_reading_past_a_throttled_host():
+    values = [{"host": "a", "i": i} for i in range(200)] + [{"host": "b", "i": i} for i in range(3)]
+    consumer = _Consumer(values)
+
+    class Processor(QueueProcessor):
+        read_topic = "links"
+        max_pending = 16
+
+        def create_work_queue(self):
+            return _scheduler(key=lambda item: item.message["host"])
+
+    processor = Processor()
+    processor._consumer = consumer
+
+    async def run():
+        processor._queue = processor.create_work_queue()
+        processor._room_available = asyncio.Event()
+        processor._queue.put_nowait(WorkItem(consumer.partition, -1, {"host": "a", "i": -1}))
+        await processor._queue.get()
+        processor._queue.release("a", 503, "60")
+
+        consuming = asyncio.ensure_future(processor._consume())
+        try:
+            return [(await asyncio.wait_for(processor._queue.get(), timeout=5)).message for _ in range(3)]
+        finally:
+            consuming.cancel()
+            await asyncio.gather(consuming, return_exceptions=True)
+
+    assert asyncio.run(run()) == [{"host": "b", "i": i} for i in range(3)]
+    assert not consumer.records